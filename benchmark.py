@@ -0,0 +1,355 @@
+"""Benchmark harness for the media organizer.
+
+Generates a synthetic media tree and runs organize_media on it in dry-run,
+move and copy modes, each in a fresh interpreter so that peak memory is
+measured per run. Results are printed (or written) as JSON so they can be
+compared between commits:
+
+    python benchmark.py --files 100k --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCHMARK_VERSION = 1
+MODES = ('dry-run', 'move', 'copy', 'warm-cache')
+DEFAULT_MODES = ('dry-run', 'move', 'copy')
+
+# Kinds of generated files and their share of the corpus
+CORPUS_MIX = (
+    ('jpeg_exif', 0.40),
+    ('jpeg_plain', 0.10),
+    ('raw_tiff', 0.10),
+    ('mp4', 0.15),
+    ('mov', 0.10),
+    ('png_plain', 0.05),
+    ('no_metadata', 0.10),
+)
+
+# Seconds between the ISO base media epoch (1904) and the Unix epoch
+BMFF_EPOCH_OFFSET = 2082844800
+
+# Names shared by colliding files, e.g. several cameras restarting at IMG_0001
+COLLIDING_NAMES = 50
+FIRST_DATE = datetime(2019, 1, 1)
+DAYS = 730
+
+# Stage of the report each Metrics step is summed into; other steps are
+# metadata lookups (header readers, fallbacks, cache lookups, mtime)
+STAGE_OF_STEP = {
+    'discovery': 'discovery',
+    'destination': 'planning',
+    'dedupe_scan': 'planning',
+    'dedupe': 'planning',
+    'resolve_duplicates': 'planning',
+    'mkdir': 'transfer',
+    'transfer': 'transfer',
+}
+
+
+def parse_count(value):
+    """Parse a file count such as 10000, 10k or 1M."""
+    multipliers = {'k': 1000, 'm': 1000000}
+    suffix = value[-1:].lower()
+    try:
+        if suffix in multipliers:
+            return int(float(value[:-1]) * multipliers[suffix])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid file count: {value}") from None
+
+
+def _tiff_with_date(date):
+    """Little-endian TIFF block with DateTimeOriginal in an Exif IFD."""
+    date_bytes = date.strftime('%Y:%m:%d %H:%M:%S').encode() + b'\0'
+    ifd0 = 8
+    exif_ifd = ifd0 + 2 + 12 + 4
+    date_offset = exif_ifd + 2 + 12 + 4
+    return (b'II*\0' + struct.pack('<I', ifd0)
+            + struct.pack('<H', 1) + struct.pack('<HHII', 0x8769, 4, 1, exif_ifd) + struct.pack('<I', 0)
+            + struct.pack('<H', 1) + struct.pack('<HHII', 0x9003, 2, len(date_bytes), date_offset)
+            + struct.pack('<I', 0) + date_bytes)
+
+
+def _jpeg(payload, date=None):
+    data = b'\xff\xd8'
+    if date is not None:
+        app1 = b'Exif\0\0' + _tiff_with_date(date)
+        data += b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+    else:
+        app0 = b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0'
+        data += b'\xff\xe0' + struct.pack('>H', len(app0) + 2) + app0
+    # Start of scan followed by stand-in image data
+    return data + b'\xff\xda\0\x02' + payload + b'\xff\xd9'
+
+
+def _box(box_type, payload):
+    return struct.pack('>I', len(payload) + 8) + box_type + payload
+
+
+def _bmff(payload, date, brand):
+    created = int((date - datetime(1970, 1, 1)).total_seconds()) + BMFF_EPOCH_OFFSET
+    mvhd = struct.pack('>IIIII', 0, created, created, 1000, 1000) + bytes(80)
+    return (_box(b'ftyp', brand + b'\0\0\0\0' + brand)
+            + _box(b'moov', _box(b'mvhd', mvhd))
+            + _box(b'mdat', payload))
+
+
+def _png(payload):
+    ihdr = struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0)
+    chunk = struct.pack('>I', len(ihdr)) + b'IHDR' + ihdr + b'\0\0\0\0'
+    data = struct.pack('>I', len(payload)) + b'IDAT' + payload + b'\0\0\0\0'
+    return b'\x89PNG\r\n\x1a\n' + chunk + data + b'\0\0\0\0IEND\xaeB`\x82'
+
+
+def _make_file(kind, payload, date, rng):
+    """Return (extension, content) for a generated file of the given kind."""
+    if kind == 'jpeg_exif':
+        return '.jpg', _jpeg(payload, date)
+    if kind == 'jpeg_plain':
+        return '.jpg', _jpeg(payload)
+    if kind == 'raw_tiff':
+        return rng.choice(('.dng', '.arw')), _tiff_with_date(date) + payload
+    if kind == 'mp4':
+        return '.mp4', _bmff(payload, date, b'isom')
+    if kind == 'mov':
+        return '.mov', _bmff(payload, date, b'qt  ')
+    if kind == 'png_plain':
+        return '.png', _png(payload)
+    return rng.choice(('.txt', '.xmp', '.thm')), payload
+
+
+def generate_corpus(root, files, depth=6, collision_rate=0.3, payload_size=4096, seed=0):
+    """Write a synthetic media tree below `root` and describe it.
+
+    Files are spread over nested directories up to `depth` levels deep; a
+    `collision_rate` share of them reuse a small pool of names, so many land
+    on the same destination name. Capture dates fall within two years and
+    are also used as modification times.
+    """
+    rng = random.Random(seed)
+    kinds = [kind for kind, _ in CORPUS_MIX]
+    weights = [weight for _, weight in CORPUS_MIX]
+    directories = []
+    for _ in range(max(1, files // 100)):
+        parts = [f"d{rng.randrange(8)}" for _ in range(rng.randint(1, depth))]
+        directories.append(os.path.join(root, *parts))
+
+    counts = dict.fromkeys(kinds, 0)
+    total_bytes = 0
+    start = time.perf_counter()
+    made = set()
+    for index in range(files):
+        kind = rng.choices(kinds, weights)[0]
+        date = FIRST_DATE + timedelta(days=rng.randrange(DAYS), seconds=rng.randrange(86400))
+        payload = rng.getrandbits(64).to_bytes(8, 'little') * (payload_size // 8)
+        extension, content = _make_file(kind, payload, date, rng)
+        if rng.random() < collision_rate:
+            name = f"IMG_{rng.randrange(COLLIDING_NAMES):04d}"
+        else:
+            name = f"IMG_{index:07d}"
+
+        directory = rng.choice(directories)
+        if directory not in made:
+            os.makedirs(directory, exist_ok=True)
+            made.add(directory)
+        path = os.path.join(directory, name + extension)
+        if os.path.exists(path):
+            path = os.path.join(directory, f"{name}_{index}{extension}")
+        with open(path, 'wb') as f:
+            f.write(content)
+        timestamp = date.timestamp()
+        os.utime(path, (timestamp, timestamp))
+
+        counts[kind] += 1
+        total_bytes += len(content)
+
+    return {
+        'files': files,
+        'bytes': total_bytes,
+        'directories': len(made),
+        'kinds': counts,
+        'depth': depth,
+        'collision_rate': collision_rate,
+        'seed': seed,
+        'generate_seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def link_tree(source, target):
+    """Recreate a tree with hard links, so a run can move files without touching the corpus."""
+    for parent, _, names in os.walk(source):
+        destination = os.path.join(target, os.path.relpath(parent, source))
+        os.makedirs(destination, exist_ok=True)
+        for name in names:
+            os.link(os.path.join(parent, name), os.path.join(destination, name))
+
+
+def metrics_stages(metrics):
+    """Sum the steps timed in a Metrics into discovery, lookup, planning and transfer seconds.
+
+    Steps run by several workers at once are summed over the workers, so
+    stages can add up to more than the run's wall-clock time.
+    """
+    stages = dict.fromkeys(('discovery', 'lookup', 'planning', 'transfer'), 0.0)
+    for step, histogram in metrics.to_dict()['stages'].items():
+        stages[STAGE_OF_STEP.get(step, 'lookup')] += histogram['total']
+    return stages
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_child(mode, tree, workers, executor):
+    """Measure one mode in this process and return its results."""
+    import logging
+    import script_v2
+    from discovery import walk_files
+    from metadata_cache import MetadataCache
+    from metrics import Metrics
+
+    logging.getLogger().setLevel(logging.WARNING)
+    result = {'mode': mode}
+
+    if mode == 'stages':
+        count, seconds = _timed(lambda: sum(1 for _ in walk_files(tree, classify=script_v2.classify)))
+        result['files'] = count
+        result['stages'] = {'discovery': seconds}
+        records = walk_files(tree, classify=script_v2.classify)
+        _, total = _timed(lambda: sum(
+            1 for _ in script_v2.iter_creation_dates(records, workers, executor)))
+        result['stages']['discovery_and_extraction'] = total
+        result['stages']['extraction'] = max(0.0, total - result['stages']['discovery'])
+    else:
+        cache = None
+        if mode == 'warm-cache':
+            cache_dir = tempfile.mkdtemp(prefix='media-bench-cache-')
+            cache = MetadataCache(os.path.join(cache_dir, 'metadata.sqlite'))
+            # First pass fills the cache; only the second one is measured
+            script_v2.organize_media(tree, dry_run=True, workers=workers, executor=executor, cache=cache)
+            cache.flush()
+            cache.hits = cache.misses = 0
+        # Steps are timed as in --metrics-out; nothing else is kept per file
+        metrics = Metrics(slowest=0)
+        stats, total = _timed(script_v2.organize_media, tree, copy=(mode == 'copy'),
+                              dry_run=mode in ('dry-run', 'warm-cache'),
+                              workers=workers, executor=executor, cache=cache, metrics=metrics)
+        if cache is not None:
+            cache.close()
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        result['files'] = stats.get('discovered', 0)
+        result['stages'] = metrics_stages(metrics)
+        result['stats'] = stats
+
+    result['seconds'] = round(total, 3)
+    result['files_per_sec'] = round(result['files'] / total, 1) if total else None
+    result['stages'] = {stage: round(seconds, 3) for stage, seconds in result['stages'].items()}
+    result['peak_rss_mb'] = script_v2.peak_rss_mb()
+    return result
+
+
+def _run_in_subprocess(mode, tree, args):
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode, tree,
+               '--workers', str(args.workers), '--executor', args.executor]
+    completed = subprocess.run(command, stdout=subprocess.PIPE,
+                               stderr=None if args.verbose else subprocess.DEVNULL,
+                               universal_newlines=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix='media-bench-', dir=args.work_dir)
+    corpus_dir = os.path.join(work_dir, 'corpus')
+    try:
+        print(f"Generating {args.files} files in {corpus_dir}", file=sys.stderr)
+        corpus = generate_corpus(corpus_dir, args.files, args.depth, args.collision_rate,
+                                 args.payload_size, args.seed)
+
+        results = [_run_in_subprocess('stages', corpus_dir, args)]
+        for mode in args.modes:
+            print(f"Running {mode}", file=sys.stderr)
+            if mode in ('move', 'copy'):
+                tree = os.path.join(work_dir, mode)
+                link_tree(corpus_dir, tree)
+            else:
+                tree = corpus_dir
+            try:
+                results.append(_run_in_subprocess(mode, tree, args))
+            finally:
+                if tree != corpus_dir:
+                    shutil.rmtree(tree, ignore_errors=True)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'version': BENCHMARK_VERSION,
+        'commit': _git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'executor': args.executor,
+        'corpus': corpus,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark organize_media on a synthetic media tree.')
+    parser.add_argument('--files', type=parse_count, default=10000,
+                        help='Number of files to generate, e.g. 10k, 100k or 1M (default: 10k)')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(DEFAULT_MODES),
+                        help='Modes to measure (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1, help='Metadata extraction workers')
+    parser.add_argument('--executor', choices=('thread', 'process', 'isolated'), default='thread',
+                        help='Worker pool type used with --workers')
+    parser.add_argument('--depth', type=int, default=6, help='Maximum directory nesting')
+    parser.add_argument('--collision-rate', type=float, default=0.3,
+                        help='Share of files drawing from a small pool of names')
+    parser.add_argument('--payload-size', type=int, default=4096, help='Stand-in media bytes per file')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the corpus')
+    parser.add_argument('--work-dir', help='Where to create the corpus (default: system temp directory)')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated corpus')
+    parser.add_argument('--output', '-o', help='Write JSON results to this file instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the measured runs')
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'TREE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child[0], args.child[1], args.workers, args.executor)))
+        return
+
+    report = run_benchmark(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Byte-identical duplicate detection with size bucketing and staged hashing."""
+import hashlib
+import logging
+import mmap
+import os
+
+DEDUPE_MODES = ('off', 'report', 'skip', 'hardlink')
+
+# Bytes hashed at the start and at the end of a file in the partial stage
+PARTIAL_BLOCK_SIZE = 64 * 1024
+
+
+def content_hasher():
+    """The hash used for file contents; verified copies record the same digest."""
+    return hashlib.blake2b(digest_size=20)
+
+
+def partial_hash(path, size):
+    """Hash the first and last block of a file (the whole file if it is small)."""
+    digest = content_hasher()
+    with open(path, 'rb') as f:
+        if size <= 2 * PARTIAL_BLOCK_SIZE:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(PARTIAL_BLOCK_SIZE))
+            f.seek(-PARTIAL_BLOCK_SIZE, os.SEEK_END)
+            digest.update(f.read(PARTIAL_BLOCK_SIZE))
+    return digest.digest()
+
+
+def full_hash(path, size=None):
+    """Hash a whole file through a read-only memory map."""
+    digest = content_hasher()
+    with open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        except (ValueError, OSError):
+            # Empty files and filesystems without mmap support
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.digest()
+
+
+def _file_key(path, stat_result):
+    """Identify a file by (device, inode), or by path where inodes are unavailable."""
+    if stat_result.st_ino:
+        return stat_result.st_dev, stat_result.st_ino
+    return path
+
+
+class DuplicateFinder:
+    """Finds an already known file with the same content as a new one.
+
+    Known files are bucketed by size, so a file whose size is unique is never
+    read. When sizes match, hashes of the first and last blocks are compared,
+    and only files whose partial hashes also match are hashed in full.
+    Digests are cached per (device, inode), so each file is read at most once
+    per stage even after it has been moved.
+
+    Known files are those added after being planned, plus the existing
+    contents of every destination directory passed to scan_directory.
+    Identical files carry identical embedded dates, so they resolve to the
+    same destination directory; scanning those directories as they are
+    first used covers the destination tree without walking all of it.
+    `digests` is an optional callable returning the known full digest of a
+    scanned file from its path and stat, e.g. Manifest.checksum, so files
+    that arrived through a verified copy are not read again.
+    """
+
+    def __init__(self, digests=None):
+        self.bytes_hashed = 0
+        self._digests = digests
+        self._by_size = {}
+        self._partial = {}
+        self._full = {}
+        self._scanned = set()
+
+    def add(self, paths, stat_result):
+        """Register a file whose content new files are compared against.
+
+        `paths` lists where the file can be found, in order of preference,
+        e.g. its current location and the destination it is planned to move
+        to; whichever exists when the file is read is used.
+        """
+        if isinstance(paths, (str, os.PathLike)):
+            paths = (paths,)
+        paths = tuple(os.fspath(path) for path in paths)
+        if stat_result.st_size:
+            self._by_size.setdefault(stat_result.st_size, []).append(
+                (paths, _file_key(paths[0], stat_result)))
+
+    def scan_directory(self, directory):
+        """Register the files already present in a destination directory, once."""
+        directory = os.fspath(directory)
+        if directory in self._scanned:
+            return
+        self._scanned.add(directory)
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                        stat_result = entry.stat(follow_symlinks=False)
+                        self.add(entry.path, stat_result)
+                        if self._digests is not None:
+                            self._seed(entry.path, stat_result)
+        except FileNotFoundError:
+            pass
+
+    def _seed(self, path, stat_result):
+        digest = self._digests(path, stat_result)
+        if digest is not None:
+            key = _file_key(path, stat_result)
+            self._full[key] = digest
+            # The partial stage hashes small files in full
+            if stat_result.st_size <= 2 * PARTIAL_BLOCK_SIZE:
+                self._partial[key] = digest
+
+    def _hash(self, digests, func, paths, key, size, cost):
+        digest = digests.get(key)
+        if digest is not None:
+            return digest
+        for path in paths:
+            try:
+                digest = digests[key] = func(path, size)
+            except FileNotFoundError:
+                continue
+            self.bytes_hashed += cost
+            return digest
+        raise FileNotFoundError(f"None of {', '.join(paths)} exists")
+
+    def _partial_hash(self, paths, key, size):
+        return self._hash(self._partial, partial_hash, paths, key, size,
+                          min(size, 2 * PARTIAL_BLOCK_SIZE))
+
+    def _full_hash(self, paths, key, size):
+        return self._hash(self._full, full_hash, paths, key, size, size)
+
+    def find(self, path, stat_result):
+        """Return the locations of a known file identical to `path`, or None."""
+        paths = (os.fspath(path),)
+        key = _file_key(paths[0], stat_result)
+        size = stat_result.st_size
+        candidates = self._by_size.get(size)
+        if not candidates:
+            return None
+
+        partial = self._partial_hash(paths, key, size)
+        for candidate, candidate_key in candidates:
+            # The same file seen through another name is not a duplicate
+            if candidate_key == key:
+                continue
+            try:
+                if self._partial_hash(candidate, candidate_key, size) != partial:
+                    continue
+                # Small files were hashed in full by the partial stage
+                if size <= 2 * PARTIAL_BLOCK_SIZE:
+                    return candidate
+                if self._full_hash(candidate, candidate_key, size) == self._full_hash(paths, key, size):
+                    return candidate
+            except OSError as e:
+                logging.warning(f"Could not compare {path} with {candidate[0]}: {e}")
+        return None
@@ -0,0 +1,104 @@
+"""In-memory index of destination directories for resolving name collisions."""
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+# Directories whose names are kept in memory at once during a real run
+DEFAULT_MAX_DIRECTORIES = 4096
+
+
+def is_case_sensitive(directory):
+    """Tell whether file names under `directory` are case sensitive."""
+    directory = os.path.abspath(directory)
+    name = os.path.basename(directory)
+    swapped = os.path.join(os.path.dirname(directory), name.swapcase())
+    if name == name.swapcase():
+        return os.path.normcase('A') != os.path.normcase('a')
+    try:
+        return not os.path.samefile(directory, swapped)
+    except OSError:
+        return True
+
+
+class _DirectoryState:
+    __slots__ = ('names', 'next_counter')
+
+    def __init__(self, names):
+        self.names = names
+        self.next_counter = {}
+
+
+class DestinationIndex:
+    """Names present in destination directories, loaded lazily once per directory.
+
+    Collisions are resolved like handle_duplicate ("name (1).ext", "name (2).ext",
+    ...), but from an in-memory name set with the next free counter remembered
+    per base name, so the Nth duplicate costs O(1) instead of N stat calls.
+    Names handed out are recorded, so a dry run resolves duplicates exactly
+    like a real run would.
+
+    With `max_directories` set, the least recently used directories are
+    dropped and re-listed from disk when needed again; this is only correct
+    when resolved names are actually written, i.e. not in a dry run.
+    """
+
+    def __init__(self, base_dir, max_directories=None):
+        self.max_directories = max_directories
+        self._fold = (lambda name: name) if is_case_sensitive(base_dir) else str.lower
+        self._dirs = OrderedDict()
+
+    def _state(self, directory):
+        key = os.fspath(directory)
+        state = self._dirs.get(key)
+        if state is not None:
+            self._dirs.move_to_end(key)
+            return state
+
+        try:
+            with os.scandir(key) as it:
+                state = _DirectoryState({self._fold(entry.name) for entry in it})
+        except FileNotFoundError:
+            state = _DirectoryState(set())
+        self._dirs[key] = state
+        if self.max_directories and len(self._dirs) > self.max_directories:
+            self._dirs.popitem(last=False)
+        return state
+
+    def _base_name(self, stem, suffix):
+        """Return the base name without any " (N)" and the key its counter is kept under."""
+        # Remove existing counter if present
+        if ' (' in stem:
+            stem = stem.rsplit(' (', 1)[0]
+        return stem, (self._fold(stem), self._fold(suffix))
+
+    def resolve(self, dest_path):
+        """Return a free path for `dest_path` and reserve it."""
+        dest_path = Path(dest_path)
+        state = self._state(dest_path.parent)
+        name = dest_path.name
+        if self._fold(name) in state.names:
+            base_name, key = self._base_name(dest_path.stem, dest_path.suffix)
+            counter = state.next_counter.get(key, 1)
+            name = f"{base_name} ({counter}){dest_path.suffix}"
+            while self._fold(name) in state.names:
+                counter += 1
+                name = f"{base_name} ({counter}){dest_path.suffix}"
+            state.next_counter[key] = counter + 1
+        state.names.add(self._fold(name))
+        return dest_path.parent / name
+
+    def discard(self, path):
+        """Forget a name after its file was moved out of an indexed directory."""
+        parent, name = os.path.split(os.fspath(path))
+        state = self._dirs.get(parent)
+        if state is not None:
+            state.names.discard(self._fold(name))
+            # A lower counter may be free again for this base name
+            state.next_counter.pop(self._base_name(*os.path.splitext(name))[1], None)
+
+    def note(self, path):
+        """Record a name that appeared in an indexed directory from outside the run."""
+        parent, name = os.path.split(os.fspath(path))
+        state = self._dirs.get(parent)
+        if state is not None:
+            state.names.add(self._fold(name))
@@ -0,0 +1,208 @@
+"""Streaming file discovery built on os.scandir.
+
+Files are yielded as compact FileRecord objects while the tree is still
+being walked, so processing can start on the first file and the stat result
+taken during discovery is reused by everything downstream. Directories are
+read incrementally and only a bounded number of records is ever queued, so
+memory does not grow with the number of files in the tree.
+"""
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+# Discovered files buffered ahead of the processing stage
+DEFAULT_QUEUE_SIZE = 1024
+# Directory entries sorted by inode at a time, so huge directories stay bounded
+INODE_SORT_CHUNK = 4096
+
+_DONE = object()
+
+
+class FileRecord:
+    """Compact description of a discovered file.
+
+    All files of a directory share one parent string. The stat fields use the
+    os.stat_result attribute names, so a record can be passed wherever a stat
+    fingerprint is expected (e.g. MetadataCache.get). `category` is a small
+    integer code assigned by the walker's classify function.
+    """
+
+    __slots__ = ('parent', 'name', 'category', 'st_dev', 'st_ino', 'st_size', 'st_mtime', 'st_mtime_ns')
+
+    def __init__(self, parent, name, stat_result, category=0):
+        self.parent = parent
+        self.name = name
+        self.category = category
+        self.st_dev = stat_result.st_dev
+        self.st_ino = stat_result.st_ino
+        self.st_size = stat_result.st_size
+        self.st_mtime = stat_result.st_mtime
+        self.st_mtime_ns = stat_result.st_mtime_ns
+
+    @property
+    def path(self):
+        return os.path.join(self.parent, self.name)
+
+    def __repr__(self):
+        return f"FileRecord({self.path!r})"
+
+
+class DiscoveryGuard:
+    """Hides files placed during a run from a walker that is still running.
+
+    Organizing into the directory being walked means a moved or copied file
+    can land in a folder the walker has not finished listing. Destinations
+    are reserved before the file is written; names reserved in a directory
+    before or while it is listed are skipped, and a directory whose listing
+    has completed cannot see later additions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scanned = set()
+        self._placed = {}
+
+    def reserve(self, dest_path):
+        """Record a destination before anything is written there."""
+        parent, name = os.path.split(os.fspath(dest_path))
+        with self._lock:
+            if parent not in self._scanned:
+                self._placed.setdefault(parent, set()).add(name)
+
+    def begin_scan(self, path):
+        """Return the live set of names placed in `path`, to be skipped while listing it."""
+        with self._lock:
+            return self._placed.setdefault(path, set())
+
+    def end_scan(self, path):
+        with self._lock:
+            self._placed.pop(path, None)
+            self._scanned.add(sys.intern(path))
+
+
+def _record(path, entry, classify):
+    category = classify(entry.name) if classify is not None else 0
+    return FileRecord(path, entry.name, entry.stat(), category)
+
+
+def _in_inode_order(path, files, classify):
+    """Yield records for a list of (inode, DirEntry) pairs in inode order, emptying it."""
+    files.sort(key=lambda item: item[0])
+    for _, entry in files:
+        try:
+            yield _record(path, entry, classify)
+        except OSError as e:
+            logging.warning(f"Could not stat {entry.path}: {e}")
+    files.clear()
+
+
+def walk_files(directory, guard=None, classify=None, prune=None, order_by_inode=False, exclude=()):
+    """Yield a FileRecord for every file below `directory`, depth first.
+
+    Like Path.rglob('*'), symlinked directories are not followed while
+    symlinks to files are yielded. `classify` maps a file name to the
+    record's category code. `prune` is called with the path and st_mtime_ns
+    of every subdirectory; subdirectories it returns True for are skipped.
+    Files named in `exclude` are not yielded. With `order_by_inode`, the
+    files of each directory are listed in chunks of INODE_SORT_CHUNK, and
+    each chunk is statted and yielded in inode order, which keeps a spinning
+    disk's head moving in one direction.
+    """
+    stack = [os.fspath(directory)]
+    while stack:
+        path = stack.pop()
+        placed = guard.begin_scan(path) if guard is not None else ()
+        subdirs = []
+        files = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if prune is None or not prune(entry.path, entry.stat(follow_symlinks=False).st_mtime_ns):
+                                subdirs.append(entry.path)
+                        elif entry.name not in placed and entry.name not in exclude and entry.is_file():
+                            if order_by_inode:
+                                # Inode numbers come with the directory listing on POSIX
+                                files.append((entry.inode(), entry))
+                                if len(files) >= INODE_SORT_CHUNK:
+                                    yield from _in_inode_order(path, files, classify)
+                            else:
+                                yield _record(path, entry, classify)
+                    except OSError as e:
+                        logging.warning(f"Could not stat {entry.path}: {e}")
+        except OSError as e:
+            logging.warning(f"Could not scan {path}: {e}")
+        finally:
+            if guard is not None:
+                guard.end_scan(path)
+        yield from _in_inode_order(path, files, classify)
+        stack.extend(reversed(subdirs))
+
+
+class Discovery:
+    """Runs walk_files on a background thread and feeds a bounded queue.
+
+    Iterating yields records as soon as they are found; `discovered` counts
+    the files found so far and `finished` tells whether the walk is complete.
+    `seconds` is how long the complete walk took.
+    """
+
+    def __init__(self, directory, guard=None, classify=None, maxsize=DEFAULT_QUEUE_SIZE, prune=None,
+                 order_by_inode=False, exclude=()):
+        self.directory = directory
+        self.guard = guard
+        self.classify = classify
+        self.prune = prune
+        self.order_by_inode = order_by_inode
+        self.exclude = exclude
+        self.discovered = 0
+        self.finished = False
+        self.seconds = None
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _walk(self):
+        start = time.perf_counter()
+        try:
+            for record in walk_files(self.directory, self.guard, self.classify, self.prune,
+                                     self.order_by_inode, self.exclude):
+                self.discovered += 1
+                if not self._put(record):
+                    return
+            self.seconds = time.perf_counter() - start
+            self._put(_DONE)
+        except BaseException as e:
+            self._put(e)
+
+    def __iter__(self):
+        self._thread = threading.Thread(target=self._walk, name='discovery', daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    self.finished = True
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the walker thread, e.g. when processing ends early."""
+        self._stop.set()
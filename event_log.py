@@ -0,0 +1,152 @@
+"""Structured event log written off the processing thread.
+
+Per-file events are appended to an in-memory queue and a background thread
+writes them to a JSON Lines file in batches, so the processing loop never
+waits for the disk. Events below WARNING can be sampled, and in summary-only
+mode only the final summary is written. queued_logging() does the same for
+the standard logging handlers: the logging thread only queues the record,
+and a listener thread formats and prints it.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+# Events written per batch, and seconds the writer waits for a batch to fill
+BATCH_SIZE = 1000
+FLUSH_INTERVAL = 0.5
+# Events kept in memory before new ones are dropped rather than waited for
+MAX_PENDING = 100000
+
+LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING,
+          'error': logging.ERROR}
+
+
+class EventLog:
+    """Batched JSON Lines writer of per-file events.
+
+    emit() may be called from any thread and never blocks: events below
+    `level` are ignored, a fraction `sample` of the remaining events below
+    WARNING is kept, and events arriving while MAX_PENDING are waiting are
+    dropped and counted in `dropped`. With `summary_only`, only the record
+    passed to close() is written.
+    """
+
+    def __init__(self, path, level=logging.INFO, sample=1.0, summary_only=False):
+        if not 0 < sample <= 1:
+            raise ValueError(f"Sample rate must be in (0, 1], got {sample}")
+        self.path = path
+        self.level = level
+        self.sample = sample
+        self.summary_only = summary_only
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self._credit = 0.0
+        self._pending = deque()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._f = open(path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._write_loop, name='event-log-writer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def wants(self, level):
+        """Tell whether an event of this level would be kept; counts sampled-out events."""
+        if self.summary_only or level < self.level:
+            return False
+        if level < logging.WARNING and self.sample < 1:
+            # Keeps every 1/sample-th event, without the cost of random numbers
+            self._credit += self.sample
+            if self._credit < 1:
+                self.sampled_out += 1
+                return False
+            self._credit -= 1
+        return True
+
+    def emit(self, level, event):
+        """Queue an event (a JSON-serializable dict) if wants(level)."""
+        if not self.wants(level):
+            return
+        if len(self._pending) >= MAX_PENDING:
+            self.dropped += 1
+            return
+        event['t'] = round(time.time(), 3)
+        event['level'] = logging.getLevelName(level)
+        self._pending.append(event)
+        if len(self._pending) >= BATCH_SIZE:
+            self._wakeup.set()
+
+    def _write_batch(self):
+        batch = []
+        while self._pending and len(batch) < BATCH_SIZE:
+            batch.append(self._pending.popleft())
+        if batch:
+            self._f.write(''.join(json.dumps(event, default=str) + '\n' for event in batch))
+            self._f.flush()
+            self.written += len(batch)
+        return len(batch)
+
+    def _write_loop(self):
+        while not self._closed:
+            self._wakeup.wait(FLUSH_INTERVAL)
+            self._wakeup.clear()
+            while self._write_batch() == BATCH_SIZE:
+                pass
+
+    def close(self, summary=None):
+        """Write the remaining events and `summary` (a dict) as the last record."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        while self._write_batch():
+            pass
+        if summary is not None:
+            record = dict(summary, event='summary', dropped=self.dropped, sampled_out=self.sampled_out)
+            self._f.write(json.dumps(record, default=str) + '\n')
+        self._f.close()
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Queues records as they are; the listener's handlers format them."""
+
+    def prepare(self, record):
+        # QueueHandler.prepare formats the message here, in the logging
+        # thread; the queue never leaves the process, so nothing needs to be
+        # made picklable
+        return record
+
+
+@contextmanager
+def queued_logging():
+    """Route the root logger's handlers through a queue and a listener thread.
+
+    Records are formatted and written by the listener thread.
+    """
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    queue = SimpleQueue()
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    queue_handler = _DeferredQueueHandler(queue)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    listener.start()
+    try:
+        yield
+    finally:
+        root.removeHandler(queue_handler)
+        listener.stop()
+        for handler in handlers:
+            root.addHandler(handler)
@@ -0,0 +1,231 @@
+"""Registry of creation date extractors, dispatched by file extension.
+
+Every known extension maps to a format: the category its files are sorted
+into and the extractors tried on them, in order. An extractor raising
+UnsupportedFormatError passes the file on to the next one; files no
+extractor of their format accepts, and files with an unknown extension, are
+identified by their first bytes instead. Heavy libraries (Pillow, piexif,
+hachoir) are imported the first time an extractor needing them runs.
+
+Other modules can add formats at import time:
+
+    from extractors import register_extractor, register_format
+
+    register_extractor('read_avif', read_avif_date, source='exif')
+    register_format(['.avif'], 'photos', ['read_avif', 'pillow'],
+                    signatures=[(4, b'ftypavif')])
+"""
+import logging
+import os
+import time
+from datetime import datetime
+
+from media_readers import UnsupportedFormatError, read_exif_date, read_video_date
+
+# Category names; a file's category code is its index in this list
+CATEGORIES = ['videos', 'photos', 'others']
+OTHERS = CATEGORIES.index('others')
+
+# Bytes read from the start of a file to identify its container
+SNIFF_SIZE = 16
+
+# How warnings name the data an extractor failed to read
+SOURCE_LABELS = {'exif': 'EXIF data', 'video': 'video metadata'}
+
+
+class Extractor:
+    """A named date reader; `source` tells where the dates it returns come from."""
+
+    __slots__ = ('name', 'func', 'source')
+
+    def __init__(self, name, func, source):
+        self.name = name
+        self.func = func
+        self.source = source
+
+
+class Format:
+    """A file format: its category code and the extractors tried in order."""
+
+    __slots__ = ('category', 'extractors')
+
+    def __init__(self, category, extractors):
+        self.category = category
+        self.extractors = extractors
+
+
+_extractors = {}
+_formats = {}
+# (offset, magic, format), longest magic first so specific brands win
+_signatures = []
+
+
+def register_extractor(name, func, source):
+    """Register `func(path)` returning a datetime, None when the file has no date,
+    or raising UnsupportedFormatError when it cannot read the file."""
+    _extractors[name] = Extractor(name, func, source)
+
+
+def register_format(extensions, category, extractors, signatures=()):
+    """Map file extensions to a category and a chain of registered extractors.
+
+    `signatures` are (offset, bytes) pairs identifying the format from a
+    file's first SNIFF_SIZE bytes. New categories are created as needed;
+    registering an extension again replaces its earlier format.
+    """
+    if category not in CATEGORIES:
+        CATEGORIES.append(category)
+    missing = [name for name in extractors if name not in _extractors]
+    if missing:
+        raise ValueError(f"Unknown extractors: {', '.join(missing)}")
+
+    fmt = Format(CATEGORIES.index(category), tuple(_extractors[name] for name in extractors))
+    for extension in extensions:
+        _formats[extension.lower()] = fmt
+    for offset, magic in signatures:
+        if offset + len(magic) > SNIFF_SIZE:
+            raise ValueError(f"Signature beyond the first {SNIFF_SIZE} bytes: {magic!r}")
+        _signatures.append((offset, magic, fmt))
+    _signatures.sort(key=lambda signature: -len(signature[1]))
+
+
+def _extension(file_name):
+    return os.path.splitext(file_name)[1].lower()
+
+
+def category_code(file_name):
+    """Return the category code for a file name."""
+    fmt = _formats.get(_extension(file_name))
+    return fmt.category if fmt is not None else OTHERS
+
+
+def extensions(category):
+    """Return the registered extensions of a category, sorted."""
+    code = CATEGORIES.index(category)
+    return sorted(extension for extension, fmt in _formats.items() if fmt.category == code)
+
+
+def sniff(file_path):
+    """Identify a file's format from its first bytes; returns None if unknown."""
+    with open(file_path, 'rb') as f:
+        head = f.read(SNIFF_SIZE)
+    for offset, magic, fmt in _signatures:
+        if head[offset:offset + len(magic)] == magic:
+            return fmt
+    return None
+
+
+def _timed(timings, step, func, file_path):
+    if timings is None:
+        return func(file_path)
+    start = time.perf_counter()
+    try:
+        return func(file_path)
+    finally:
+        timings[step] = timings.get(step, 0.0) + time.perf_counter() - start
+
+
+class _Unsupported(Exception):
+    """No extractor of a format accepted the file."""
+
+
+def _run(fmt, file_path, timings):
+    for extractor in fmt.extractors:
+        try:
+            return _timed(timings, extractor.name, extractor.func, file_path), extractor.source
+        except UnsupportedFormatError:
+            continue
+        except Exception as e:
+            label = SOURCE_LABELS.get(extractor.source, f"{extractor.source} metadata")
+            logging.warning(f"Could not read {label} from {file_path}: {e}")
+            return None, None
+    raise _Unsupported()
+
+
+def extract_date(file_path, timings=None):
+    """Return (date, source) from a file's metadata, or (None, None) if it has none.
+
+    When `timings` is a dict, the duration of every extractor run is added
+    to it under the extractor's name.
+    """
+    fmt = _formats.get(_extension(file_path))
+    if fmt is not None:
+        try:
+            return _run(fmt, file_path, timings)
+        except _Unsupported:
+            pass
+
+    # Misnamed file or unknown extension: look at the content
+    try:
+        sniffed = _timed(timings, 'sniff', sniff, file_path)
+    except OSError as e:
+        logging.warning(f"Could not read {file_path}: {e}")
+        return None, None
+    if sniffed is None or sniffed is fmt:
+        return None, None
+    try:
+        return _run(sniffed, file_path, timings)
+    except _Unsupported:
+        return None, None
+
+
+def get_pillow_exif_date(file_path):
+    """Extract DateTimeOriginal by decoding the file with Pillow and piexif."""
+    from PIL import Image, UnidentifiedImageError
+    import piexif
+
+    try:
+        img = Image.open(file_path)
+    except UnidentifiedImageError as e:
+        raise UnsupportedFormatError(str(e)) from None
+    with img:
+        if 'exif' in img.info:
+            exif_dict = piexif.load(img.info['exif'])
+            if piexif.ExifIFD.DateTimeOriginal in exif_dict['Exif']:
+                date_str = exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal].decode('utf-8')
+                return datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
+    return None
+
+
+def get_hachoir_date(file_path):
+    """Extract the creation date by parsing the container with hachoir."""
+    from hachoir.parser import createParser
+    from hachoir.metadata import extractMetadata
+
+    parser = createParser(file_path)
+    if not parser:
+        raise UnsupportedFormatError('Not a container hachoir can parse')
+    with parser:
+        metadata = extractMetadata(parser)
+        if metadata and metadata.has('creation_date'):
+            return metadata.get('creation_date')
+    return None
+
+
+# Header-only readers first, full decoders for containers they don't know
+register_extractor('read_exif', read_exif_date, 'exif')
+register_extractor('pillow', get_pillow_exif_date, 'exif')
+register_extractor('read_video', read_video_date, 'video')
+register_extractor('hachoir', get_hachoir_date, 'video')
+# Canon CR3 is an ISO base media file with the capture time in mvhd
+register_extractor('read_bmff', read_video_date, 'container')
+
+register_format(['.mov', '.mp4', '.avi', '.mkv', '.wmv'], 'videos', ['read_video', 'hachoir'],
+                signatures=[(4, b'ftyp'), (4, b'moov'), (4, b'mdat'), (4, b'wide'),
+                            (0, b'\x1a\x45\xdf\xa3'), (8, b'AVI ')])
+register_format(['.jpg', '.jpeg', '.png', '.arw', '.dng', '.heic', '.raw'],
+                'photos', ['read_exif', 'pillow'],
+                signatures=[(0, b'\xff\xd8\xff'), (0, b'\x89PNG\r\n\x1a\n'), (0, b'II*\x00'),
+                            (0, b'MM\x00*'), (4, b'ftypheic'), (4, b'ftypheix'), (4, b'ftypmif1'),
+                            (4, b'ftypmsf1'), (4, b'ftyphevc')])
+
+
+def register_extra_formats():
+    """Sort WebM, HEIF, HEIF sequences and Canon CR3 as videos and photos.
+
+    Not registered by default: libraries organized before keep these files
+    under others, and registering them moves them on the next run.
+    """
+    register_format(['.webm'], 'videos', ['read_video', 'hachoir'])
+    register_format(['.heif', '.heics'], 'photos', ['read_exif', 'pillow'])
+    register_format(['.cr3'], 'photos', ['read_bmff'], signatures=[(4, b'ftypcrx ')])
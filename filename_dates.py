@@ -0,0 +1,112 @@
+"""Creation dates read from file names, without opening the files.
+
+Phones and messengers name files after their capture time, e.g.
+IMG_20230714_101502.jpg, PXL_20230714_101502123.jpg, IMG-20230714-WA0001.jpg
+or "Screenshot 2023-07-14 at 10.15.02.png". Matching the name is a few
+microseconds per file, so with the 'filename-first' policy such files are
+never opened at all. 'metadata-first' reads the metadata and only uses the
+name instead of the modification time, and 'cross-check' reads both and
+reports files whose name and metadata disagree.
+
+Patterns are regular expressions with the named groups y, m and d, and
+optionally H, M, S and p (AM/PM). They are searched in the file name, or in
+the whole path (with '/' separators) when the pattern contains a '/'.
+"""
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+
+FILENAME_FIRST = 'filename-first'
+METADATA_FIRST = 'metadata-first'
+CROSS_CHECK = 'cross-check'
+POLICIES = (FILENAME_FIRST, METADATA_FIRST, CROSS_CHECK)
+
+# Date source of a name date, and of a cross-checked file whose name and metadata disagree
+SOURCE = 'filename'
+CONFLICT = 'conflict'
+
+# Names and metadata this far apart disagree; covers names in UTC (e.g. Pixel)
+TOLERANCE = timedelta(days=1)
+
+# Names claiming an earlier year are more likely counters than dates
+MIN_YEAR = 1990
+
+DEFAULT_PATTERNS = (
+    # IMG_20230714_101502, VID_..., PXL_20230714_101502123, Screenshot_20230714-101502
+    r'(?<!\d)(?P<y>(?:19|20)\d\d)(?P<m>[01]\d)(?P<d>[0-3]\d)[_-]'
+    r'(?P<H>[0-2]\d)(?P<M>[0-5]\d)(?P<S>[0-5]\d)',
+    # WhatsApp: IMG-20230714-WA0001, VID-20230714-WA0001
+    r'^(?:IMG|VID|AUD|PTT)-(?P<y>(?:19|20)\d\d)(?P<m>[01]\d)(?P<d>[0-3]\d)-WA\d+',
+    # Screenshot 2023-07-14 at 10.15.02, Screen Shot 2023-07-14 at 10.15.02 AM,
+    # WhatsApp Image 2023-07-14 at 10.15.02, 2023-07-14 10.15.02, Screenshot_2023-07-14-10-15-02
+    r'(?<!\d)(?P<y>(?:19|20)\d\d)-(?P<m>[01]\d)-(?P<d>[0-3]\d)[ _-](?:at )?'
+    r'(?P<H>[0-2]?\d)[.:-](?P<M>[0-5]\d)[.:-](?P<S>[0-5]\d)(?: ?(?P<p>[AaPp][Mm]))?',
+)
+
+
+def compile_pattern(pattern):
+    """Compile a date pattern, raising ValueError when it lacks the y, m and d groups."""
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"Invalid date pattern '{pattern}': {e}") from None
+    missing = {'y', 'm', 'd'} - set(compiled.groupindex)
+    if missing:
+        raise ValueError(f"Date pattern '{pattern}' lacks the groups {', '.join(sorted(missing))}")
+    return compiled
+
+
+def _date(match):
+    groups = match.groupdict()
+    hour = int(groups.get('H') or 0)
+    if groups.get('p'):
+        hour = hour % 12 + (12 if groups['p'].lower() == 'pm' else 0)
+    return datetime(int(groups['y']), int(groups['m']), int(groups['d']),
+                    hour, int(groups.get('M') or 0), int(groups.get('S') or 0))
+
+
+class FilenameDates:
+    """Date patterns for file names and the policy for trusting them.
+
+    `patterns` are tried before the defaults unless `defaults` is False.
+    Instances are picklable, so they can be handed to worker processes.
+    """
+
+    def __init__(self, policy=METADATA_FIRST, patterns=(), defaults=True):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown filename date policy: {policy}")
+        self.policy = policy
+        patterns = list(patterns) + (list(DEFAULT_PATTERNS) if defaults else [])
+        # (pattern, whether it is matched against the whole path)
+        self._patterns = [(compiled, '/' in compiled.pattern)
+                          for compiled in map(compile_pattern, patterns)]
+
+    @property
+    def first(self):
+        """Tell whether a name date is used without reading the metadata."""
+        return self.policy == FILENAME_FIRST
+
+    def match(self, path):
+        """Return the date in a file's name (or path), or None if no pattern gives a valid one."""
+        path = os.fspath(path)
+        name = os.path.basename(path)
+        for pattern, whole_path in self._patterns:
+            found = pattern.search(path.replace(os.sep, '/') if whole_path else name)
+            if found is None:
+                continue
+            try:
+                date = _date(found)
+            except ValueError:  # e.g. month 13 in a counter that looks like a date
+                continue
+            if MIN_YEAR <= date.year and date <= datetime.now() + TOLERANCE:
+                return date
+        return None
+
+    def agree(self, named, extracted, file_path):
+        """Tell whether a name date and a metadata date agree; logs a warning if not."""
+        if abs(named - extracted.replace(tzinfo=None)) <= TOLERANCE:
+            return True
+        logging.warning(f"Date in the name of {file_path} ({named}) differs from its "
+                        f"metadata ({extracted}), using the metadata")
+        return False
@@ -0,0 +1,269 @@
+"""Supervised worker processes for metadata extraction.
+
+A corrupt or truncated file can keep a parser busy for minutes or make it
+allocate gigabytes. IsolatedPool runs extraction in separate processes that
+take one file at a time; a worker that exceeds the per-file time budget or
+the memory limit, or that dies, is killed and replaced, and the file it was
+working on gets a fallback result instead. The rest of its batch continues
+on the new worker, so one bad file costs at most the time budget.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+DEFAULT_FILE_TIMEOUT = 30.0
+DEFAULT_MAX_RSS_MB = 1024
+
+# Reasons a file was given up on; used as its date source
+TIMEOUT = 'timeout'
+MEMORY_LIMIT = 'memory_limit'
+CRASHED = 'worker_crashed'
+FAILURE_REASONS = (TIMEOUT, MEMORY_LIMIT, CRASHED)
+
+# Seconds between checks of the workers' run time and memory
+CHECK_INTERVAL = 0.1
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):  # Windows
+    _PAGE_SIZE = None
+
+
+def rss_mb(pid):
+    """Resident memory of a process in MB, or None where /proc is not available."""
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _worker_main(conn):
+    """Run tasks from the supervisor one item at a time until told to stop."""
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        fn, items, args = task
+        for item in items:
+            conn.send(fn([item], *args)[0])
+
+
+class _Task:
+    __slots__ = ('future', 'fn', 'items', 'args', 'results')
+
+    def __init__(self, future, fn, items, args):
+        self.future = future
+        self.fn = fn
+        self.items = items
+        self.args = args
+        self.results = []
+
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'task', 'started')
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,),
+                                       name='extraction-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+
+    def start(self, task):
+        """Hand the unfinished part of a task to this worker."""
+        self.task = task
+        self.started = time.monotonic()
+        self.conn.send((task.fn, task.items[len(task.results):], task.args))
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class IsolatedPool:
+    """Process pool with a time budget and a memory limit per file.
+
+    `submit(fn, items, *args)` returns a Future of `fn(items, *args)`, where
+    `fn` maps a list of items to a list of results. Workers call `fn` on one
+    item at a time; when an item runs longer than `timeout` seconds, the
+    worker grows beyond `max_rss_mb` (checked on Linux), or the worker dies,
+    its result is `fallback(item, reason, seconds, *args)` instead, with
+    `reason` one of FAILURE_REASONS. The worker is replaced and every
+    incident is kept in `failures` as (item, reason, seconds).
+    """
+
+    def __init__(self, max_workers, fallback, timeout=DEFAULT_FILE_TIMEOUT,
+                 max_rss_mb=DEFAULT_MAX_RSS_MB):
+        self.max_workers = max_workers
+        self.fallback = fallback
+        self.timeout = timeout
+        self.max_rss_mb = max_rss_mb
+        self.failures = []
+        self.restarts = 0
+        # Workers are spawned: forking a process that runs threads is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = []
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._shutdown = False
+        self._thread = threading.Thread(target=self._supervise, name='extraction-supervisor',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, items, *args):
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot submit after shutdown')
+            self._pending.append(_Task(future, fn, list(items), args))
+        self._wakeup.set()
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shutdown = True
+        self._wakeup.set()
+        if wait:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _dispatch(self):
+        """Start pending tasks on idle workers, spawning workers up to max_workers."""
+        with self._lock:
+            while self._pending:
+                worker = next((w for w in self._workers if w.task is None), None)
+                if worker is None:
+                    if len(self._workers) >= self.max_workers:
+                        return
+                    worker = _Worker(self._context)
+                    self._workers.append(worker)
+                task = self._pending.popleft()
+                # Tasks resumed after a restart are already running
+                if task.future.running() or task.future.set_running_or_notify_cancel():
+                    worker.start(task)
+
+    def _over_memory(self, worker):
+        if not self.max_rss_mb:
+            return False
+        rss = rss_mb(worker.process.pid)
+        return rss is not None and rss > self.max_rss_mb
+
+    def _add_result(self, worker, task, result):
+        task.results.append(result)
+        if len(task.results) == len(task.items):
+            worker.task = None
+            task.future.set_result(task.results)
+            return False
+        return True
+
+    def _recycle(self, worker, task):
+        """Replace a worker; the rest of its task goes to a fresh one ahead of other tasks."""
+        self.restarts += 1
+        worker.kill()
+        self._workers.remove(worker)
+        if task is not None:
+            with self._lock:
+                self._pending.appendleft(task)
+
+    def _finish_item(self, worker, result):
+        task = worker.task
+        more = self._add_result(worker, task, result)
+        # Memory the parser kept after a large file would count against the next one
+        if self._over_memory(worker):
+            self._recycle(worker, task if more else None)
+        elif more:
+            worker.started = time.monotonic()
+
+    def _give_up(self, worker, reason):
+        """Replace a worker and fall back for the item it was working on."""
+        task = worker.task
+        item = task.items[len(task.results)]
+        seconds = time.monotonic() - worker.started
+        self.failures.append((item, reason, seconds))
+        try:
+            result = self.fallback(item, reason, seconds, *task.args)
+        except Exception as e:
+            worker.task = None
+            task.future.set_exception(e)
+            self._recycle(worker, None)
+            return
+        self._recycle(worker, task if self._add_result(worker, task, result) else None)
+
+    def _check(self, worker):
+        if time.monotonic() - worker.started > self.timeout:
+            return TIMEOUT
+        if self._over_memory(worker):
+            return MEMORY_LIMIT
+        return None
+
+    def _supervise(self):
+        try:
+            while True:
+                with self._lock:
+                    done = self._shutdown and not self._pending
+                if done and all(w.task is None for w in self._workers):
+                    return
+                self._dispatch()
+                busy = {w.conn: w for w in self._workers if w.task is not None}
+                if not busy:
+                    self._wakeup.wait(CHECK_INTERVAL)
+                    self._wakeup.clear()
+                    continue
+                for conn in wait(list(busy), CHECK_INTERVAL):
+                    worker = busy[conn]
+                    try:
+                        self._finish_item(worker, conn.recv())
+                    except (EOFError, OSError):
+                        self._give_up(worker, CRASHED)
+                for worker in busy.values():
+                    if worker in self._workers and worker.task is not None:
+                        reason = self._check(worker)
+                        if reason is not None:
+                            logging.debug(f"Restarting extraction worker {worker.process.pid}: {reason}")
+                            self._give_up(worker, reason)
+        except BaseException as e:
+            # Never leave a caller waiting on a future that can no longer finish
+            for worker in self._workers:
+                if worker.task is not None and not worker.task.future.done():
+                    worker.task.future.set_exception(e)
+            with self._lock:
+                for task in self._pending:
+                    if not task.future.done():
+                        task.future.set_exception(e)
+                self._pending.clear()
+            raise
+        finally:
+            for worker in self._workers:
+                worker.stop()
+            self._workers.clear()
@@ -0,0 +1,349 @@
+"""Plan files and resumable, journaled execution of plans.
+
+A plan is a JSON Lines file: a header line describing the run, then one
+entry per file with its source, destination, action and the stat
+fingerprint of the source at planning time. Applying a plan records every
+entry in a write-ahead journal before and after it is executed, so an
+interrupted apply resumes exactly where it stopped. Plans can be split into
+shards that separate processes apply concurrently.
+"""
+import json
+import logging
+import os
+import time
+
+from transfer import transfer
+
+PLAN_VERSION = 1
+
+# Actions that change the filesystem; other entries are informational
+EXECUTABLE_ACTIONS = ('move', 'copy', 'link', 'hardlink')
+
+# Log wording for executed actions
+ACTION_LABELS = {'move': 'Moved', 'copy': 'Copied', 'link': 'Linked', 'hardlink': 'Hardlinked'}
+
+# The journal is fsynced every this many records and when it is closed
+JOURNAL_SYNC_EVERY = 1000
+
+
+def make_entry(seq, action, src, dst=None, record=None, **extra):
+    """Build a plan entry; `record` supplies the source fingerprint."""
+    entry = {'seq': seq, 'action': action, 'src': os.fspath(src)}
+    if dst is not None:
+        entry['dst'] = os.fspath(dst)
+    if record is not None:
+        entry['fp'] = [record.st_dev, record.st_ino, record.st_size, record.st_mtime_ns]
+    entry.update(extra)
+    return entry
+
+
+def write_plan(path, header, entries):
+    """Stream plan entries to a JSON Lines file; returns the number written."""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(dict(header, version=PLAN_VERSION)) + '\n')
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+            count += 1
+    return count
+
+
+def _read_header(f):
+    header = json.loads(f.readline())
+    if header.get('version') != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version: {header.get('version')}")
+    return header
+
+
+def read_plan_header(path):
+    """Return the header of a plan file."""
+    with open(path, encoding='utf-8') as f:
+        return _read_header(f)
+
+
+def read_plan(path):
+    """Return the header of a plan file and an iterator over its entries."""
+    f = open(path, encoding='utf-8')
+    try:
+        header = _read_header(f)
+    except ValueError:
+        f.close()
+        raise
+
+    def entries():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, entries()
+
+
+def parse_shard(value):
+    """Parse an 'I/N' shard specification into (index, count)."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{value}', expected INDEX/COUNT") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{value}', expected 0 <= INDEX < COUNT")
+    return index, count
+
+
+def journal_path(plan_path, shard=(0, 1)):
+    index, count = shard
+    if count == 1:
+        return f"{plan_path}.journal"
+    return f"{plan_path}.journal.{index}of{count}"
+
+
+class Journal:
+    """Append-only record of plan entries started and finished.
+
+    Finished entries are kept as a bitmap indexed by sequence number, so
+    resuming a plan with millions of entries stays cheap in memory. A torn
+    last line from a crash is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._done = bytearray()
+        self._begun = set()
+        self._pending_sync = 0
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    # A torn line can still parse, e.g. as a bare number
+                    if not isinstance(record, dict) or not isinstance(record.get('seq'), int):
+                        continue
+                    if record.get('state') == 'begin':
+                        self._begun.add(record['seq'])
+                    elif record.get('state') == 'done':
+                        self._set_done(record['seq'])
+                        self._begun.discard(record['seq'])
+        self._f = open(path, 'a', encoding='utf-8')
+
+    def _set_done(self, seq):
+        byte = seq >> 3
+        if byte >= len(self._done):
+            self._done.extend(bytes(byte - len(self._done) + 1))
+        self._done[byte] |= 1 << (seq & 7)
+
+    def is_done(self, seq):
+        byte = seq >> 3
+        return byte < len(self._done) and bool(self._done[byte] & (1 << (seq & 7)))
+
+    def was_begun(self, seq):
+        """Tell whether a previous apply started this entry without finishing it."""
+        return seq in self._begun
+
+    def _write(self, record):
+        self._f.write(json.dumps(record) + '\n')
+        self._f.flush()
+        self._pending_sync += 1
+        if self._pending_sync >= JOURNAL_SYNC_EVERY:
+            os.fsync(self._f.fileno())
+            self._pending_sync = 0
+
+    def begin(self, seq):
+        self._write({'seq': seq, 'state': 'begin'})
+
+    def finish(self, seq, checksum=None):
+        record = {'seq': seq, 'state': 'done'}
+        if checksum is not None:
+            record['checksum'] = checksum
+        self._write(record)
+        self._set_done(seq)
+
+    def fail(self, seq, error):
+        self._write({'seq': seq, 'state': 'failed', 'error': str(error)})
+
+    def close(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+
+
+def _matches(path, fingerprint):
+    """Tell whether a file has the size and mtime recorded in a fingerprint."""
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return (stat_result.st_size, stat_result.st_mtime_ns) == tuple(fingerprint[2:])
+
+
+def _link_target(entry):
+    """Return the first existing location of the file a hardlink entry points to."""
+    for path in entry['link']:
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"Link target missing: {entry['link'][0]}")
+
+
+def count_strategy(stats, strategy):
+    """Count a transfer strategy in a run's stats."""
+    strategies = stats.setdefault('strategies', {})
+    strategies[strategy] = strategies.get(strategy, 0) + 1
+
+
+def execute_entry(entry, made_dirs, metrics=None, throttle=None, verifier=None):
+    """Carry out a move, copy, link or hardlink entry; returns the transfer strategy.
+
+    `made_dirs` is a set of directories already created by this process, so
+    each destination directory is created once. Existing destinations are
+    never overwritten. 'link' hard links the source itself, while 'hardlink'
+    links a duplicate's destination to the original it matched. Directory
+    creation and the transfer are timed into `metrics` when it is given.
+    `throttle` limits the bandwidth of copies and a `verifier` (a
+    transfer.Verifier) checksums and verifies them (see transfer.copy_file).
+    """
+    src, dst = entry['src'], entry['dst']
+    extension = os.path.splitext(src)[1].lower()
+    parent = os.path.dirname(dst)
+    if parent not in made_dirs:
+        start = time.perf_counter()
+        os.makedirs(parent, exist_ok=True)
+        made_dirs.add(parent)
+        if metrics is not None:
+            metrics.record('mkdir', time.perf_counter() - start, extension)
+    if os.path.lexists(dst):
+        raise FileExistsError(f"Destination already exists: {dst}")
+
+    start = time.perf_counter()
+    action = entry['action']
+    if action in ('move', 'copy', 'link'):
+        strategy = transfer(src, dst, action, throttle, verifier)
+    elif action == 'hardlink':
+        strategy = transfer(_link_target(entry), dst, 'link', throttle, verifier)
+        if entry.get('remove_src'):
+            os.remove(src)
+    else:
+        raise ValueError(f"Unknown plan action: {action}")
+
+    if metrics is not None:
+        seconds = time.perf_counter() - start
+        metrics.record('transfer', seconds, extension)
+        metrics.record_strategy(strategy, seconds)
+    return strategy
+
+
+def _recover(entry, begun):
+    """Settle an entry whose destination exists before it is (re)applied.
+
+    Returns True when the entry's effect is already on disk, e.g. because
+    the journal record was lost or the process stopped right after the
+    operation. Partial results of an interrupted entry are removed.
+    """
+    src, dst = entry['src'], entry['dst']
+    if not os.path.lexists(dst):
+        return False
+
+    action = entry['action']
+    if action == 'hardlink':
+        try:
+            complete = os.path.samefile(dst, _link_target(entry))
+        except FileNotFoundError:
+            complete = False
+    else:
+        complete = _matches(dst, entry['fp'])
+
+    if complete:
+        # A cross-device move or hardlink may have stopped before removing the source
+        if (action == 'move' or entry.get('remove_src')) and _matches(src, entry['fp']):
+            os.remove(src)
+        return True
+    if begun:
+        os.remove(dst)
+        return False
+    raise FileExistsError(f"Destination already exists: {dst}")
+
+
+def record_entry(manifest, entry, placed, kept, checksum=None):
+    """Record the files an entry left in the library in `manifest`.
+
+    `placed` tells whether the entry put a file at its destination, and
+    `kept` whether its source stays where it is (copies and links).
+    """
+    try:
+        if placed:
+            manifest.add(entry['dst'], os.stat(entry['dst']), entry['date'], checksum)
+        # Sources are kept by copies, links and skipped files
+        if not placed or kept:
+            manifest.add(entry['src'], os.stat(entry['src']), entry['date'], checksum)
+    except OSError as e:
+        logging.warning(f"Could not record {entry['src']} in the manifest: {e}")
+
+
+def apply_plan(plan_path, shard=(0, 1), journal_file=None, progress=None, metrics=None,
+               throttle=None, verifier=None, manifest=None):
+    """Execute the entries of a plan file that belong to `shard`.
+
+    Entries already finished according to the journal are skipped, so
+    running apply again after an interruption resumes the plan. Entries whose
+    source changed since it was planned are reported as errors. Transfers
+    are timed into `metrics` when it is given and copies are limited by
+    `throttle`. Copies made with a `verifier` are verified, and their
+    checksums are kept in the journal. Placed and skipped files are
+    recorded in `manifest` (a manifest.Manifest of the plan's directory)
+    when it is given.
+    """
+    index, count = shard
+    header, entries = read_plan(plan_path)
+    kept = header.get('copy') or header.get('link')
+    journal = Journal(journal_file or journal_path(plan_path, shard))
+    made_dirs = set()
+    stats = {'moved': 0, 'resumed': 0, 'skipped': 0, 'errors': 0}
+
+    try:
+        for entry in entries:
+            seq = entry['seq']
+            if seq % count != index:
+                continue
+            if progress is not None:
+                progress(entry)
+            if entry['action'] not in EXECUTABLE_ACTIONS:
+                stats['skipped'] += 1
+                if manifest is not None and entry['action'] == 'skip':
+                    record_entry(manifest, entry, False, kept)
+                continue
+            if journal.is_done(seq):
+                stats['resumed'] += 1
+                continue
+
+            try:
+                if _recover(entry, journal.was_begun(seq)):
+                    journal.finish(seq)
+                    if manifest is not None:
+                        record_entry(manifest, entry, True, kept)
+                    stats['resumed'] += 1
+                    continue
+                if not _matches(entry['src'], entry['fp']):
+                    raise RuntimeError("source changed since the plan was made")
+
+                journal.begin(seq)
+                strategy = execute_entry(entry, made_dirs, metrics, throttle, verifier)
+                checksum = verifier.take(entry['dst']) if verifier is not None else None
+                journal.finish(seq, checksum)
+                if manifest is not None:
+                    record_entry(manifest, entry, True, kept, checksum)
+                stats['moved'] += 1
+                count_strategy(stats, strategy)
+                if metrics is not None:
+                    metrics.file_done(entry['dst'])
+                logging.info(f"{ACTION_LABELS[entry['action']]} '{entry['src']}' to '{entry['dst']}'")
+            except Exception as e:
+                journal.fail(seq, e)
+                logging.error(f"Error processing {entry['src']}: {e}")
+                stats['errors'] += 1
+    finally:
+        journal.close()
+
+    if verifier is not None:
+        stats['verified'] = verifier.verified
+    return header, stats
@@ -0,0 +1,208 @@
+"""Manifest of an organized library, kept inside the library itself.
+
+Every file placed (or found already in place) is recorded with its path
+relative to the library, its stat fingerprint and the creation date it was
+organized by. Directories that hold nothing but recorded files are stored
+with their modification time; as long as that time is unchanged no entry
+was added, removed or renamed in them, so later runs skip them without
+listing them. A re-run then costs a stat per directory plus the work for new
+or changed files, instead of extracting the whole library again. Files that
+arrived through a verified copy also keep their content checksum, which
+dedupe reuses instead of reading them.
+
+The manifest also stores the settings the library was organized with (the
+layout and whether files were moved, copied or linked). A run with other
+settings starts a new manifest, since the recorded files are not where that
+run would put them.
+"""
+import os
+import sqlite3
+
+MANIFEST_NAME = '.media-organizer.sqlite'
+# The manifest and SQLite's files next to it, never organized themselves
+MANIFEST_FILES = tuple(MANIFEST_NAME + suffix for suffix in ('', '-wal', '-shm', '-journal'))
+
+# Pending file entries are written in one transaction every this many entries
+FLUSH_EVERY = 5000
+
+SCHEMA_VERSION = 3
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    checksum TEXT
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def manifest_path(directory):
+    return os.path.join(os.fspath(directory), MANIFEST_NAME)
+
+
+def _fingerprint(stat_result):
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+
+class Manifest:
+    """SQLite record of the files organized into `directory`.
+
+    With `readonly` (dry runs), the manifest is used for skipping but
+    nothing is written, and a missing manifest is not created. `settings`
+    (a dict of strings, e.g. organize_by and mode) describes the run; a
+    manifest written with other settings is replaced, or ignored when
+    `readonly`.
+    """
+
+    def __init__(self, directory, path=None, readonly=False, settings=None):
+        self.directory = os.fspath(directory)
+        self.path = path or manifest_path(directory)
+        self.readonly = readonly
+        self.unchanged = 0
+        self.pruned = 0
+        self._writes = []
+        self._touched = set()
+
+        if not readonly:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            # Earlier versions did not record their settings, so their entries
+            # can't be trusted for any layout
+            if self._db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                self._db.executescript(f'DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS dirs; '
+                                       f'PRAGMA user_version={SCHEMA_VERSION};')
+            self._db.executescript(SCHEMA)
+            if settings is not None and self._settings() != settings:
+                with self._db:
+                    self._db.execute('DELETE FROM files')
+                    self._db.execute('DELETE FROM dirs')
+                    self._db.execute('DELETE FROM settings')
+                    self._db.executemany('INSERT INTO settings VALUES (?, ?)', settings.items())
+        elif os.path.exists(self.path):
+            self._db = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            if (self._db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION
+                    or settings is not None and self._settings() != settings):
+                # Written by an incompatible version or for another layout;
+                # behave as if there were none
+                self._db.close()
+                self._db = None
+        else:
+            self._db = None
+        if self._db is None:
+            self._db = sqlite3.connect(':memory:')
+            self._db.executescript(SCHEMA)
+
+        self._dirs = dict(self._db.execute('SELECT path, mtime_ns FROM dirs'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _settings(self):
+        return dict(self._db.execute('SELECT key, value FROM settings'))
+
+    def _relative(self, path):
+        return os.path.relpath(os.fspath(path), self.directory)
+
+    def _recorded(self, path):
+        return self._db.execute('SELECT dev, ino, size, mtime_ns FROM files WHERE path = ?',
+                                (self._relative(path),)).fetchone()
+
+    def checksum(self, path, stat_result):
+        """Return the recorded content digest (bytes) of an unchanged file, or None."""
+        row = self._db.execute('SELECT dev, ino, size, mtime_ns, checksum FROM files WHERE path = ?',
+                               (self._relative(path),)).fetchone()
+        if row is None or row[4] is None or row[:4] != _fingerprint(stat_result):
+            return None
+        return bytes.fromhex(row[4])
+
+    def unchanged_dir(self, path, mtime_ns):
+        """Tell whether a directory holds only recorded files and is unchanged since.
+
+        Used by discovery to prune directories; may be called from its thread.
+        """
+        if self._dirs.get(self._relative(path)) == mtime_ns:
+            self.pruned += 1
+            return True
+        return False
+
+    def unchanged_file(self, record):
+        """Tell whether a discovered FileRecord is recorded with the same fingerprint."""
+        if self._recorded(record.path) != _fingerprint(record):
+            return False
+        self.unchanged += 1
+        # The directory was listed, so it changed; it is recorded again on close
+        self._touched.add(record.parent)
+        return True
+
+    def add(self, path, stat_result, created, checksum=None):
+        """Record a file in its organized location and the date (ISO string) it was sorted by.
+
+        `checksum` is the hex content digest of a verified copy, if there was one.
+        """
+        if self.readonly:
+            return
+        path = os.fspath(path)
+        self._writes.append((self._relative(path), *_fingerprint(stat_result), created, checksum))
+        self._touched.add(os.path.dirname(path))
+        if len(self._writes) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        """Write pending file entries in a single transaction."""
+        if self._writes:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', self._writes)
+            self._writes.clear()
+
+    def _only_recorded(self, directory):
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    return False
+                if self._recorded(entry.path) != _fingerprint(entry.stat()):
+                    return False
+        return True
+
+    def record_directories(self):
+        """Store the directories touched by this run that hold only recorded files."""
+        if self.readonly:
+            return
+        self.flush()
+        updates = []
+        removed = []
+        for directory in self._touched:
+            relative = self._relative(directory)
+            try:
+                # Taken before listing, so a change while listing is noticed next time
+                mtime_ns = os.stat(directory).st_mtime_ns
+                if self._only_recorded(directory):
+                    updates.append((relative, mtime_ns))
+                    continue
+            except OSError:
+                pass
+            removed.append((relative,))
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?)', updates)
+            self._db.executemany('DELETE FROM dirs WHERE path = ?', removed)
+        self._touched.clear()
+
+    def close(self):
+        self.record_directories()
+        self._db.close()
@@ -0,0 +1,512 @@
+"""Header-only readers for capture dates embedded in media files.
+
+Photos are handled by walking JPEG/PNG/TIFF structures to the EXIF IFD,
+videos by walking ISO-BMFF boxes (MP4/MOV), EBML elements (MKV) or RIFF
+chunks (AVI) while seeking over the media payload.
+
+These readers only touch the few structures that hold the capture date and
+never decode image data, so the number of bytes read per file stays small
+and independent of the file size.
+"""
+import io
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+
+# Bytes read up front from TIFF-based files; IFD0 and the EXIF IFD almost
+# always live in this window, anything else is fetched with a targeted read
+TIFF_HEAD_SIZE = 16 * 1024
+
+# Safety limits for corrupt files
+MAX_JPEG_SEGMENTS = 64
+MAX_PNG_CHUNKS = 64
+MAX_IFD_ENTRIES = 1024
+# Date tags are at most a few dozen characters; longer counts are corrupt
+MAX_ASCII_TAG_LENGTH = 64
+MAX_BOXES = 256
+MAX_ELEMENTS = 256
+
+# Largest metadata container (udta, meta, MKV Info, AVI hdrl) read into memory
+MAX_METADATA_BOX_SIZE = 256 * 1024
+
+EXIF_DATE_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+# TIFF magic numbers: standard TIFF, Olympus ORF and Panasonic RW2
+TIFF_MAGICS = (42, 0x4F52, 0x5352, 0x55)
+
+# EXIF tags
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+TAG_SUBSEC_TIME_ORIGINAL = 0x9291
+
+DATE_TAGS = (TAG_DATETIME_ORIGINAL, TAG_SUBSEC_TIME_ORIGINAL, TAG_OFFSET_TIME_ORIGINAL)
+
+# TIFF field types we decode
+TYPE_ASCII = 2
+TYPE_SHORT = 3
+TYPE_LONG = 4
+TYPE_IFD = 13
+
+JPEG_SOI = b'\xff\xd8'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+EXIF_HEADER = b'Exif\x00\x00'
+
+# ISO-BMFF (MP4/MOV)
+BMFF_EPOCH = datetime(1904, 1, 1)
+BMFF_TOP_LEVEL_BOXES = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot', b'uuid')
+QUICKTIME_CREATION_KEY = b'com.apple.quicktime.creationdate'
+QUICKTIME_DAY = b'\xa9day'
+
+# Matroska/WebM (EBML)
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+EBML_ID_SEGMENT = 0x18538067
+EBML_ID_INFO = 0x1549A966
+EBML_ID_CLUSTER = 0x1F43B675
+EBML_ID_DATE_UTC = 0x4461
+EBML_EPOCH = datetime(2001, 1, 1)
+
+# Text date layouts found in QuickTime keys and AVI IDIT/ICRD chunks
+TEXT_DATE_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S%z',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y:%m:%d %H:%M:%S',
+    '%a %b %d %H:%M:%S %Y',
+    '%Y-%m-%d',
+)
+
+
+class UnsupportedFormatError(ValueError):
+    """Raised when a file's layout is not understood by the fast readers."""
+
+
+class _TiffView:
+    """Random access to a TIFF structure, served from a head buffer when possible."""
+
+    def __init__(self, head, f=None, base=0):
+        self.head = head
+        self.f = f
+        self.base = base
+
+    def read(self, offset, size):
+        end = offset + size
+        if end <= len(self.head):
+            return self.head[offset:end]
+        if self.f is None:
+            raise UnsupportedFormatError('EXIF offset points outside the EXIF segment')
+        self.f.seek(self.base + offset)
+        data = self.f.read(size)
+        if len(data) != size:
+            raise UnsupportedFormatError('Truncated TIFF structure')
+        return data
+
+
+def _read_ifd(view, order, offset, wanted):
+    """Return {tag: value} for the wanted tags of the IFD at `offset`."""
+    count, = struct.unpack(order + 'H', view.read(offset, 2))
+    if count > MAX_IFD_ENTRIES:
+        raise UnsupportedFormatError(f'Implausible IFD entry count: {count}')
+
+    values = {}
+    entries = view.read(offset + 2, count * 12)
+    for i in range(0, count * 12, 12):
+        tag, field_type, length = struct.unpack(order + 'HHI', entries[i:i + 8])
+        if tag not in wanted:
+            continue
+        raw = entries[i + 8:i + 12]
+        if field_type == TYPE_ASCII:
+            if length > MAX_ASCII_TAG_LENGTH:
+                continue
+            if length > 4:
+                raw = view.read(struct.unpack(order + 'I', raw)[0], length)
+            values[tag] = raw[:length]
+        elif field_type in (TYPE_LONG, TYPE_IFD):
+            values[tag] = struct.unpack(order + 'I', raw)[0]
+        elif field_type == TYPE_SHORT:
+            values[tag] = struct.unpack(order + 'H', raw[:2])[0]
+    return values
+
+
+def _read_tiff_date(view):
+    """Follow IFD0 to the EXIF IFD and build the original capture date."""
+    header = view.read(0, 8)
+    if header[:2] == b'II':
+        order = '<'
+    elif header[:2] == b'MM':
+        order = '>'
+    else:
+        raise UnsupportedFormatError('Missing TIFF byte order mark')
+    magic, ifd0_offset = struct.unpack(order + 'HI', header[2:])
+    if magic not in TIFF_MAGICS:
+        raise UnsupportedFormatError(f'Unknown TIFF magic number: {magic}')
+
+    # Some DNG writers put the date tags straight into IFD0
+    tags = _read_ifd(view, order, ifd0_offset, (TAG_EXIF_IFD,) + DATE_TAGS)
+    exif_offset = tags.get(TAG_EXIF_IFD)
+    if exif_offset:
+        exif_tags = _read_ifd(view, order, exif_offset, DATE_TAGS)
+        if TAG_DATETIME_ORIGINAL in exif_tags:
+            tags = exif_tags
+
+    if TAG_DATETIME_ORIGINAL not in tags:
+        return None
+    return parse_exif_datetime(tags[TAG_DATETIME_ORIGINAL],
+                               tags.get(TAG_SUBSEC_TIME_ORIGINAL),
+                               tags.get(TAG_OFFSET_TIME_ORIGINAL))
+
+
+def _decode_ascii(value):
+    if isinstance(value, bytes):
+        value = value.rstrip(b'\x00 ').decode('ascii')
+    return value.strip()
+
+
+def parse_exif_datetime(value, subsec=None, offset=None):
+    """Build a datetime from DateTimeOriginal plus optional sub-second and UTC offset tags."""
+    date = datetime.strptime(_decode_ascii(value), EXIF_DATE_FORMAT)
+
+    if subsec:
+        digits = _decode_ascii(subsec)
+        if digits.isdigit():
+            date = date.replace(microsecond=int(digits[:6].ljust(6, '0')))
+
+    if offset:
+        text = _decode_ascii(offset)
+        try:
+            sign = -1 if text[0] == '-' else 1
+            hours, minutes = text[1:].split(':')
+            delta = timedelta(hours=int(hours), minutes=int(minutes))
+            date = date.replace(tzinfo=timezone(sign * delta))
+        except (IndexError, ValueError):
+            pass  # Malformed offsets are ignored, the local time is still valid
+
+    return date
+
+
+def _find_jpeg_exif(f):
+    """Walk JPEG marker segments up to the image data and return the EXIF TIFF block."""
+    f.seek(len(JPEG_SOI))
+    for _ in range(MAX_JPEG_SEGMENTS):
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            raise UnsupportedFormatError('Corrupt JPEG marker')
+        marker = header[1]
+        if marker in (0xDA, 0xD9):  # Start of scan / end of image
+            return None
+        length, = struct.unpack('>H', header[2:])
+        # The length includes its own two bytes
+        if length < 2:
+            raise UnsupportedFormatError(f'Corrupt JPEG segment length: {length}')
+        if marker == 0xE1:
+            data = f.read(length - 2)
+            if data.startswith(EXIF_HEADER):
+                return data[len(EXIF_HEADER):]
+        else:
+            f.seek(length - 2, 1)
+    return None
+
+
+def _find_png_exif(f):
+    """Walk PNG chunks up to the image data and return the eXIf TIFF block."""
+    f.seek(len(PNG_SIGNATURE))
+    for _ in range(MAX_PNG_CHUNKS):
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'eXIf':
+            data = f.read(length)
+            # Early writers kept the APP1 prefix in the chunk
+            return data[len(EXIF_HEADER):] if data.startswith(EXIF_HEADER) else data
+        if chunk_type in (b'IDAT', b'IEND'):
+            return None
+        f.seek(length + 4, 1)  # Chunk data and CRC
+    return None
+
+
+def read_exif_date(file_path):
+    """Read DateTimeOriginal from a JPEG, PNG or TIFF-based RAW file header.
+
+    Returns None when the file has no original capture date and raises
+    UnsupportedFormatError when the container is not recognized, so the
+    caller can fall back to a full decoder.
+    """
+    with open(file_path, 'rb') as f:
+        signature = f.read(8)
+        if signature.startswith(JPEG_SOI):
+            tiff = _find_jpeg_exif(f)
+            return _read_tiff_date(_TiffView(tiff)) if tiff else None
+        if signature == PNG_SIGNATURE:
+            tiff = _find_png_exif(f)
+            return _read_tiff_date(_TiffView(tiff)) if tiff else None
+        if signature[:2] in (b'II', b'MM'):
+            f.seek(0)
+            return _read_tiff_date(_TiffView(f.read(TIFF_HEAD_SIZE), f))
+    raise UnsupportedFormatError('Not a JPEG, PNG or TIFF-based file')
+
+
+def parse_text_date(value):
+    """Parse a date string as written by cameras into video containers."""
+    text = _decode_ascii(value.replace(b'\n', b'') if isinstance(value, bytes) else value)
+    if text.endswith('Z'):
+        text = text[:-1] + '+0000'
+    for date_format in TEXT_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def _read_payload(f, offset, size):
+    """Read a small metadata container payload."""
+    if not 0 <= size <= MAX_METADATA_BOX_SIZE:
+        raise UnsupportedFormatError(f'Implausible metadata container size: {size} bytes')
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size:
+        raise UnsupportedFormatError('Truncated metadata container')
+    return data
+
+
+def _iter_boxes(f, start, end):
+    """Yield (type, payload offset, payload size) of the boxes in [start, end), seeking over payloads."""
+    offset = start
+    for _ in range(MAX_BOXES):
+        if offset + 8 > end:
+            return
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:  # 64-bit largesize follows the type
+            large = f.read(8)
+            if len(large) < 8:
+                return
+            size, = struct.unpack('>Q', large)
+            header_size = 16
+        elif size == 0:  # Box extends to the end of its parent
+            size = end - offset
+        if size < header_size:
+            raise UnsupportedFormatError(f'Corrupt {box_type!r} box size')
+        yield box_type, offset + header_size, size - header_size
+        offset += size
+
+
+def _iter_buffer_boxes(data):
+    """Yield (type, payload) for boxes inside an in-memory container."""
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        if size < 8:
+            return
+        yield box_type, data[offset + 8:offset + size]
+        offset += size
+
+
+def _parse_mvhd(payload):
+    """Return the movie creation time from an mvhd payload (version 0 or 1)."""
+    if payload[:1] == b'\x01':
+        created, = struct.unpack('>Q', payload[4:12])
+    else:
+        created, = struct.unpack('>I', payload[4:8])
+    if not created:
+        return None
+    return BMFF_EPOCH + timedelta(seconds=created)
+
+
+def _parse_quicktime_meta(payload):
+    """Return com.apple.quicktime.creationdate from a moov/meta payload (keys + ilst)."""
+    # QuickTime meta boxes have no version/flags, ISO ones do
+    if payload[:4] == b'\x00\x00\x00\x00':
+        payload = payload[4:]
+    keys = {}
+    items = {}
+    for box_type, data in _iter_buffer_boxes(payload):
+        if box_type == b'keys':
+            entry_offset = 8  # Version/flags and entry count
+            for index in range(1, struct.unpack('>I', data[4:8])[0] + 1):
+                key_size, = struct.unpack('>I', data[entry_offset:entry_offset + 4])
+                if key_size < 8:
+                    break
+                keys[data[entry_offset + 8:entry_offset + key_size]] = index
+                entry_offset += key_size
+        elif box_type == b'ilst':
+            for item_type, item in _iter_buffer_boxes(data):
+                items[item_type] = item
+
+    index = keys.get(QUICKTIME_CREATION_KEY)
+    item = items.get(struct.pack('>I', index)) if index else items.get(QUICKTIME_DAY)
+    if item is None:
+        return None
+    for box_type, data in _iter_buffer_boxes(item):
+        if box_type == b'data':
+            return parse_text_date(data[8:])  # Skip type indicator and locale
+    return None
+
+
+def _parse_udta(payload):
+    """Return the QuickTime \u00a9day user data date from a udta payload."""
+    for box_type, data in _iter_buffer_boxes(payload):
+        if box_type == QUICKTIME_DAY:
+            # Size and language code precede the string
+            return parse_text_date(data[4:])
+        if box_type == b'meta':
+            date = _parse_quicktime_meta(data)
+            if date is not None:
+                return date
+    return None
+
+
+def _read_bmff_date(f, file_size):
+    """Seek across top-level boxes to moov and read mvhd, falling back to QuickTime date keys."""
+    for box_type, offset, size in _iter_boxes(f, 0, file_size):
+        if box_type not in BMFF_TOP_LEVEL_BOXES and box_type != b'meta':
+            raise UnsupportedFormatError(f'Unexpected top-level box {box_type!r}')
+        if box_type != b'moov':
+            continue
+
+        fallback = None
+        for child_type, child_offset, child_size in _iter_boxes(f, offset, offset + size):
+            if child_type == b'mvhd':
+                date = _parse_mvhd(_read_payload(f, child_offset, min(child_size, 32)))
+                if date is not None:
+                    return date
+            elif child_type == b'meta' and fallback is None:
+                fallback = _parse_quicktime_meta(_read_payload(f, child_offset, child_size))
+            elif child_type == b'udta' and fallback is None:
+                fallback = _parse_udta(_read_payload(f, child_offset, child_size))
+        return fallback
+    return None
+
+
+def _read_ebml_id(f):
+    first = f.read(1)
+    if not first:
+        return None, 0
+    length = 1
+    while length <= 4 and not first[0] & (0x80 >> (length - 1)):
+        length += 1
+    if length > 4:
+        raise UnsupportedFormatError('Invalid EBML element ID')
+    rest = f.read(length - 1)
+    return int.from_bytes(first + rest, 'big'), length
+
+
+def _read_ebml_size(f):
+    """Read an EBML data size; returns None for the reserved 'unknown size' value."""
+    first = f.read(1)
+    if not first:
+        raise UnsupportedFormatError('Truncated EBML element')
+    length = 1
+    while length <= 8 and not first[0] & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise UnsupportedFormatError('Invalid EBML size')
+    value = first[0] & (0xFF >> length)
+    for byte in f.read(length - 1):
+        value = (value << 8) | byte
+    if value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def _iter_ebml_elements(f, start, end):
+    """Yield (id, payload offset, payload size) of the EBML elements in [start, end)."""
+    offset = start
+    for _ in range(MAX_ELEMENTS):
+        if offset >= end:
+            return
+        f.seek(offset)
+        element_id, id_length = _read_ebml_id(f)
+        if element_id is None:
+            return
+        size, size_length = _read_ebml_size(f)
+        payload_offset = offset + id_length + size_length
+        yield element_id, payload_offset, size
+        if size is None:
+            return
+        offset = payload_offset + size
+
+
+def _read_ebml_date(f, file_size):
+    """Find Segment/Info/DateUTC in a Matroska file without touching clusters."""
+    elements = _iter_ebml_elements(f, 0, file_size)
+    for element_id, offset, size in elements:
+        if element_id != EBML_ID_SEGMENT:
+            continue
+        segment_end = file_size if size is None else offset + size
+        for child_id, child_offset, child_size in _iter_ebml_elements(f, offset, segment_end):
+            if child_id == EBML_ID_CLUSTER or child_size is None:
+                return None
+            if child_id != EBML_ID_INFO:
+                continue
+            info = io.BytesIO(_read_payload(f, child_offset, child_size))
+            for info_id, value_offset, value_size in _iter_ebml_elements(info, 0, child_size):
+                if info_id == EBML_ID_DATE_UTC and value_size == 8:
+                    info.seek(value_offset)
+                    nanoseconds, = struct.unpack('>q', info.read(8))
+                    return EBML_EPOCH + timedelta(microseconds=nanoseconds // 1000)
+            return None
+        return None
+    return None
+
+
+def _iter_riff_chunks(data):
+    """Yield (id, payload) for RIFF chunks inside an in-memory LIST, recursing into sub-lists."""
+    offset = 0
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack('<4sI', data[offset:offset + 8])
+        payload = data[offset + 8:offset + 8 + size]
+        if chunk_id == b'LIST':
+            yield from _iter_riff_chunks(payload[4:])
+        else:
+            yield chunk_id, payload
+        offset += 8 + size + (size & 1)
+
+
+def _read_riff_date(f, file_size):
+    """Read the IDIT (or INFO/ICRD) date from an AVI file, seeking over the movi list."""
+    offset = 12  # 'RIFF', size, 'AVI '
+    fallback = None
+    for _ in range(MAX_ELEMENTS):
+        if offset + 12 > file_size:
+            break
+        f.seek(offset)
+        chunk_id, size, list_type = struct.unpack('<4sI4s', f.read(12))
+        # A list holds at least its type
+        if chunk_id == b'LIST' and size < 4:
+            raise UnsupportedFormatError(f'Corrupt RIFF list size: {size}')
+        if chunk_id == b'LIST' and list_type in (b'hdrl', b'INFO'):
+            for sub_id, payload in _iter_riff_chunks(_read_payload(f, offset + 12, size - 4)):
+                if sub_id == b'IDIT':
+                    date = parse_text_date(payload)
+                    if date is not None:
+                        return date
+                elif sub_id == b'ICRD' and fallback is None:
+                    fallback = parse_text_date(payload)
+        offset += 8 + size + (size & 1)
+    return fallback
+
+
+def read_video_date(file_path):
+    """Read the creation date from an MP4/MOV, MKV/WebM or AVI container.
+
+    Only container headers are read: media payloads (mdat, clusters, movi)
+    are skipped with a seek, so the number of reads does not grow with the
+    file size. Returns None when the container carries no creation date and
+    raises UnsupportedFormatError for anything else.
+    """
+    with open(file_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        signature = f.read(12)
+        if signature[4:8] in BMFF_TOP_LEVEL_BOXES:
+            return _read_bmff_date(f, file_size)
+        if signature.startswith(EBML_MAGIC):
+            return _read_ebml_date(f, file_size)
+        if signature[:4] == b'RIFF' and signature[8:12] == b'AVI ':
+            return _read_riff_date(f, file_size)
+    raise UnsupportedFormatError('Not an MP4/MOV, MKV or AVI file')
@@ -0,0 +1,126 @@
+"""Persistent cache of extracted creation dates.
+
+Entries are keyed by (device, inode) and validated against the file size and
+modification time, so files that have not changed since the last run are
+never reopened, and a modified file is re-extracted automatically. Each
+date is stored with its source ('exif', 'video', 'mtime', ...), so hits
+report where the date originally came from.
+"""
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'media-file-organizer',
+    'metadata.sqlite',
+)
+DEFAULT_MAX_ENTRIES = 2_000_000
+
+# Pending writes are flushed in one transaction every this many entries
+FLUSH_EVERY = 5000
+
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dates (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    source TEXT,
+    used INTEGER NOT NULL,
+    PRIMARY KEY (dev, ino)
+);
+CREATE INDEX IF NOT EXISTS dates_used ON dates (used);
+"""
+
+
+class MetadataCache:
+    """SQLite-backed map from a file's stat fingerprint to its creation date."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._run = int(time.time())
+        self._writes = []
+        self._touched = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        if self._db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self._db.executescript(f'DROP TABLE IF EXISTS dates; PRAGMA user_version={SCHEMA_VERSION};')
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, stat_result, skip=()):
+        """Return (creation date, source) cached for a file, or (None, None) if unknown or changed.
+
+        `stat_result` is an os.stat_result or anything with the same st_dev,
+        st_ino, st_size and st_mtime_ns attributes, such as a FileRecord.
+        Entries whose source is in `skip` count as misses.
+        """
+        if not stat_result.st_ino:
+            self.misses += 1
+            return None, None
+        row = self._db.execute(
+            'SELECT size, mtime_ns, created, source FROM dates WHERE dev = ? AND ino = ?',
+            (stat_result.st_dev, stat_result.st_ino)
+        ).fetchone()
+        if (row is None or row[0] != stat_result.st_size or row[1] != stat_result.st_mtime_ns
+                or row[3] in skip):
+            self.misses += 1
+            return None, None
+
+        self.hits += 1
+        self._touched.append((self._run, stat_result.st_dev, stat_result.st_ino))
+        if len(self._touched) >= FLUSH_EVERY:
+            self.flush()
+        return datetime.fromisoformat(row[2]), row[3]
+
+    def get(self, stat_result):
+        """Return the cached creation date for a file, or None if unknown or changed."""
+        return self.lookup(stat_result)[0]
+
+    def put(self, stat_result, creation_date, source=None):
+        """Record the creation date extracted for a file and where it came from."""
+        # Filesystems without stable inode numbers can't be fingerprinted
+        if not stat_result.st_ino:
+            return
+        self._writes.append((stat_result.st_dev, stat_result.st_ino, stat_result.st_size,
+                             stat_result.st_mtime_ns, creation_date.isoformat(), source, self._run))
+        if len(self._writes) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        """Write pending entries and access times in a single transaction."""
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO dates VALUES (?, ?, ?, ?, ?, ?, ?)', self._writes)
+            self._db.executemany('UPDATE dates SET used = ? WHERE dev = ? AND ino = ?', self._touched)
+        self._writes.clear()
+        self._touched.clear()
+
+    def evict(self):
+        """Drop the least recently used entries beyond the size cap."""
+        count = self._db.execute('SELECT COUNT(*) FROM dates').fetchone()[0]
+        if count > self.max_entries:
+            with self._db:
+                self._db.execute(
+                    'DELETE FROM dates WHERE rowid IN (SELECT rowid FROM dates ORDER BY used LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+
+    def close(self):
+        self.flush()
+        self.evict()
+        self._db.close()
@@ -0,0 +1,189 @@
+"""Latency histograms for the hot path of a run.
+
+Each step of processing a file (metadata extraction, destination lookup,
+name collision handling, directory creation, transfer) is timed and recorded
+in log-scale histograms, overall and broken down by file extension, by
+where the creation date came from and by transfer strategy. The slowest
+files are remembered so they can be profiled again after the run.
+"""
+import cProfile
+import heapq
+import json
+import os
+import time
+
+METRICS_VERSION = 1
+
+# Histogram buckets are powers of two in microseconds, up to about 70 minutes
+HISTOGRAM_BUCKETS = 32
+
+# Slowest files listed in the report even when none are profiled
+DEFAULT_SLOWEST = 10
+
+
+class Histogram:
+    """Log-scale latency histogram; percentiles are accurate to a factor of two."""
+
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        self.buckets[bucket] += 1
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples."""
+        if not self.count:
+            return None
+        threshold = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= threshold:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': round(self.total, 6),
+            'mean': round(self.total / self.count, 6) if self.count else None,
+            'min': round(self.min, 6) if self.min is not None else None,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': round(self.max, 6),
+            # [upper bound in seconds, samples] for every non-empty bucket
+            'buckets': [[(1 << bucket) / 1e6, count]
+                        for bucket, count in enumerate(self.buckets) if count],
+        }
+
+
+def _histograms_to_dict(histograms):
+    return {key: histogram.to_dict() for key, histogram in sorted(histograms.items())}
+
+
+class Metrics:
+    """Collects step latencies of a run, attributed to the file being processed.
+
+    Steps recorded between two calls to file_done belong to the same file;
+    the run's main loop calls file_done once a file has been fully handled.
+    """
+
+    def __init__(self, slowest=DEFAULT_SLOWEST):
+        self.files = 0
+        self.slowest = slowest
+        self._stages = {}
+        self._by_extension = {}
+        self._by_source = {}
+        self._by_strategy = {}
+        self._slowest = []
+        self._file_seconds = 0.0
+        self._file_steps = {}
+
+    def record(self, stage, seconds, extension=None):
+        """Record the duration of one step of the current file."""
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = Histogram()
+        histogram.record(seconds)
+        if extension is not None:
+            by_extension = self._by_extension.setdefault(stage, {})
+            histogram = by_extension.get(extension)
+            if histogram is None:
+                histogram = by_extension[extension] = Histogram()
+            histogram.record(seconds)
+        self._file_seconds += seconds
+        self._file_steps[stage] = self._file_steps.get(stage, 0.0) + seconds
+
+    def record_run(self, stage, seconds):
+        """Record a step of the run as a whole, such as discovery, not attributed to any file."""
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = Histogram()
+        histogram.record(seconds)
+
+    def record_source(self, source, seconds):
+        """Record the total extraction time of a file by where its date came from."""
+        self._by_source.setdefault(source, Histogram()).record(seconds)
+
+    def record_strategy(self, strategy, seconds):
+        """Record the transfer time of a file by transfer strategy."""
+        self._by_strategy.setdefault(strategy, Histogram()).record(seconds)
+
+    def file_done(self, path):
+        """Close the current file; `path` is where it can be found after the run."""
+        self.files += 1
+        if self.slowest:
+            item = (self._file_seconds, self.files, os.fspath(path), self._file_steps)
+            if len(self._slowest) < self.slowest:
+                heapq.heappush(self._slowest, item)
+            elif item[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+        self._file_seconds = 0.0
+        self._file_steps = {}
+
+    def slowest_files(self):
+        """Return (seconds, path, steps) of the slowest files, slowest first."""
+        return [(seconds, path, steps)
+                for seconds, _, path, steps in sorted(self._slowest, reverse=True)]
+
+    def to_dict(self):
+        return {
+            'version': METRICS_VERSION,
+            'files': self.files,
+            'stages': _histograms_to_dict(self._stages),
+            'by_extension': {stage: _histograms_to_dict(histograms)
+                             for stage, histograms in sorted(self._by_extension.items())},
+            'by_source': _histograms_to_dict(self._by_source),
+            'by_strategy': _histograms_to_dict(self._by_strategy),
+            'slowest': [{'path': path, 'seconds': round(seconds, 6),
+                         'steps': {stage: round(value, 6) for stage, value in steps.items()}}
+                        for seconds, path, steps in self.slowest_files()],
+        }
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write('\n')
+
+    def profile_slowest(self, func, directory, count):
+        """Run `func(path)` under cProfile for the `count` slowest files.
+
+        One .prof file per file is written to `directory`, named by rank, for
+        use with pstats or snakeviz. Returns the paths written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        written = []
+        for rank, (_, path, _) in enumerate(self.slowest_files()[:count], 1):
+            if not os.path.exists(path):
+                continue
+            profile = cProfile.Profile()
+            profile.runcall(func, path)
+            out_path = os.path.join(directory, f"{rank:02d}-{os.path.basename(path)}.prof")
+            profile.dump_stats(out_path)
+            written.append(out_path)
+        return written
+
+
+def timed(metrics, stage, func, *args, extension=None):
+    """Call `func(*args)`, recording its duration in `metrics` when metrics are enabled."""
+    if metrics is None:
+        return func(*args)
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        metrics.record(stage, time.perf_counter() - start, extension)
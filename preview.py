@@ -0,0 +1,284 @@
+"""Dry-run preview for the GUI that stays fast for very large plans.
+
+PlanPreview groups planned files by destination folder (date and category)
+and keeps a flat index of the rows currently visible, so any row is found
+by a binary search over the folders instead of being stored in a widget.
+PreviewView draws only the rows that fit in its window; scrolling through a
+plan of 200k files costs the same as scrolling through 200.
+"""
+import os
+import threading
+from bisect import bisect_right, insort
+
+import tkinter as tk
+import tkinter.font as tkfont
+
+# Kinds of entries the preview can be restricted to
+KINDS = {
+    'all': None,
+    'planned': ('move', 'copy', 'link', 'hardlink'),
+    'skipped': ('skip',),
+    'errors': ('error',),
+}
+
+# Groups for entries without a destination, listed after the date folders
+SKIPPED_GROUP = 'Skipped'
+ERRORS_GROUP = 'Errors'
+
+# Milliseconds to wait after the last keystroke before filtering again
+FILTER_DELAY_MS = 200
+
+ERROR_COLOR = '#D13438'
+
+
+class _Folder:
+    __slots__ = ('key', 'rows', 'shown', 'expanded')
+
+    def __init__(self, key):
+        self.key = key
+        self.rows = []
+        self.shown = []
+        self.expanded = False
+
+
+class PlanPreview:
+    """Planned files grouped by destination folder, with filtering.
+
+    add() may be called from any thread; everything else belongs to the Tk
+    thread. Rows added are picked up by update(), which only does work in
+    proportion to the new rows and the number of folders.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = os.fspath(base_dir)
+        self.total = 0
+        self._lock = threading.Lock()
+        self._pending = []
+        self._folders = {}
+        self._order = []
+        self._starts = []
+        self._visible = []
+        self._length = 0
+        self._text = ''
+        self._kinds = None
+        self._dirty = False
+
+    def add(self, src, dst, action, note=None):
+        """Queue one plan entry for the preview."""
+        with self._lock:
+            self._pending.append((src, dst, action, note))
+
+    def _group(self, dst, action):
+        if dst is None:
+            return (1, ERRORS_GROUP) if action == 'error' else (1, SKIPPED_GROUP)
+        return (0, os.path.relpath(os.path.dirname(dst), self.base_dir))
+
+    def _matches(self, row):
+        src, name, action, note = row
+        if self._kinds is not None and action not in self._kinds:
+            return False
+        return not self._text or self._text in src.lower() or self._text in name.lower()
+
+    def update(self):
+        """Take in rows added since the last call; returns True if the view changed."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for src, dst, action, note in pending:
+            order_key = self._group(dst, action)
+            folder = self._folders.get(order_key)
+            if folder is None:
+                folder = self._folders[order_key] = _Folder(order_key[1])
+                insort(self._order, order_key)
+            row = (src, os.path.basename(dst) if dst else '', action, note)
+            folder.rows.append(row)
+            if self._matches(row):
+                folder.shown.append(row)
+        if pending:
+            self.total += len(pending)
+            self._dirty = True
+        if self._dirty:
+            self._layout()
+            self._dirty = False
+            return True
+        return False
+
+    def set_filter(self, text='', kind='all'):
+        """Show only rows whose source or destination name contains `text`, of one kind."""
+        self._text = text.strip().lower()
+        self._kinds = KINDS[kind]
+        for folder in self._folders.values():
+            folder.shown = [row for row in folder.rows if self._matches(row)]
+        self._dirty = True
+
+    def expand_all(self, expanded=True):
+        for folder in self._folders.values():
+            folder.expanded = expanded
+        self._dirty = True
+
+    def _layout(self):
+        # Folders without matching rows are hidden while a filter is active
+        filtering = bool(self._text) or self._kinds is not None
+        self._starts = []
+        self._visible = []
+        position = 0
+        for order_key in self._order:
+            folder = self._folders[order_key]
+            if filtering and not folder.shown:
+                continue
+            self._starts.append(position)
+            self._visible.append(folder)
+            position += 1 + (len(folder.shown) if folder.expanded else 0)
+        self._length = position
+
+    def __len__(self):
+        return self._length
+
+    def folder_count(self):
+        return len(self._starts)
+
+    def _locate(self, index):
+        j = bisect_right(self._starts, index) - 1
+        return self._visible[j], index - self._starts[j]
+
+    def row(self, index):
+        """Return (text, kind) of a visible row; kind is 'folder' or the entry's action."""
+        folder, offset = self._locate(index)
+        if offset == 0:
+            marker = '▾' if folder.expanded else '▸'
+            count = f"{len(folder.shown)} files"
+            if len(folder.shown) != len(folder.rows):
+                count = f"{len(folder.shown)} of {len(folder.rows)} files"
+            return f"{marker} {folder.key}   ({count})", 'folder'
+        src, name, action, note = folder.shown[offset - 1]
+        if note:
+            return f"      {src}   ({note})", action
+        return f"      {src}  →  {name}", action
+
+    def toggle(self, index):
+        """Expand or collapse the folder of a header row; returns True if it was one."""
+        folder, offset = self._locate(index)
+        if offset != 0:
+            return False
+        folder.expanded = not folder.expanded
+        self._layout()
+        return True
+
+
+class PreviewView(tk.Frame):
+    """Scrollable view of a PlanPreview that draws only the rows on screen."""
+
+    def __init__(self, master, colors, font=('SF Pro Display', 12), **kwargs):
+        super().__init__(master, bg=colors['bg'], **kwargs)
+        self.colors = colors
+        self.model = None
+        self.top = 0
+        self._filter_job = None
+        self._font = tkfont.Font(font=font)
+        self._bold = tkfont.Font(font=font, weight='bold')
+        self._row_height = self._font.metrics('linespace') + 4
+
+        toolbar = tk.Frame(self, bg=colors['bg'])
+        toolbar.pack(fill='x', pady=(0, 5))
+        tk.Label(toolbar, text="Search:", font=font, bg=colors['bg'], fg=colors['fg']).pack(side='left')
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add('write', lambda *_: self._schedule_filter())
+        tk.Entry(toolbar, textvariable=self.search_var, font=font, bg=colors['input_bg'],
+                 fg=colors['input_fg'], insertbackground=colors['input_fg']).pack(side='left', padx=5)
+        self.kind_var = tk.StringVar(value='all')
+        kind_menu = tk.OptionMenu(toolbar, self.kind_var, *KINDS, command=lambda _: self._apply_filter())
+        kind_menu.configure(font=font, bg=colors['input_bg'], fg=colors['input_fg'],
+                            activebackground=colors['button_active_bg'], highlightthickness=0)
+        kind_menu.pack(side='left', padx=5)
+        for text, expanded in (("Expand all", True), ("Collapse all", False)):
+            tk.Button(toolbar, text=text, font=font, bg=colors['button_bg'], fg=colors['button_fg'],
+                      activebackground=colors['button_active_bg'], relief='flat', padx=10,
+                      command=lambda expanded=expanded: self._expand_all(expanded)).pack(side='left', padx=(0, 5))
+        self.summary = tk.Label(toolbar, font=font, bg=colors['bg'], fg=colors['fg'])
+        self.summary.pack(side='right')
+
+        body = tk.Frame(self, bg=colors['bg'])
+        body.pack(fill='both', expand=True)
+        self.scrollbar = tk.Scrollbar(body, command=self._yview)
+        self.scrollbar.pack(side='right', fill='y')
+        self.canvas = tk.Canvas(body, bg=colors['input_bg'], highlightthickness=1,
+                                highlightbackground=colors['border'])
+        self.canvas.pack(side='left', fill='both', expand=True)
+        self.canvas.bind('<Configure>', lambda _: self.redraw())
+        self.canvas.bind('<Button-1>', self._click)
+        self.canvas.bind('<MouseWheel>', self._wheel)
+        self.canvas.bind('<Button-4>', lambda _: self._scroll(-3))
+        self.canvas.bind('<Button-5>', lambda _: self._scroll(3))
+
+    def set_model(self, model):
+        self.model = model
+        self.top = 0
+        self._apply_filter()
+
+    def refresh(self):
+        """Pick up new rows; called once per GUI frame."""
+        if self.model is not None and self.model.update():
+            self.redraw()
+
+    def _page_size(self):
+        return max(1, self.canvas.winfo_height() // self._row_height)
+
+    def redraw(self):
+        self.canvas.delete('all')
+        if self.model is None:
+            return
+        length = len(self.model)
+        page = self._page_size()
+        self.top = max(0, min(self.top, length - page))
+        for line, index in enumerate(range(self.top, min(self.top + page + 1, length))):
+            text, kind = self.model.row(index)
+            color = ERROR_COLOR if kind == 'error' else self.colors['input_fg']
+            self.canvas.create_text(8, line * self._row_height + 2, text=text, anchor='nw', fill=color,
+                                    font=self._bold if kind == 'folder' else self._font)
+        if length:
+            self.scrollbar.set(self.top / length, min(1.0, (self.top + page) / length))
+        else:
+            self.scrollbar.set(0, 1)
+        self.summary['text'] = f"{self.model.total} files in {self.model.folder_count()} folders"
+
+    def _scroll(self, rows):
+        self.top += rows
+        self.redraw()
+
+    def _yview(self, *args):
+        if self.model is None:
+            return
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.model))
+        elif args[0] == 'scroll':
+            step = self._page_size() if args[2] == 'pages' else 1
+            self.top += int(args[1]) * step
+        self.redraw()
+
+    def _wheel(self, event):
+        self._scroll(-3 if event.delta > 0 else 3)
+
+    def _click(self, event):
+        if self.model is None:
+            return
+        index = self.top + event.y // self._row_height
+        if index < len(self.model) and self.model.toggle(index):
+            self.redraw()
+
+    def _schedule_filter(self):
+        if self._filter_job is not None:
+            self.after_cancel(self._filter_job)
+        self._filter_job = self.after(FILTER_DELAY_MS, self._apply_filter)
+
+    def _apply_filter(self):
+        self._filter_job = None
+        if self.model is not None:
+            self.model.set_filter(self.search_var.get(), self.kind_var.get())
+            self.top = 0
+            self.model.update()
+            self.redraw()
+
+    def _expand_all(self, expanded):
+        if self.model is not None:
+            self.model.expand_all(expanded)
+            self.model.update()
+            self.redraw()
@@ -1,24 +1,93 @@
 import os
 os.environ['TK_SILENCE_DEPRECATION'] = '1'
 
-import shutil
-from datetime import datetime
 import logging
-from pathlib import Path
-from PIL import Image
-import piexif
-from hachoir.parser import createParser
-from hachoir.metadata import extractMetadata
+from manifest import Manifest
+from metadata_cache import MetadataCache
+from preview import PlanPreview, PreviewView
+from script_v2 import OrganizerEngine, manifest_settings
+from storage import IOScheduler
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from threading import Thread
-import queue
+from threading import Lock, Thread
+from collections import deque
 import platform
 import darkdetect
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Log and progress refreshes per second
+GUI_FPS = 10
+# Lines kept in the log window; older lines are dropped
+LOG_MAX_LINES = 5000
+# Metadata extraction worker processes used by the engine
+GUI_WORKERS = min(8, os.cpu_count() or 1)
+
+# Log detail choices and the lowest message level each one shows
+VERBOSITY_LEVELS = {
+    'all files': logging.INFO,
+    'warnings': logging.WARNING,
+    'errors': logging.ERROR,
+}
+
+class LogRelay:
+    """Hands log lines and progress from the worker thread to the Tk loop.
+
+    The worker posts as often as it likes; the Tk loop collects everything
+    posted since the last frame in one call. Pending lines are kept in a
+    ring buffer, so a stalled window never holds more than `max_lines`
+    of them, and progress updates simply overwrite each other. Every line,
+    whatever the verbosity, can be spilled to a log file.
+    """
+
+    def __init__(self, max_lines=LOG_MAX_LINES, min_level=logging.INFO):
+        self.min_level = min_level
+        self.dropped = 0
+        self._lock = Lock()
+        self._lines = deque(maxlen=max_lines)
+        self._progress = None
+        self._spill = None
+
+    def open_spill(self, path):
+        """Start writing every posted line to `path`."""
+        self.close_spill()
+        self._spill = open(path, 'a', encoding='utf-8')
+
+    def close_spill(self):
+        with self._lock:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+
+    def spill(self, message):
+        """Write a line to the log file only."""
+        with self._lock:
+            if self._spill is not None:
+                self._spill.write(message + "\n")
+
+    def post(self, message, level=logging.INFO):
+        """Queue a log line; a `level` of None is shown at every verbosity."""
+        with self._lock:
+            if self._spill is not None:
+                self._spill.write(message + "\n")
+            if level is None or level >= self.min_level:
+                if len(self._lines) == self._lines.maxlen:
+                    self.dropped += 1
+                self._lines.append(message)
+
+    def set_progress(self, percent):
+        self._progress = percent
+
+    def collect(self):
+        """Return (lines, progress, dropped) posted since the last call."""
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            progress, self._progress = self._progress, None
+            dropped, self.dropped = self.dropped, 0
+        return lines, progress, dropped
+
 class MediaOrganizerGUI:
     def __init__(self, root):
         self.root = root
@@ -137,6 +206,52 @@ class MediaOrganizerGUI:
                       selectcolor=self.colors['checkbox_bg'],
                       activebackground=self.colors['frame_bg'],
                       activeforeground=self.colors['fg']).pack(anchor='w')
+
+        self.cache_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(options_frame,
+                      text="Use metadata cache",
+                      variable=self.cache_var,
+                      font=('SF Pro Display', 12),
+                      bg=self.colors['frame_bg'],
+                      fg=self.colors['fg'],
+                      selectcolor=self.colors['checkbox_bg'],
+                      activebackground=self.colors['frame_bg'],
+                      activeforeground=self.colors['fg']).pack(anchor='w', pady=(5, 0))
+
+        self.spill_var = tk.BooleanVar()
+        tk.Checkbutton(options_frame,
+                      text="Save full log to file",
+                      variable=self.spill_var,
+                      font=('SF Pro Display', 12),
+                      bg=self.colors['frame_bg'],
+                      fg=self.colors['fg'],
+                      selectcolor=self.colors['checkbox_bg'],
+                      activebackground=self.colors['frame_bg'],
+                      activeforeground=self.colors['fg']).pack(anchor='w', pady=(5, 0))
+
+        # Log detail, applied to new lines as soon as it changes
+        verbosity_frame = tk.Frame(options_frame, bg=self.colors['frame_bg'])
+        verbosity_frame.pack(fill='x', pady=(5, 0))
+
+        tk.Label(verbosity_frame,
+                text="Log detail:",
+                font=('SF Pro Display', 12),
+                bg=self.colors['frame_bg'],
+                fg=self.colors['fg']).pack(side='left')
+
+        self.verbosity_var = tk.StringVar(value="all files")
+        verbosity_menu = tk.OptionMenu(verbosity_frame, self.verbosity_var, *VERBOSITY_LEVELS,
+                                       command=self.set_verbosity)
+        verbosity_menu.configure(font=('SF Pro Display', 12),
+                               bg=self.colors['input_bg'],
+                               fg=self.colors['input_fg'],
+                               activebackground=self.colors['button_active_bg'],
+                               activeforeground=self.colors['button_fg'],
+                               highlightthickness=1,
+                               highlightbackground=self.colors['border'])
+        verbosity_menu["menu"].configure(bg=self.colors['input_bg'],
+                                       fg=self.colors['input_fg'])
+        verbosity_menu.pack(side='left', padx=5)
         
         # Progress section
         progress_frame = tk.Frame(main_frame, bg=self.colors['bg'])
@@ -158,9 +273,13 @@ class MediaOrganizerGUI:
                                           style='Custom.Horizontal.TProgressbar')
         self.progress_bar.pack(fill='x')
         
+        # The log, and the preview filled by dry runs
+        self.notebook = ttk.Notebook(main_frame)
+        self.notebook.pack(fill='both', expand=True, pady=10)
+
         # Status text with improved visibility
-        status_frame = tk.Frame(main_frame, bg=self.colors['bg'])
-        status_frame.pack(fill='both', expand=True, pady=10)
+        status_frame = tk.Frame(self.notebook, bg=self.colors['bg'])
+        self.notebook.add(status_frame, text="Log")
         
         # Add scrollbar to status text
         scrollbar = tk.Scrollbar(status_frame)
@@ -179,6 +298,10 @@ class MediaOrganizerGUI:
                                  yscrollcommand=scrollbar.set)
         self.status_text.pack(side='left', fill='both', expand=True)
         scrollbar.config(command=self.status_text.yview)
+
+        # Only the rows on screen are drawn, so very large plans stay responsive
+        self.preview = PreviewView(self.notebook, self.colors)
+        self.notebook.add(self.preview, text="Preview")
         
         # Control buttons with improved styling
         button_frame = tk.Frame(main_frame, bg=self.colors['bg'])
@@ -196,6 +319,34 @@ class MediaOrganizerGUI:
                                     padx=15,
                                     pady=5)
         self.start_button.pack(side='left', padx=5)
+
+        self.pause_button = tk.Button(button_frame,
+                                    text="Pause",
+                                    command=self.toggle_pause,
+                                    state='disabled',
+                                    font=('SF Pro Display', 12),
+                                    bg=self.colors['button_bg'],
+                                    fg=self.colors['button_fg'],
+                                    activebackground=self.colors['button_active_bg'],
+                                    activeforeground=self.colors['button_fg'],
+                                    relief='flat',
+                                    padx=15,
+                                    pady=5)
+        self.pause_button.pack(side='left', padx=(0, 5))
+
+        self.cancel_button = tk.Button(button_frame,
+                                     text="Cancel",
+                                     command=self.cancel_organization,
+                                     state='disabled',
+                                     font=('SF Pro Display', 12),
+                                     bg=self.colors['button_bg'],
+                                     fg=self.colors['button_fg'],
+                                     activebackground=self.colors['button_active_bg'],
+                                     activeforeground=self.colors['button_fg'],
+                                     relief='flat',
+                                     padx=15,
+                                     pady=5)
+        self.cancel_button.pack(side='left', padx=(0, 5))
         
         tk.Button(button_frame,
                  text="Clear Log",
@@ -209,9 +360,14 @@ class MediaOrganizerGUI:
                  padx=15,
                  pady=5).pack(side='left')
         
-        # Message queue for thread communication
-        self.message_queue = queue.Queue()
-        self.root.after(100, self.check_queue)
+        # Log lines and progress from the worker thread, shown once per frame
+        self.relay = LogRelay()
+        self.root.after(1000 // GUI_FPS, self.check_queue)
+
+        # The running engine and its thread, if any
+        self.engine = None
+        self.worker = None
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def get_color_scheme(self):
         if self.is_dark_mode:
@@ -259,21 +415,30 @@ class MediaOrganizerGUI:
         self.status_text.delete(1.0, tk.END)
         self.progress_var.set(0)
 
+    def set_verbosity(self, choice):
+        self.relay.min_level = VERBOSITY_LEVELS[choice]
+
     def log_message(self, message):
-        self.status_text.insert(tk.END, message + "\n")
+        self.log_lines([message])
+
+    def log_lines(self, lines):
+        # One insert per frame, then trim the widget back to its line cap
+        self.status_text.insert(tk.END, "\n".join(lines) + "\n")
+        line_count = int(self.status_text.index('end-1c').split('.')[0])
+        if line_count > LOG_MAX_LINES:
+            self.status_text.delete('1.0', f'{line_count - LOG_MAX_LINES}.0')
         self.status_text.see(tk.END)
 
     def check_queue(self):
-        try:
-            while True:
-                message, progress = self.message_queue.get_nowait()
-                self.log_message(message)
-                if progress is not None:
-                    self.progress_var.set(progress)
-                self.message_queue.task_done()
-        except queue.Empty:
-            pass
-        self.root.after(100, self.check_queue)
+        lines, progress, dropped = self.relay.collect()
+        if dropped:
+            lines.insert(0, f"... {dropped} earlier lines not shown ...")
+        if lines:
+            self.log_lines(lines)
+        self.preview.refresh()
+        if progress is not None:
+            self.progress_var.set(progress)
+        self.root.after(1000 // GUI_FPS, self.check_queue)
 
     def start_organization(self):
         directory = self.dir_entry.get()
@@ -285,130 +450,129 @@ class MediaOrganizerGUI:
             messagebox.showerror("Error", "Selected directory does not exist!")
             return
         
+        if self.spill_var.get():
+            log_path = filedialog.asksaveasfilename(title="Save full log as",
+                                                    defaultextension=".log",
+                                                    filetypes=[("Log files", "*.log"), ("All files", "*")])
+            if not log_path:
+                return
+            try:
+                self.relay.open_spill(log_path)
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not open log file: {e}")
+                return
+
         self.start_button["state"] = "disabled"
+        self.pause_button.config(state='normal', text="Pause")
+        self.cancel_button["state"] = "normal"
         self.progress_var.set(0)
-        
-        thread = Thread(target=self.process_files,
+
+        # Dry runs fill the preview as dates are extracted instead of the log
+        plan = None
+        if self.dry_run_var.get():
+            plan = PlanPreview(directory)
+            self.preview.set_model(plan)
+            self.notebook.select(self.preview)
+
+        self.worker = Thread(target=self.process_files,
                        args=(directory,
                              self.organize_var.get(),
                              self.copy_var.get(),
-                             self.dry_run_var.get()))
-        thread.daemon = True
-        thread.start()
+                             self.dry_run_var.get(),
+                             self.cache_var.get(),
+                             plan))
+        self.worker.daemon = True
+        self.worker.start()
+
+    def toggle_pause(self):
+        if self.engine is None:
+            return
+        if self.engine.paused:
+            self.engine.resume()
+            self.pause_button["text"] = "Pause"
+            self.relay.post("Resumed", None)
+        else:
+            self.engine.pause()
+            self.pause_button["text"] = "Resume"
+            self.relay.post("Paused", None)
+
+    def cancel_organization(self):
+        if self.engine is not None:
+            # Stops before the next file; the file being moved is finished first
+            self.engine.cancel()
+            self.cancel_button["state"] = "disabled"
+            self.pause_button["state"] = "disabled"
 
-    def process_files(self, directory, organize_by, copy, dry_run):
+    def run_finished(self):
+        self.engine = None
+        self.start_button["state"] = "normal"
+        self.pause_button.config(state='disabled', text="Pause")
+        self.cancel_button["state"] = "disabled"
+
+    def on_close(self):
+        # Let the current file finish so nothing is left half moved
+        if self.engine is not None:
+            self.engine.cancel()
+            self.worker.join(timeout=5)
+        self.root.destroy()
+
+    def process_files(self, directory, organize_by, copy, dry_run, use_cache=True, plan=None):
+        cache = None
+        manifest = None
+        scheduler = None
         try:
-            files = list(Path(directory).rglob('*'))
-            files = [f for f in files if f.is_file()]
-            total_files = len(files)
-            processed = 0
-            
-            stats = {'moved': 0, 'skipped': 0, 'errors': 0}
-            
-            for file_path in files:
-                try:
-                    if file_path.name.startswith('.'):
-                        stats['skipped'] += 1
-                        continue
-
-                    creation_date = get_creation_date(str(file_path))
-                    dest_path = get_destination_path(str(file_path), directory,
-                                                   creation_date, organize_by)
-
-                    if dest_path.exists():
-                        dest_path = handle_duplicate(dest_path)
-
-                    dest_path.parent.mkdir(parents=True, exist_ok=True)
-
-                    action = "Would move" if dry_run else "Moving"
-                    message = f"{action} '{file_path}' to '{dest_path}'"
-                    self.message_queue.put((message, (processed / total_files) * 100))
-
-                    if not dry_run:
-                        if copy:
-                            shutil.copy2(file_path, dest_path)
-                        else:
-                            shutil.move(file_path, dest_path)
-                        stats['moved'] += 1
-
-                except Exception as e:
-                    error_msg = f"Error processing {file_path}: {e}"
-                    self.message_queue.put((error_msg, None))
-                    stats['errors'] += 1
-
-                processed += 1
-
-            summary = "\nOperation completed:\n"
+            # SQLite connections are bound to the thread that opens them
+            if use_cache:
+                cache = MetadataCache()
+            if os.path.isdir(directory):
+                manifest = Manifest(directory, readonly=dry_run,
+                                    settings=manifest_settings(organize_by, copy))
+                scheduler = IOScheduler.for_directory(directory, GUI_WORKERS)
+
+            # The same engine as the command line, with parallel extraction in
+            # supervised processes so a bad file cannot stall the run
+            self.engine = OrganizerEngine(directory, organize_by, copy, dry_run,
+                                          workers=GUI_WORKERS, executor='isolated',
+                                          cache=cache, manifest=manifest, scheduler=scheduler)
+            for event in self.engine:
+                message = f"[{event.processed}/{event.discovered} discovered] {event.message}"
+                if plan is not None:
+                    plan.add(event.src, event.dst, event.action,
+                             event.error or ('skipped' if event.action == 'skip' else None))
+                if plan is None or event.level >= logging.WARNING:
+                    self.relay.post(message, event.level)
+                else:
+                    self.relay.spill(message)
+                self.relay.set_progress((event.processed / max(event.discovered, 1)) * 100)
+
+            stats = self.engine.stats
+            summary = "\nOperation cancelled:\n" if self.engine.cancelled else "\nOperation completed:\n"
             summary += f"Files processed: {stats['moved']}\n"
             summary += f"Files skipped: {stats['skipped']}\n"
+            if manifest is not None:
+                summary += f"Files already organized: {stats['unchanged']}\n"
             summary += f"Errors encountered: {stats['errors']}"
-            self.message_queue.put((summary, 100))
+            if stats.get('failed_files'):
+                summary += f"\nFiles dated without metadata after extraction failed: {len(stats['failed_files'])}"
+            if stats.get('date_sources'):
+                sources = ', '.join(f"{name}: {count}" for name, count in sorted(stats['date_sources'].items()))
+                summary += f"\nDates from: {sources}"
+            if cache is not None:
+                summary += f"\nCache hits: {stats['cache_hits']}"
+                summary += f"\nCache misses: {stats['cache_misses']}"
+            self.relay.post(summary, None)
+            if not self.engine.cancelled:
+                self.relay.set_progress(100)
 
         except Exception as e:
-            self.message_queue.put((f"An error occurred: {e}", None))
+            self.relay.post(f"An error occurred: {e}", logging.ERROR)
         finally:
-            self.root.after(0, lambda: setattr(self.start_button, 'state', 'normal'))
-
-def get_creation_date(file_path):
-    """Extract creation date from file metadata."""
-    try:
-        if any(file_path.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.arw', '.dng', '.heic', '.raw']):
-            try:
-                img = Image.open(file_path)
-                if 'exif' in img.info:
-                    exif_dict = piexif.load(img.info['exif'])
-                    if piexif.ExifIFD.DateTimeOriginal in exif_dict['Exif']:
-                        date_str = exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal].decode('utf-8')
-                        return datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-            except Exception as e:
-                logging.warning(f"Could not read EXIF data from {file_path}: {e}")
-
-        if any(file_path.lower().endswith(ext) for ext in ['.mov', '.mp4', '.avi', '.mkv', '.wmv']):
-            try:
-                parser = createParser(file_path)
-                if parser:
-                    metadata = extractMetadata(parser)
-                    if metadata and metadata.has('creation_date'):
-                        return metadata.get('creation_date')
-            except Exception as e:
-                logging.warning(f"Could not read video metadata from {file_path}: {e}")
-
-        return datetime.fromtimestamp(os.path.getmtime(file_path))
-    except Exception as e:
-        logging.error(f"Error getting creation date for {file_path}: {e}")
-        return datetime.fromtimestamp(os.path.getmtime(file_path))
-
-def get_destination_path(file_path, base_dir, creation_date, organize_by='date'):
-    """Determine the destination path for a file."""
-    file_name = os.path.basename(file_path)
-    file_ext = os.path.splitext(file_name)[1].lower()
-
-    if file_ext in ['.mov', '.mp4', '.avi', '.mkv', '.wmv']:
-        category = 'videos'
-    elif file_ext in ['.jpg', '.jpeg', '.png', '.arw', '.dng', '.heic', '.raw']:
-        category = 'photos'
-    else:
-        category = 'others'
-
-    if organize_by == 'date':
-        date_path = creation_date.strftime('%Y-%m-%d')
-    elif organize_by == 'year_month':
-        date_path = creation_date.strftime('%Y/%m')
-    else:  # year_month_day
-        date_path = creation_date.strftime('%Y/%m/%d')
-
-    return Path(base_dir) / date_path / category / file_name
-
-def handle_duplicate(dest_path, counter=1):
-    """Handle duplicate filenames by adding a counter."""
-    while dest_path.exists():
-        base_name = dest_path.stem
-        if ' (' in base_name:
-            base_name = base_name.rsplit(' (', 1)[0]
-        new_name = f"{base_name} ({counter}){dest_path.suffix}"
-        dest_path = dest_path.parent / new_name
-        counter += 1
-    return dest_path
+            if cache is not None:
+                cache.close()
+            if manifest is not None:
+                manifest.close()
+            self.relay.close_spill()
+            self.root.after(0, self.run_finished)
 
 if __name__ == '__main__':
     root = tk.Tk()
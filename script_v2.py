@@ -1,14 +1,36 @@
 import os
-import shutil
+import sys
+import time
 from datetime import datetime
 import argparse
+import json
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 from pathlib import Path
-from tqdm import tqdm
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 import logging
-from PIL import Image
-import piexif
-from hachoir.parser import createParser
-from hachoir.metadata import extractMetadata
+from extractors import CATEGORIES, category_code, extract_date, register_extra_formats
+from dedupe import DEDUPE_MODES, DuplicateFinder
+from dest_index import DEFAULT_MAX_DIRECTORIES, DestinationIndex
+from discovery import Discovery, DiscoveryGuard
+from event_log import LEVELS, EventLog, queued_logging
+from filename_dates import CONFLICT, CROSS_CHECK, POLICIES, FilenameDates
+from filename_dates import SOURCE as FILENAME_SOURCE
+from isolation import DEFAULT_FILE_TIMEOUT, DEFAULT_MAX_RSS_MB, FAILURE_REASONS
+from journal import (ACTION_LABELS, EXECUTABLE_ACTIONS, apply_plan, count_strategy, execute_entry,
+                     make_entry, parse_shard, read_plan_header, record_entry, write_plan)
+from manifest import MANIFEST_FILES, MANIFEST_NAME, Manifest
+from metadata_cache import DEFAULT_CACHE_PATH, DEFAULT_MAX_ENTRIES, MetadataCache
+from metrics import DEFAULT_SLOWEST, Metrics, timed
+from storage import DEVICE_CLASSES, IOScheduler, parse_rate
+from transfer import VERIFY_MODES, Verifier
+from watcher import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_SECONDS, REMOVED, Debouncer, open_watcher
 
 # Configure logging
 logging.basicConfig(
@@ -16,55 +38,122 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# File type configurations
-SUPPORTED_FORMATS = {
-    'videos': ('.mov', '.mp4', '.avi', '.mkv', '.wmv'),
-    'photos': ('.jpg', '.jpeg', '.png', '.arw', '.dng', '.heic', '.raw'),
-    'others': ()  # Will catch all other files
+def _process_pool(max_workers):
+    # Imported on first use; most runs never start worker processes
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+def _isolated_pool(max_workers, timeout=DEFAULT_FILE_TIMEOUT, max_rss_mb=DEFAULT_MAX_RSS_MB):
+    from isolation import IsolatedPool
+    return IsolatedPool(max_workers, _fallback_date, timeout, max_rss_mb)
+
+# Pool types available for the metadata extraction stage
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': _process_pool,
+    'isolated': _isolated_pool,
 }
 
-def get_creation_date(file_path):
-    """Extract creation date from file metadata."""
+def isolated_executor(timeout=DEFAULT_FILE_TIMEOUT, max_rss_mb=DEFAULT_MAX_RSS_MB):
+    """Executor running extraction in supervised processes with the given limits per file.
+
+    Files that take longer than `timeout` seconds or make a worker exceed
+    `max_rss_mb` are dated by their modification time, and the worker is
+    replaced. Can be passed wherever an executor name is accepted.
+    """
+    return partial(_isolated_pool, timeout=timeout, max_rss_mb=max_rss_mb)
+
+def _make_pool(executor, workers):
+    """Create the extraction pool, or None to extract on the calling thread."""
+    if callable(executor):
+        return executor(max_workers=workers)
+    # Isolation is worth a process even for a single worker
+    if workers > 1 or executor == 'isolated':
+        return EXECUTORS[executor](max_workers=workers)
+    return None
+
+# Files handed to a worker per task; keeps pool overhead low for small files
+EXTRACT_BATCH_SIZE = 32
+
+def classify(file_name):
+    """Return the category code for a file name (see extractors.register_format)."""
+    return category_code(file_name)
+
+def _progress_bar(**kwargs):
+    """Create a tqdm progress bar; tqdm is only imported when a bar is shown."""
+    from tqdm import tqdm
+    return tqdm(**kwargs)
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where unsupported."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _step(timings, step, func, file_path):
+    """Call an extraction step, adding its duration to `timings` when given."""
+    if timings is None:
+        return func(file_path)
+    start = time.perf_counter()
     try:
-        # Try to get date from EXIF for images
-        if any(file_path.lower().endswith(ext) for ext in SUPPORTED_FORMATS['photos']):
-            try:
-                img = Image.open(file_path)
-                if 'exif' in img.info:
-                    exif_dict = piexif.load(img.info['exif'])
-                    if piexif.ExifIFD.DateTimeOriginal in exif_dict['Exif']:
-                        date_str = exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal].decode('utf-8')
-                        return datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-            except Exception as e:
-                logging.warning(f"Could not read EXIF data from {file_path}: {e}")
+        return func(file_path)
+    finally:
+        timings[step] = timings.get(step, 0.0) + time.perf_counter() - start
 
-        # Try to get date from video metadata
-        if any(file_path.lower().endswith(ext) for ext in SUPPORTED_FORMATS['videos']):
-            try:
-                parser = createParser(file_path)
-                if parser:
-                    metadata = extractMetadata(parser)
-                    if metadata and metadata.has('creation_date'):
-                        return metadata.get('creation_date')
-            except Exception as e:
-                logging.warning(f"Could not read video metadata from {file_path}: {e}")
+def extract_creation_date(file_path, mtime=None, timings=None, names=None):
+    """Extract creation date from file metadata, returning (date, source).
+
+    `source` tells where the date came from: the source of the extractor
+    that found it (e.g. 'exif' or 'video'), 'filename' or 'mtime'.
+    `mtime` is the modification time from an earlier stat of the file, used
+    for the fallback instead of statting the file again. When `timings` is a
+    dict, the duration of every extraction step is added to it. `names` is
+    an optional FilenameDates: a date in the file name is used before the
+    metadata or after it, depending on its policy, and always before the
+    modification time.
+    """
+    try:
+        named = None
+        if names is not None:
+            named = _step(timings, 'filename', names.match, file_path)
+            if named is not None and names.first:
+                return named, FILENAME_SOURCE
+
+        # One lookup by extension, then the extractors registered for it
+        creation_date, source = extract_date(file_path, timings)
+        if creation_date is not None:
+            if named is not None and names.policy == CROSS_CHECK:
+                if not names.agree(named, creation_date, file_path):
+                    return creation_date, CONFLICT
+            return creation_date, source
+        if named is not None:
+            return named, FILENAME_SOURCE
 
         # Fallback to file modification time
-        return datetime.fromtimestamp(os.path.getmtime(file_path))
+        if mtime is None:
+            mtime = _step(timings, 'mtime', os.path.getmtime, file_path)
+        return datetime.fromtimestamp(mtime), 'mtime'
     except Exception as e:
         logging.error(f"Error getting creation date for {file_path}: {e}")
-        return datetime.fromtimestamp(os.path.getmtime(file_path))
+        return datetime.fromtimestamp(mtime if mtime is not None else os.path.getmtime(file_path)), 'mtime'
+
+def get_creation_date(file_path, mtime=None):
+    """Extract creation date from file metadata.
 
-def get_destination_path(file_path, base_dir, creation_date, organize_by='date'):
+    `mtime` is the modification time from an earlier stat of the file, used
+    for the fallback instead of statting the file again.
+    """
+    return extract_creation_date(file_path, mtime)[0]
+
+def get_destination_path(file_path, base_dir, creation_date, organize_by='date', category=None):
     """Determine the destination path for a file."""
     file_name = os.path.basename(file_path)
-    file_ext = os.path.splitext(file_name)[1].lower()
 
     # Determine file type category
-    category = next(
-        (cat for cat, exts in SUPPORTED_FORMATS.items() if file_ext in exts),
-        'others'
-    )
+    if category is None:
+        category = CATEGORIES[classify(file_name)]
 
     # Create date-based directory structure
     if organize_by == 'date':
@@ -88,77 +177,1039 @@ def handle_duplicate(dest_path, counter=1):
         counter += 1
     return dest_path
 
-def organize_media(directory, organize_by='date', copy=False, dry_run=False):
-    """Main function to organize media files."""
+def _extract_dates(files, timed=False, names=None):
+    """Extract creation dates for a batch of (path, mtime) pairs, capturing errors per file.
+
+    Returns (date, error, source, timings) per file; timings are only
+    measured when `timed` is set. `names` is passed on to extract_creation_date.
+    """
+    results = []
+    for path, mtime in files:
+        timings = {} if timed else None
+        try:
+            creation_date, source = extract_creation_date(path, mtime, timings, names)
+            results.append((creation_date, None, source, timings))
+        except Exception as e:
+            results.append((None, str(e), None, timings))
+    return results
+
+def _fallback_date(item, reason, seconds, timed=False, names=None):
+    """Result for a file an isolated worker gave up on: the date in its name or its modification time."""
+    path, mtime = item
+    named = names.match(path) if names is not None else None
+    return named or datetime.fromtimestamp(mtime), None, reason, {reason: seconds}
+
+def _batches(iterable, size):
+    """Split an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _completed(result):
+    """Wrap an already computed result in a finished Future."""
+    future = Future()
+    future.set_result(result)
+    return future
+
+def _cacheable(source):
+    """Tell whether a date from this source may be cached.
+
+    Name dates depend on the policy and patterns of the run, so only dates
+    from the metadata or the modification time are cached.
+    """
+    return source not in FAILURE_REASONS and source not in (FILENAME_SOURCE, CONFLICT)
+
+def _cached_date(cache, stat_result, file_path, names=None):
+    """Return (creation date, original source) cached for a file, or (None, None).
+
+    A cached modification time is ignored when the name holds a date, and
+    a cached metadata date is cross-checked against the name if asked to.
+    """
+    named = names.match(file_path) if names is not None else None
+    creation_date, source = cache.lookup(stat_result, skip=('mtime',) if named is not None else ())
+    if creation_date is None:
+        return None, None
+    if named is not None and names.policy == CROSS_CHECK:
+        if not names.agree(named, creation_date, file_path):
+            return creation_date, CONFLICT
+    return creation_date, source or 'cache'
+
+def _lookup_batch(batch, cache, timed=False, names=None):
+    """Split a batch into results known without opening the files and the indexes still to extract.
+
+    Dates in file names are taken first when `names` trusts them first,
+    then dates in the metadata cache, reported under their original source.
+    """
+    results = [None] * len(batch)
+    misses = []
+    for i, record in enumerate(batch):
+        creation_date = None
+        timings = None
+        if names is not None and names.first:
+            if timed:
+                start = time.perf_counter()
+                creation_date = names.match(record.path)
+                timings = {'filename': time.perf_counter() - start}
+            else:
+                creation_date = names.match(record.path)
+            if creation_date is not None:
+                results[i] = (creation_date, None, FILENAME_SOURCE, timings)
+                continue
+        if cache is not None:
+            if timed:
+                start = time.perf_counter()
+                creation_date, source = _cached_date(cache, record, record.path, names)
+                timings = dict(timings or (), cache_lookup=time.perf_counter() - start)
+            else:
+                creation_date, source = _cached_date(cache, record, record.path, names)
+        if creation_date is not None:
+            results[i] = (creation_date, None, source, timings)
+        else:
+            results[i] = timings
+            misses.append(i)
+    return results, misses
+
+def _record_extraction(metrics, record, source, timings):
+    extension = os.path.splitext(record.name)[1].lower()
+    for step, seconds in timings.items():
+        metrics.record(step, seconds, extension)
+    if source is not None:
+        metrics.record_source(source, sum(timings.values()))
+
+def _report_latency(scheduler, started, files, future):
+    if not future.cancelled():
+        scheduler.record(time.perf_counter() - started, files)
+
+def _drain(pending, keep, cache, metrics=None, failures=None, sources=None):
+    """Yield results of the oldest pending batches until only `keep` remain.
+
+    The date source of every file is counted in `sources` when it is given.
+    """
+    while len(pending) > keep:
+        batch, results, misses, future = pending.popleft()
+        if misses:
+            for i, result in zip(misses, future.result()):
+                # Fold the time spent on the cache miss into the extraction timings
+                lookup = results[i]
+                if lookup and result[3] is not None:
+                    result[3].update(lookup)
+                results[i] = result
+                if result[2] in FAILURE_REASONS:
+                    # Not cached, so a later run with other limits tries again
+                    seconds = sum(result[3].values())
+                    logging.warning(f"Gave up reading {batch[i].path} after {seconds:.1f}s "
+                                    f"({result[2]}), dating it by its name or modification time")
+                    if failures is not None:
+                        failures.append({'path': batch[i].path, 'reason': result[2], 'seconds': seconds})
+                elif cache is not None and result[1] is None and _cacheable(result[2]):
+                    cache.put(batch[i], result[0], result[2])
+        for record, (creation_date, error, source, timings) in zip(batch, results):
+            if sources is not None and source is not None:
+                sources[source] = sources.get(source, 0) + 1
+            # Recorded as the file is handed on, so steps are attributed to it
+            if metrics is not None and timings is not None:
+                _record_extraction(metrics, record, source, timings)
+            yield record, creation_date, error, source, timings
+
+def iter_creation_dates(records, workers=1, executor='thread', cache=None,
+                        chunk_size=EXTRACT_BATCH_SIZE, metrics=None, failures=None, scheduler=None,
+                        names=None, sources=None, timed=False):
+    """Yield (record, creation_date, error, source, timings) for each FileRecord, in input order.
+
+    Dates found in the metadata cache are used as is. With more than one
+    worker, the remaining files are extracted on a thread or process pool
+    while results are still handed back in the original order, so callers
+    see exactly the same sequence as a serial run. The 'isolated' executor
+    (or one from isolated_executor) extracts in supervised processes even
+    with one worker; files they give up on are dated by their modification
+    time and appended to `failures` as dicts with path, reason and seconds.
+    Extraction steps are timed and recorded in `metrics` when it is given.
+    With an IOScheduler, at most `scheduler.limit` batches are in flight and
+    their latency is reported back to it. `names` (a FilenameDates) dates
+    files by their names as its policy says; with 'filename-first', those
+    files are never opened or handed to the pool. The source of every date
+    is counted in the `sources` dict when it is given. `timings` is a dict
+    of seconds per step, measured when `timed` is set or `metrics` given,
+    and None otherwise.
+    """
+    timed = timed or metrics is not None
+    pool = _make_pool(executor, workers)
+    pending = deque()
+    try:
+        for batch in _batches(records, chunk_size if pool else 1):
+            results, misses = _lookup_batch(batch, cache, timed, names)
+            future = None
+            if misses:
+                # Workers get plain (path, mtime) pairs so the mtime fallback needs no stat
+                todo = [(batch[i].path, batch[i].st_mtime) for i in misses]
+                if pool is not None:
+                    future = pool.submit(_extract_dates, todo, timed, names)
+                    if scheduler is not None:
+                        future.add_done_callback(partial(_report_latency, scheduler,
+                                                         time.perf_counter(), len(todo)))
+                else:
+                    future = _completed(_extract_dates(todo, timed, names))
+            pending.append((batch, results, misses, future))
+            # Keep a bounded window of batches in flight
+            if pool is None:
+                keep = 0
+            elif scheduler is None:
+                keep = workers * 2
+            else:
+                keep = scheduler.limit - 1
+            yield from _drain(pending, keep, cache, metrics, failures, sources)
+        yield from _drain(pending, 0, cache, metrics, failures, sources)
+    finally:
+        if pool is not None:
+            # Batches not started yet are dropped when the caller stops early
+            for _, _, _, future in pending:
+                if future is not None:
+                    future.cancel()
+            pool.shutdown()
+
+def plan_media(directory, organize_by='date', copy=False, workers=1, executor='thread',
+               cache=None, chunk_size=EXTRACT_BATCH_SIZE, dedupe='off', stats=None,
+               guard=None, live=False, reuse_names=True, link=False, metrics=None, manifest=None,
+               scheduler=None, names=None, time_extraction=False):
+    """Decide where every file goes, yielding one plan entry per visible file.
+
+    Nothing is written here. Destination names are reserved in an in-memory
+    index and moved sources are released from it, so duplicate names resolve
+    exactly as if every earlier entry had already been applied. Set `live`
+    when each entry is applied before the next one is requested; the index
+    may then forget directories and re-read them from disk. `guard` is the
+    DiscoveryGuard the caller reserves destinations with before writing.
+    Without `reuse_names`, names freed by planned moves are not handed out
+    again, so no entry depends on another one having been applied first.
+    With `link`, files are hard linked into place and the sources are kept.
+    Every step is timed into `metrics` when it is given. Directories and
+    files recorded unchanged in `manifest` (a Manifest) are skipped, and a
+    file already at its destination gets a 'skip' entry marked `organized`.
+    Entries that place a file carry the ISO creation date as `date`.
+    `scheduler` is an optional IOScheduler pacing discovery and extraction.
+    `names` is an optional FilenameDates reading dates from file names; the
+    number of files dated by each source is kept in stats['date_sources'].
+    Entries that place a file also carry the date `source`, and with
+    `time_extraction` the seconds spent extracting its date as `extract_s`.
+    """
     directory = Path(directory)
-    if not directory.exists():
-        raise ValueError(f"Directory not found: {directory}")
+    if stats is None:
+        stats = {}
+    for key in ('skipped', 'errors', 'discovered'):
+        stats.setdefault(key, 0)
+    if manifest is not None:
+        stats.setdefault('unchanged', 0)
+    failures = stats.setdefault('failed_files', [])
+    sources = stats.setdefault('date_sources', {})
+
+    # Discover files on a background thread while earlier ones are processed
+    discovery = Discovery(directory, guard, classify,
+                          prune=manifest.unchanged_dir if manifest is not None else None,
+                          order_by_inode=scheduler is not None and scheduler.order_by_inode,
+                          exclude=MANIFEST_FILES)
+    # Without live writes, planned names only exist in memory
+    index = DestinationIndex(directory, DEFAULT_MAX_DIRECTORIES if live else None)
+    # Checksums of verified copies recorded in the manifest spare rereading them
+    finder = None
+    if dedupe != 'off':
+        finder = DuplicateFinder(manifest.checksum if manifest is not None else None)
+    if finder is not None:
+        stats.setdefault('duplicates', 0)
+    action = 'link' if link else 'copy' if copy else 'move'
+    # Copies and links leave the source where it is
+    copy = copy or link
 
-    # Get list of all files
-    files = list(directory.rglob('*'))
-    files = [f for f in files if f.is_file()]
+    def visible_files():
+        for record in discovery:
+            stats['discovered'] = discovery.discovered
+            # Skip hidden files
+            if record.name.startswith('.'):
+                stats['skipped'] += 1
+                continue
+            # Organized by an earlier run and not changed since
+            if manifest is not None and manifest.unchanged_file(record):
+                stats['unchanged'] += 1
+                continue
+            yield record
 
-    # Process files with progress bar
-    with tqdm(total=len(files), desc="Processing files") as pbar:
-        stats = {'moved': 0, 'skipped': 0, 'errors': 0}
-        
-        for file_path in files:
+    # Dates are extracted concurrently; entries are planned here in file order
+    records = iter_creation_dates(visible_files(), workers, executor, cache, chunk_size, metrics,
+                                  failures, scheduler, names, sources, time_extraction)
+    try:
+        for seq, (record, creation_date, error, source, timings) in enumerate(records):
+            file_path = record.path
+            extension = os.path.splitext(record.name)[1].lower()
             try:
-                # Skip hidden files
-                if file_path.name.startswith('.'):
-                    stats['skipped'] += 1
+                if error is not None:
+                    raise RuntimeError(error)
+
+                # Get destination path
+                dest_path = timed(metrics, 'destination', get_destination_path, file_path, directory,
+                                  creation_date, organize_by, CATEGORIES[record.category],
+                                  extension=extension)
+                dated = {'date': creation_date.isoformat(), 'source': source}
+                if timings is not None:
+                    dated['extract_s'] = round(sum(timings.values()), 6)
+
+                # Already where it belongs, e.g. organized before the manifest existed
+                if dest_path == Path(file_path):
+                    yield make_entry(seq, 'skip', file_path, record=record, organized=True, **dated)
                     continue
 
-                # Get creation date and destination path
-                creation_date = get_creation_date(str(file_path))
-                dest_path = get_destination_path(str(file_path), directory, creation_date, organize_by)
+                # Look for a byte-identical file among planned and existing ones
+                original = None
+                if finder is not None:
+                    timed(metrics, 'dedupe_scan', finder.scan_directory, dest_path.parent, extension=extension)
+                    original = timed(metrics, 'dedupe', finder.find, file_path, record, extension=extension)
+                    if original is not None:
+                        stats['duplicates'] += 1
+                        logging.info(f"'{file_path}' is a duplicate of '{original[0]}'")
+
+                if original is not None and dedupe == 'skip':
+                    yield make_entry(seq, 'skip', file_path, record=record, duplicate_of=original[0],
+                                     **dated)
+                    continue
 
                 # Handle duplicates
-                if dest_path.exists():
-                    dest_path = handle_duplicate(dest_path)
-
-                # Create destination directory
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-
-                if not dry_run:
-                    if copy:
-                        shutil.copy2(file_path, dest_path)
-                    else:
-                        shutil.move(file_path, dest_path)
-                    stats['moved'] += 1
-                    logging.info(f"{'Copied' if copy else 'Moved'} '{file_path}' to '{dest_path}'")
+                dest_path = timed(metrics, 'resolve_duplicates', index.resolve, dest_path, extension=extension)
+                if not copy and reuse_names:
+                    index.discard(file_path)
+
+                if original is not None and dedupe == 'hardlink':
+                    yield make_entry(seq, 'hardlink', file_path, dest_path, record,
+                                     link=list(original), remove_src=not copy, **dated)
                 else:
-                    logging.info(f"Would {'copy' if copy else 'move'} '{file_path}' to '{dest_path}'")
+                    # Later files are compared against this one wherever it is at that point
+                    if finder is not None:
+                        finder.add((file_path,) if copy else (file_path, dest_path), record)
+                    yield make_entry(seq, action, file_path, dest_path, record, **dated)
 
             except Exception as e:
                 logging.error(f"Error processing {file_path}: {e}")
                 stats['errors'] += 1
+                yield make_entry(seq, 'error', file_path, record=record, error=str(e))
+    finally:
+        # Stops discovery and the extraction pool when planning ends early
+        records.close()
+
+    if metrics is not None and discovery.seconds is not None:
+        # Walked on its own thread, overlapping the steps of each file
+        metrics.record_run('discovery', discovery.seconds)
+    if finder is not None:
+        stats['bytes_hashed'] = finder.bytes_hashed
+
+def _check_options(directory, executor, dedupe):
+    directory = Path(directory)
+    if not directory.exists():
+        raise ValueError(f"Directory not found: {directory}")
+    if not callable(executor) and executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor: {executor}")
+    if dedupe not in DEDUPE_MODES:
+        raise ValueError(f"Unknown dedupe mode: {dedupe}")
+    return directory
+
+def manifest_settings(organize_by='date', copy=False, link=False):
+    """The settings a library manifest is kept for; see manifest.Manifest."""
+    return {'organize_by': organize_by, 'mode': 'link' if link else 'copy' if copy else 'move'}
+
+def _throttle(scheduler):
+    """The bandwidth limiter of a scheduler for execute_entry, if it has a cap."""
+    if scheduler is None or not scheduler.max_bandwidth:
+        return None
+    return scheduler.throttle
+
+def _scheduler_stats(stats, scheduler):
+    if scheduler is not None:
+        stats['storage'] = scheduler.device_class
+        stats['io_concurrency'] = scheduler.limit
+        stats['throttled_seconds'] = round(scheduler.throttled_seconds, 3)
+
+# One handled file: `action` is the planned action ('move', 'copy', 'link',
+# 'hardlink', 'skip' or 'error'), `error` is set when it failed, and
+# `processed`/`discovered` tell how far the run has come
+OrganizeEvent = namedtuple('OrganizeEvent', ['src', 'dst', 'action', 'error', 'level', 'message',
+                                             'processed', 'discovered'])
+
+class OrganizerEngine:
+    """One organize run, driven by iterating over its events.
+
+    Each file is planned (see plan_media) and then applied right away; in a
+    dry run the plan is only reported. Iterating yields an OrganizeEvent per
+    file, in discovery order. pause() and resume() may be called from any
+    thread and take effect before the next file; cancel() stops the run
+    before the next file, after which iteration ends and `cancelled` is set.
+    `stats` is updated as the run goes. With a `manifest`, organized subtrees
+    recorded by earlier runs are skipped and the files handled are recorded.
+    A `scheduler` (IOScheduler) paces extraction and caps transfer bandwidth.
+    Copies are verified by `verifier` (a transfer.Verifier) when it is given,
+    and their checksums recorded in the manifest. `names` (a FilenameDates)
+    dates files by their names. Every file is also written to `event_log`
+    (an EventLog) when it is given, with its date source and timings.
+    """
 
+    def __init__(self, directory, organize_by='date', copy=False, dry_run=False,
+                 workers=1, executor='thread', cache=None, chunk_size=EXTRACT_BATCH_SIZE,
+                 dedupe='off', link=False, metrics=None, manifest=None, scheduler=None,
+                 verifier=None, names=None, event_log=None):
+        self.directory = _check_options(directory, executor, dedupe)
+        self.organize_by = organize_by
+        self.copy = copy
+        self.dry_run = dry_run
+        self.workers = workers
+        self.executor = executor
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.dedupe = dedupe
+        self.link = link
+        self.metrics = metrics
+        self.manifest = manifest
+        self.scheduler = scheduler
+        self.verifier = verifier
+        self.names = names
+        self.event_log = event_log
+        self.stats = {'moved': 0, 'skipped': 0, 'errors': 0, 'discovered': 0}
+        self.processed = 0
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        # Wake up a paused run so it can stop
+        self._running.set()
+
+    def _wait_while_paused(self):
+        while not self._running.wait(0.1):
+            pass
+
+    def _record(self, entry, placed):
+        """Record the files an entry left in the library in the manifest."""
+        checksum = self.verifier.take(entry['dst']) if placed and self.verifier is not None else None
+        if self.manifest is None or self.dry_run:
+            return
+        record_entry(self.manifest, entry, placed, self.copy or self.link, checksum)
+
+    def _log_event(self, entry, level, error, strategy, seconds):
+        event = {'file': entry['src'], 'action': entry['action'], 'dst': entry.get('dst'),
+                 'source': entry.get('source'), 'date': entry.get('date')}
+        if 'extract_s' in entry:
+            event['extract_s'] = entry['extract_s']
+        if seconds is not None:
+            event['transfer_s'] = round(seconds, 6)
+            event['strategy'] = strategy
+        if entry.get('duplicate_of'):
+            event['duplicate_of'] = entry['duplicate_of']
+        if error is not None:
+            event['error'] = error
+        self.event_log.emit(level, event)
+
+    def _apply(self, entry, guard, made_dirs):
+        """Carry out one plan entry and describe the result as an event."""
+        file_path = entry['src']
+        action = entry['action']
+        dst = entry.get('dst')
+        location = file_path
+        error = None
+        level = logging.INFO
+        strategy = None
+        seconds = None
+        if action == 'skip':
+            if entry.get('organized'):
+                message = f"'{file_path}' is already organized"
+            else:
+                message = f"Skipping duplicate '{file_path}'"
+            self._record(entry, False)
+        elif action == 'error':
+            error = entry['error']
+            level = logging.ERROR
+            message = f"Error processing {file_path}: {error}"
+        elif self.dry_run:
+            message = f"Would {action} '{file_path}' to '{dst}'"
+        else:
+            try:
+                guard.reserve(dst)
+                start = time.perf_counter()
+                strategy = execute_entry(entry, made_dirs, self.metrics, _throttle(self.scheduler),
+                                         self.verifier)
+                seconds = time.perf_counter() - start
+                self.stats['moved'] += 1
+                count_strategy(self.stats, strategy)
+                location = dst
+                message = f"{ACTION_LABELS[action]} '{file_path}' to '{dst}'"
+                self._record(entry, True)
+            except Exception as e:
+                error = str(e)
+                level = logging.ERROR
+                message = f"Error processing {file_path}: {e}"
+                self.stats['errors'] += 1
+
+        if self.metrics is not None:
+            self.metrics.file_done(location)
+        if self.event_log is not None:
+            self._log_event(entry, level, error, strategy, seconds)
+        self.processed += 1
+        return OrganizeEvent(file_path, dst, action, error, level, message,
+                             self.processed, self.stats['discovered'])
+
+    def __iter__(self):
+        guard = DiscoveryGuard()
+        made_dirs = set()
+        entries = plan_media(self.directory, self.organize_by, self.copy, self.workers,
+                             self.executor, self.cache, self.chunk_size, self.dedupe, self.stats,
+                             guard, live=not self.dry_run, link=self.link, metrics=self.metrics,
+                             manifest=self.manifest, scheduler=self.scheduler, names=self.names,
+                             time_extraction=self.event_log is not None)
+        try:
+            while True:
+                self._wait_while_paused()
+                if self.cancelled:
+                    break
+                entry = next(entries, None)
+                if entry is None:
+                    break
+                yield self._apply(entry, guard, made_dirs)
+        finally:
+            # Stops discovery and drops extraction work that is still queued
+            entries.close()
+            if self.cancelled:
+                self.stats['cancelled'] = True
+            if self.cache is not None:
+                self.stats['cache_hits'] = self.cache.hits
+                self.stats['cache_misses'] = self.cache.misses
+            if self.manifest is not None:
+                self.stats['pruned_dirs'] = self.manifest.pruned
+            _scheduler_stats(self.stats, self.scheduler)
+            if self.verifier is not None:
+                self.stats['verified'] = self.verifier.verified
+            self.stats['peak_rss_mb'] = peak_rss_mb()
+
+def organize_media(directory, organize_by='date', copy=False, dry_run=False,
+                   workers=1, executor='thread', cache=None, chunk_size=EXTRACT_BATCH_SIZE,
+                   dedupe='off', link=False, metrics=None, manifest=None, scheduler=None,
+                   verifier=None, names=None, event_log=None):
+    """Main function to organize media files.
+
+    Runs an OrganizerEngine to completion, logging every file. `cache` is an
+    optional MetadataCache used to skip extraction for files that have not
+    changed since a previous run. Files are streamed through the pipeline
+    `chunk_size` at a time, so memory stays flat regardless of the number of
+    files. `dedupe` selects what happens to files whose content is identical
+    to one already organized: 'report' only logs them, 'skip' leaves them
+    where they are and 'hardlink' links them to the original. `link` hard
+    links files into place instead of copying them (falling back to a copy
+    across filesystems); the transfer strategy of every file is counted in
+    the stats. `metrics` is an optional Metrics collecting step latencies.
+    `manifest` is an optional Manifest of the library: subtrees and files it
+    records as organized and unchanged are skipped, so a re-run only
+    processes new or changed files. `scheduler` is an optional IOScheduler
+    adapting extraction to the storage and limiting transfer bandwidth.
+    `verifier` is an optional transfer.Verifier checking every copy before a
+    moved source is removed. `names` is an optional FilenameDates taking
+    dates from file names, before or after the metadata as its policy says.
+    With an `event_log` (an EventLog), files are written to it instead of
+    being logged one by one; only warnings and errors are still logged.
+    """
+    engine = OrganizerEngine(directory, organize_by, copy, dry_run, workers, executor, cache,
+                             chunk_size, dedupe, link, metrics, manifest, scheduler, verifier, names,
+                             event_log)
+    # Skips formatting and handing on lines no handler would show
+    log_files = event_log is None and logging.getLogger().isEnabledFor(logging.INFO)
+    with _progress_bar(desc="Processing files", unit='file') as pbar:
+        for event in engine:
+            # Planning errors were already logged by plan_media
+            if event.action != 'error' and (log_files or event.level >= logging.WARNING):
+                logging.log(event.level, event.message)
+            pbar.set_postfix(discovered=event.discovered, refresh=False)
             pbar.update(1)
 
+    return engine.stats
+
+def plan_to_file(directory, plan_path, organize_by='date', copy=False, workers=1,
+                 executor='thread', cache=None, chunk_size=EXTRACT_BATCH_SIZE, dedupe='off',
+                 link=False, metrics=None, manifest=None, scheduler=None, names=None):
+    """Write the plan for organizing `directory` to a JSON Lines file.
+
+    Files recorded unchanged in `manifest` are left out of the plan.
+    Extraction is paced by `scheduler` when it is given, and `names` dates
+    files by their names.
+    """
+    directory = _check_options(directory, executor, dedupe)
+    stats = {'planned': 0, 'skipped': 0, 'errors': 0}
+    header = {'directory': str(directory), 'organize_by': organize_by,
+              'copy': copy, 'link': link, 'dedupe': dedupe}
+
+    with _progress_bar(desc="Planning files", unit='file') as pbar:
+        def entries():
+            # Entries must not depend on each other so that shards can run concurrently
+            for entry in plan_media(directory, organize_by, copy, workers, executor, cache,
+                                    chunk_size, dedupe, stats, reuse_names=False, link=link,
+                                    metrics=metrics, manifest=manifest, scheduler=scheduler,
+                                    names=names):
+                if entry['action'] in EXECUTABLE_ACTIONS:
+                    stats['planned'] += 1
+                if metrics is not None:
+                    metrics.file_done(entry['src'])
+                pbar.update(1)
+                yield entry
+        write_plan(plan_path, header, entries())
+
+    if cache is not None:
+        stats['cache_hits'] = cache.hits
+        stats['cache_misses'] = cache.misses
+    if manifest is not None:
+        stats['pruned_dirs'] = manifest.pruned
+    _scheduler_stats(stats, scheduler)
+    stats['peak_rss_mb'] = peak_rss_mb()
+
+    return stats
+
+# Directory levels of the date part of a destination, per organize_by
+DATE_LAYOUTS = {
+    'date': '%Y-%m-%d',
+    'year_month': '%Y/%m',
+    'year_month_day': '%Y/%m/%d',
+}
+
+def is_organized(file_path, base_dir, organize_by='date'):
+    """Tell from its path alone whether a file already sits where organizing puts files."""
+    layout = DATE_LAYOUTS[organize_by]
+    parts = os.path.relpath(file_path, base_dir).split(os.sep)
+    levels = layout.count('/') + 1
+    if len(parts) != levels + 2 or parts[-2] != CATEGORIES[classify(parts[-1])]:
+        return False
+    try:
+        datetime.strptime('/'.join(parts[:levels]), layout)
+    except ValueError:
+        return False
+    return True
+
+def watch_media(directory, organize_by='date', copy=False, dry_run=False, workers=1,
+                executor='thread', cache=None, chunk_size=EXTRACT_BATCH_SIZE, link=False,
+                settle=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL, polling=False,
+                stop=None, manifest=None, scheduler=None, verifier=None, names=None,
+                event_log=None):
+    """Organize files as they arrive in `directory` until interrupted or `stop` is set.
+
+    Files already present are organized by a regular run first. After that,
+    each new or finished file is organized on its own once its size and
+    modification time have not changed for `settle` seconds, so the work per
+    arrival does not depend on the size of the tree. Files that already sit
+    in an organized location, including the ones placed here, are left
+    alone. Changes come from inotify, or from polling every `poll_interval`
+    seconds where inotify is unavailable or `polling` is set. `stop` is an
+    optional threading.Event ending the watch. Files organized are recorded
+    in `manifest` when it is given, `scheduler` paces the first run and
+    caps transfer bandwidth, `verifier` verifies copies and `names` dates
+    files by their names. Files organized go to `event_log` instead of the
+    log when it is given. Returns the stats of the run.
+    """
+    directory = _check_options(directory, executor, 'off')
+    # Watch before the first run so files arriving during it are not missed
+    watcher = open_watcher(directory, polling, poll_interval)
+    pool = None
+    try:
+        stats = organize_media(directory, organize_by, copy, dry_run, workers, executor, cache,
+                               chunk_size, link=link, manifest=manifest, scheduler=scheduler,
+                               verifier=verifier, names=names, event_log=event_log)
+        logging.info(f"Watching {directory} for new files")
+
+        debouncer = Debouncer(settle)
+        index = DestinationIndex(directory, DEFAULT_MAX_DIRECTORIES)
+        made_dirs = set()
+        action = 'link' if link else 'copy' if copy else 'move'
+        # Arrivals are extracted one at a time, isolated if requested
+        pool = _make_pool(executor, 1)
+
+        def extract_arrival(file_path, stat_result):
+            """Return (date, source, timings) like _extract_dates, on the pool if there is one."""
+            todo = [(file_path, stat_result.st_mtime)]
+            if pool is None:
+                creation_date, error, source, timings = _extract_dates(todo, False, names)[0]
+            else:
+                creation_date, error, source, timings = pool.submit(_extract_dates, todo, False,
+                                                                    names).result()[0]
+            if error is not None:
+                raise RuntimeError(error)
+            return creation_date, source, timings
+
+        def organize_arrival(file_path, stat_result):
+            # Dates in the name or the cache spare opening the file
+            creation_date = None
+            if names is not None and names.first:
+                creation_date, source = names.match(file_path), FILENAME_SOURCE
+            if creation_date is None and cache is not None:
+                creation_date, source = _cached_date(cache, stat_result, file_path, names)
+            if creation_date is None:
+                creation_date, source, timings = extract_arrival(file_path, stat_result)
+                if source in FAILURE_REASONS:
+                    seconds = sum(timings.values())
+                    logging.warning(f"Gave up reading {file_path} after {seconds:.1f}s ({source}), "
+                                    f"dating it by its name or modification time")
+                    stats['failed_files'].append({'path': file_path, 'reason': source, 'seconds': seconds})
+                elif cache is not None and _cacheable(source):
+                    cache.put(stat_result, creation_date, source)
+            sources = stats.setdefault('date_sources', {})
+            sources[source] = sources.get(source, 0) + 1
+            dest_path = get_destination_path(file_path, directory, creation_date, organize_by)
+            dest_path = index.resolve(dest_path)
+            event = {'file': file_path, 'action': action, 'dst': str(dest_path), 'source': source,
+                     'date': creation_date.isoformat()}
+            if dry_run:
+                if event_log is not None:
+                    event_log.emit(logging.INFO, event)
+                else:
+                    logging.info(f"Would {action} '{file_path}' to '{dest_path}'")
+                return
+            strategy = execute_entry(make_entry(stats['moved'], action, file_path, dest_path,
+                                                stat_result), made_dirs, throttle=_throttle(scheduler),
+                                     verifier=verifier)
+            if action == 'move':
+                index.discard(file_path)
+            checksum = verifier.take(dest_path) if verifier is not None else None
+            if manifest is not None:
+                date = creation_date.isoformat()
+                manifest.add(dest_path, os.stat(dest_path), date, checksum)
+                if action != 'move':
+                    manifest.add(file_path, os.stat(file_path), date, checksum)
+            stats['moved'] += 1
+            count_strategy(stats, strategy)
+            if event_log is not None:
+                event_log.emit(logging.INFO, dict(event, strategy=strategy))
+            else:
+                logging.info(f"{ACTION_LABELS[action]} '{file_path}' to '{dest_path}'")
+
+        while stop is None or not stop.is_set():
+            # Wake up often enough to hand on settled files without delay
+            for kind, file_path in watcher.read(min(settle, 0.5) if len(debouncer) else 1.0):
+                if kind == REMOVED:
+                    debouncer.discard(file_path)
+                    index.discard(file_path)
+                    continue
+                index.note(file_path)
+                if os.path.basename(file_path).startswith('.'):
+                    continue
+                if not is_organized(file_path, directory, organize_by):
+                    debouncer.touch(file_path)
+
+            for file_path, stat_result in debouncer.ready():
+                try:
+                    organize_arrival(file_path, stat_result)
+                except Exception as e:
+                    logging.error(f"Error processing {file_path}: {e}")
+                    if event_log is not None:
+                        event_log.emit(logging.ERROR, {'file': file_path, 'error': str(e)})
+                    stats['errors'] += 1
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")
+    finally:
+        watcher.close()
+        if pool is not None:
+            pool.shutdown()
+
+    if verifier is not None:
+        stats['verified'] = verifier.verified
+    stats['peak_rss_mb'] = peak_rss_mb()
     return stats
 
-def main():
-    parser = argparse.ArgumentParser(description='Organize media files by date and type.')
+def _add_organize_options(parser):
     parser.add_argument('directory', help='Directory to organize')
     parser.add_argument('--organize-by', choices=['date', 'year_month', 'year_month_day'],
                         default='date', help='Organization structure')
-    parser.add_argument('--copy', action='store_true', help='Copy instead of move files')
-    parser.add_argument('--dry-run', action='store_true', help='Show what would be done without making changes')
-    
-    args = parser.parse_args()
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--copy', action='store_true', help='Copy instead of move files')
+    mode.add_argument('--link', action='store_true',
+                      help='Hard link instead of copy files (copies across filesystems)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of parallel metadata extraction workers')
+    parser.add_argument('--executor', choices=sorted(EXECUTORS), default='thread',
+                        help='Worker pool type used with --workers; "isolated" runs extraction in '
+                             'supervised processes with the limits below')
+    parser.add_argument('--file-timeout', type=float, default=DEFAULT_FILE_TIMEOUT, metavar='SECONDS',
+                        help='With --executor isolated, give up on a file after this long (default: %(default)s)')
+    parser.add_argument('--max-worker-rss', type=int, default=DEFAULT_MAX_RSS_MB, metavar='MB',
+                        help='With --executor isolated, restart a worker using more memory (default: %(default)s)')
+    parser.add_argument('--failures-out', metavar='PATH',
+                        help='Write the files extraction gave up on as JSON Lines to PATH')
+    parser.add_argument('--filename-dates', choices=POLICIES + ('off',), default='off',
+                        help='Trust dates in file names (e.g. IMG_20230714_101502) before the metadata, '
+                             'after it, or only when both agree (default: %(default)s)')
+    parser.add_argument('--date-pattern', action='append', default=[], metavar='REGEX',
+                        help='Extra file name pattern with the named groups y, m, d and optionally '
+                             'H, M, S; matched against the whole path if it contains "/" (repeatable)')
+    parser.add_argument('--extra-formats', action='store_true',
+                        help='Also sort .webm as videos and .heif, .heics and .cr3 as photos '
+                             '(files organized before under others are moved)')
+    parser.add_argument('--storage', choices=('auto',) + DEVICE_CLASSES, default='auto',
+                        help='Storage class of the directory, used to pace extraction (default: detect)')
+    _add_transfer_options(parser)
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, metavar='PATH',
+                        help='Metadata cache file (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not use the metadata cache')
+    parser.add_argument('--cache-max-entries', type=int, default=DEFAULT_MAX_ENTRIES,
+                        help='Maximum number of cached entries before the oldest are evicted')
+    parser.add_argument('--dedupe', choices=DEDUPE_MODES, default='off',
+                        help='Detect byte-identical files: report them, skip them or hardlink them. '
+                             'Only files organized in this run and files already in the same '
+                             'destination folder are compared, not the rest of the library')
+    parser.add_argument('--chunk-size', type=int, default=EXTRACT_BATCH_SIZE,
+                        help='Files per extraction task; bounds the number of files held in memory')
+    parser.add_argument('--no-manifest', action='store_true',
+                        help=f'Do not use the library manifest ({MANIFEST_NAME}); process every file')
+    _add_metrics_options(parser)
+    parser.add_argument('--event-log', metavar='PATH',
+                        help='Write an event per file (destination, date source, timings, errors) '
+                             'as JSON Lines to PATH instead of logging each file')
+    parser.add_argument('--event-log-level', choices=sorted(LEVELS, key=LEVELS.get), default='info',
+                        help='Lowest level of events written to --event-log (default: %(default)s)')
+    parser.add_argument('--event-sample', type=float, default=1.0, metavar='RATE',
+                        help='Write only this fraction of the events below warning level (default: 1)')
+    parser.add_argument('--summary-only', action='store_true',
+                        help='Log no line per file, only warnings, errors and the final summary')
+    parser.add_argument('--profile', type=int, default=0, metavar='N',
+                        help='Re-run metadata extraction of the N slowest files under cProfile')
+    parser.add_argument('--profile-out', default='profiles', metavar='DIR',
+                        help='Directory for the --profile output (default: %(default)s)')
 
-    try:
-        stats = organize_media(args.directory, args.organize_by, args.copy, args.dry_run)
-        print("\nOperation completed:")
+def _add_transfer_options(parser):
+    parser.add_argument('--max-bandwidth', type=parse_rate, metavar='RATE',
+                        help='Limit copies to RATE bytes per second, e.g. 50M')
+    parser.add_argument('--verify', nargs='?', choices=VERIFY_MODES, const='readback',
+                        help='Checksum copies while they are made and fsync them; "readback" (the '
+                             'default) also re-reads and compares each destination before a moved '
+                             'source is removed')
+
+def _add_metrics_options(parser):
+    parser.add_argument('--metrics-out', metavar='PATH',
+                        help='Write per-step latency histograms as JSON to PATH')
+
+def _finish_metrics(args, metrics):
+    """Profile the slowest files if requested and write the metrics report."""
+    if getattr(args, 'profile', 0):
+        for path in metrics.profile_slowest(get_creation_date, args.profile_out, args.profile):
+            logging.info(f"Wrote profile {path}")
+    if args.metrics_out:
+        metrics.write(args.metrics_out)
+        logging.info(f"Wrote metrics to {args.metrics_out}")
+
+def _write_failures(path, failures):
+    with open(path, 'w', encoding='utf-8') as f:
+        for failure in failures:
+            f.write(json.dumps(failure) + '\n')
+    logging.info(f"Wrote {len(failures)} failed files to {path}")
+
+def _print_stats(stats):
+    print("\nOperation completed:")
+    if 'planned' in stats:
+        print(f"Files planned: {stats['planned']}")
+    else:
         print(f"Files processed: {stats['moved']}")
-        print(f"Files skipped: {stats['skipped']}")
-        print(f"Errors encountered: {stats['errors']}")
+    if 'resumed' in stats:
+        print(f"Files already done: {stats['resumed']}")
+    print(f"Files skipped: {stats['skipped']}")
+    print(f"Errors encountered: {stats['errors']}")
+    if 'unchanged' in stats:
+        print(f"Files already organized: {stats['unchanged']}")
+        print(f"Directories skipped: {stats['pruned_dirs']}")
+    if stats.get('date_sources'):
+        sources = ', '.join(f"{name}: {count}" for name, count in sorted(stats['date_sources'].items()))
+        print(f"Dates from: {sources}")
+    if stats.get('failed_files'):
+        print(f"Files dated without metadata after extraction failed: {len(stats['failed_files'])}")
+    if 'duplicates' in stats:
+        print(f"Duplicates found: {stats['duplicates']}")
+    if stats.get('strategies'):
+        strategies = ', '.join(f"{name}: {count}" for name, count in sorted(stats['strategies'].items()))
+        print(f"Transfer strategies: {strategies}")
+    if 'storage' in stats:
+        print(f"Storage: {stats['storage']} (extraction concurrency {stats['io_concurrency']})")
+    if stats.get('throttled_seconds'):
+        print(f"Throttled for bandwidth: {stats['throttled_seconds']:.1f}s")
+    if 'verified' in stats:
+        print(f"Copies verified: {stats['verified']}")
+    if 'cache_hits' in stats:
+        print(f"Cache hits: {stats['cache_hits']}")
+        print(f"Cache misses: {stats['cache_misses']}")
+    if stats.get('peak_rss_mb') is not None:
+        print(f"Peak memory: {stats['peak_rss_mb']:.1f} MB")
+
+def _run_organize(parser, args, command):
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.chunk_size < 1:
+        parser.error('--chunk-size must be at least 1')
+    if args.profile < 0:
+        parser.error('--profile must not be negative')
+    if args.file_timeout <= 0 or args.max_worker_rss < 0:
+        parser.error('--file-timeout must be positive and --max-worker-rss must not be negative')
+    if not 0 < args.event_sample <= 1:
+        parser.error('--event-sample must be greater than 0 and at most 1')
+    if command == 'plan' and args.event_log:
+        parser.error('--event-log is not supported by plan, whose entries already describe every file')
+    if args.extra_formats:
+        register_extra_formats()
+    names = None
+    if args.filename_dates != 'off':
+        try:
+            names = FilenameDates(args.filename_dates, args.date_pattern)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.date_pattern:
+        parser.error('--date-pattern needs --filename-dates')
+    if command == 'watch':
+        if args.dedupe != 'off':
+            parser.error('--watch does not support --dedupe')
+        if args.settle < 0 or args.poll_interval <= 0:
+            parser.error('--settle must not be negative and --poll-interval must be positive')
+
+    cache = None
+    manifest = None
+    metrics = None
+    event_log = None
+    stats = None
+    verifier = Verifier(args.verify) if args.verify else None
+    if args.summary_only:
+        logging.getLogger().setLevel(logging.WARNING)
+    executor = args.executor
+    if executor == 'isolated':
+        executor = isolated_executor(args.file_timeout, args.max_worker_rss)
+    if args.metrics_out or args.profile:
+        metrics = Metrics(max(DEFAULT_SLOWEST, args.profile))
+    try:
+        if args.event_log:
+            event_log = EventLog(args.event_log, LEVELS[args.event_log_level], args.event_sample,
+                                 args.summary_only)
+        if not args.no_cache:
+            cache = MetadataCache(args.cache, args.cache_max_entries)
+        if not args.no_manifest and os.path.isdir(args.directory):
+            # Runs that change nothing only read the manifest
+            readonly = command == 'plan' or args.dry_run
+            manifest = Manifest(args.directory, readonly=readonly,
+                                settings=manifest_settings(args.organize_by, args.copy, args.link))
+        scheduler = None
+        if os.path.isdir(args.directory):
+            scheduler = IOScheduler.for_directory(args.directory, args.workers, args.storage,
+                                                  args.max_bandwidth)
+        if command == 'watch':
+            stats = watch_media(args.directory, args.organize_by, args.copy, args.dry_run,
+                                args.workers, executor, cache, args.chunk_size, args.link,
+                                args.settle, args.poll_interval, args.polling, manifest=manifest,
+                                scheduler=scheduler, verifier=verifier, names=names, event_log=event_log)
+        elif command == 'plan':
+            stats = plan_to_file(args.directory, args.output, args.organize_by, args.copy,
+                                 args.workers, executor, cache, args.chunk_size, args.dedupe,
+                                 args.link, metrics, manifest, scheduler, names)
+        else:
+            stats = organize_media(args.directory, args.organize_by, args.copy, args.dry_run,
+                                   args.workers, executor, cache, args.chunk_size, args.dedupe,
+                                   args.link, metrics, manifest, scheduler, verifier, names, event_log)
+        _print_stats(stats)
+        if args.failures_out:
+            _write_failures(args.failures_out, stats.get('failed_files', []))
+        if metrics is not None:
+            _finish_metrics(args, metrics)
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        return 1
+    finally:
+        if cache is not None:
+            cache.close()
+        if manifest is not None:
+            manifest.close()
+        if event_log is not None:
+            event_log.close(stats)
+
+    return 0
+
+def _run_apply(parser, args):
+    try:
+        shard = parse_shard(args.shard)
+    except ValueError as e:
+        parser.error(str(e))
+
+    metrics = Metrics() if args.metrics_out else None
+    throttle = _throttle(IOScheduler(max_bandwidth=args.max_bandwidth))
+    verifier = Verifier(args.verify) if args.verify else None
+    manifest = None
+    try:
+        if not args.no_manifest:
+            header = read_plan_header(args.plan)
+            manifest = Manifest(header['directory'], settings=manifest_settings(
+                header['organize_by'], header.get('copy'), header.get('link')))
+        with _progress_bar(desc="Applying plan", unit='file') as pbar:
+            _, stats = apply_plan(args.plan, shard, args.journal, lambda entry: pbar.update(1), metrics,
+                                  throttle, verifier, manifest)
+        _print_stats(stats)
+        if metrics is not None:
+            _finish_metrics(args, metrics)
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         return 1
+    finally:
+        if manifest is not None:
+            manifest.close()
 
     return 0
 
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv and argv[0] == 'plan':
+        parser = argparse.ArgumentParser(prog='script_v2.py plan',
+                                         description='Write a plan for organizing media files without changing anything.')
+        _add_organize_options(parser)
+        parser.add_argument('-o', '--output', required=True, metavar='PLAN',
+                            help='Plan file to write (JSON Lines)')
+        with queued_logging():
+            return _run_organize(parser, parser.parse_args(argv[1:]), 'plan')
+
+    if argv and argv[0] == 'apply':
+        parser = argparse.ArgumentParser(prog='script_v2.py apply',
+                                         description='Execute a plan written by the plan command.')
+        parser.add_argument('plan', help='Plan file to execute')
+        parser.add_argument('--shard', default='0/1', metavar='I/N',
+                            help='Only execute entries whose sequence number modulo N is I')
+        parser.add_argument('--journal', metavar='PATH',
+                            help='Journal file (default: PLAN.journal, with a shard suffix when sharded)')
+        parser.add_argument('--no-manifest', action='store_true',
+                            help=f'Do not record the placed files in the library manifest ({MANIFEST_NAME})')
+        _add_transfer_options(parser)
+        _add_metrics_options(parser)
+        with queued_logging():
+            return _run_apply(parser, parser.parse_args(argv[1:]))
+
+    parser = argparse.ArgumentParser(description='Organize media files by date and type.',
+                                     epilog='Use "plan" and "apply" subcommands to split planning from execution.')
+    _add_organize_options(parser)
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only plan: show what would be done without making changes')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and organize new files as they arrive')
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS, metavar='SECONDS',
+                        help='With --watch, wait until a file has not changed for this long (default: %(default)s)')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, metavar='SECONDS',
+                        help='With --watch, seconds between scans when inotify is unavailable (default: %(default)s)')
+    parser.add_argument('--polling', action='store_true',
+                        help='With --watch, scan for changes instead of using inotify (e.g. on network shares)')
+    args = parser.parse_args(argv)
+    with queued_logging():
+        return _run_organize(parser, args, 'watch' if args.watch else 'organize')
+
 if __name__ == '__main__':
     exit(main())
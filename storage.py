@@ -0,0 +1,169 @@
+"""Storage-aware scheduling of extraction and transfers.
+
+The device behind a directory is classified as an SSD, a spinning disk or a
+network share. The class decides where concurrency starts and whether files
+are read in inode order; from there the number of extraction batches in
+flight follows the latency observed per file, backing off when the device
+slows down and growing again while it keeps up. An optional bandwidth cap
+throttles the bytes copied by transfers.
+"""
+import logging
+import os
+import statistics
+import threading
+import time
+
+SSD = 'ssd'
+HDD = 'hdd'
+NETWORK = 'network'
+UNKNOWN = 'unknown'
+DEVICE_CLASSES = (SSD, HDD, NETWORK, UNKNOWN)
+
+NETWORK_FILESYSTEMS = {
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', '9p', 'ceph', 'glusterfs',
+    'fuse.sshfs', 'fuse.glusterfs', 'fuse.cephfs', 'fuse.s3fs', 'fuse.rclone', 'davfs',
+}
+
+# Per device class: start at full concurrency or at one, and read files in inode order
+PROFILES = {
+    SSD: {'start_full': True, 'order_by_inode': False},
+    HDD: {'start_full': False, 'order_by_inode': True},
+    NETWORK: {'start_full': True, 'order_by_inode': False},
+    UNKNOWN: {'start_full': True, 'order_by_inode': False},
+}
+
+# Latency samples per concurrency decision
+ADJUST_EVERY = 32
+# Back off when the median latency exceeds the best one seen by this factor...
+SLOWDOWN = 2.0
+# ...and grow while it stays within this factor
+KEEPING_UP = 1.25
+# The best latency drifts up by this factor per decision, so one lucky window does not stick
+BASELINE_DRIFT = 1.05
+
+
+def _mount_of(path):
+    """Return (major:minor, filesystem type) of the mount holding `path`, or None."""
+    path = os.path.realpath(path)
+    best = None
+    try:
+        with open('/proc/self/mountinfo', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                fields, _, rest = line.partition(' - ')
+                fields = fields.split()
+                mount_point = fields[4].replace('\\040', ' ')
+                if path != mount_point and not path.startswith(mount_point.rstrip('/') + '/'):
+                    continue
+                if best is None or len(mount_point) >= len(best[0]):
+                    best = (mount_point, fields[2], rest.split()[0])
+    except (OSError, IndexError):
+        return None
+    return best[1:] if best else None
+
+
+def _read_flag(path):
+    try:
+        with open(path, encoding='ascii') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def detect_device_class(path):
+    """Classify the storage holding `path` as SSD, HDD, NETWORK or UNKNOWN (Linux only)."""
+    mount = _mount_of(path)
+    if mount is None:
+        return UNKNOWN
+    device, fs_type = mount
+    if fs_type in NETWORK_FILESYSTEMS:
+        return NETWORK
+    # Partitions keep the queue attributes on their parent disk
+    block = f'/sys/dev/block/{device}'
+    rotational = _read_flag(f'{block}/queue/rotational') or _read_flag(f'{block}/../queue/rotational')
+    if rotational == '1':
+        return HDD
+    if rotational == '0':
+        return SSD
+    return UNKNOWN
+
+
+def parse_rate(value):
+    """Parse a bandwidth such as '50M' or '1.5G' (bytes per second, binary units)."""
+    multipliers = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+    rate = value.strip().lower()
+    if rate.endswith('/s'):
+        rate = rate[:-2]
+    rate = rate.rstrip('b')
+    try:
+        if rate[-1:] in multipliers:
+            return int(float(rate[:-1]) * multipliers[rate[-1]])
+        return int(rate)
+    except ValueError:
+        raise ValueError(f"Invalid bandwidth '{value}', expected e.g. 800K, 50M or 1G") from None
+
+
+class IOScheduler:
+    """Concurrency and bandwidth control for one run on one device.
+
+    `limit` is the number of extraction batches allowed in flight, between 1
+    and `max_concurrency`; record() feeds it per-file latencies and may be
+    called from any thread. throttle() blocks as needed to keep transfers
+    under `max_bandwidth` bytes per second.
+    """
+
+    def __init__(self, device_class=UNKNOWN, max_concurrency=1, max_bandwidth=None):
+        profile = PROFILES[device_class]
+        self.device_class = device_class
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_bandwidth = max_bandwidth
+        self.order_by_inode = profile['order_by_inode']
+        self.limit = self.max_concurrency if profile['start_full'] else 1
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+        self._samples = []
+        self._baseline = None
+        self._allowance = 0.0
+        self._last_refill = time.monotonic()
+
+    @classmethod
+    def for_directory(cls, directory, max_concurrency=1, device_class='auto', max_bandwidth=None):
+        """Create a scheduler for `directory`, detecting the device class unless given."""
+        if device_class == 'auto':
+            device_class = detect_device_class(directory)
+            logging.info(f"Detected {device_class} storage for {directory}")
+        return cls(device_class, max_concurrency, max_bandwidth)
+
+    def record(self, seconds, files=1):
+        """Record the time it took to handle `files` files."""
+        if files <= 0:
+            return
+        with self._lock:
+            self._samples.append(seconds / files)
+            if len(self._samples) >= ADJUST_EVERY:
+                self._adjust(statistics.median(self._samples))
+                self._samples.clear()
+
+    def _adjust(self, latency):
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        if latency > self._baseline * SLOWDOWN and self.limit > 1:
+            self.limit = max(1, self.limit // 2)
+        elif latency <= self._baseline * KEEPING_UP and self.limit < self.max_concurrency:
+            self.limit += 1
+        self._baseline *= BASELINE_DRIFT
+
+    def throttle(self, nbytes):
+        """Wait until `nbytes` more bytes fit under the bandwidth cap."""
+        if not self.max_bandwidth:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # Allow bursts of up to one second's worth of data
+            self._allowance = min(self.max_bandwidth,
+                                  self._allowance + (now - self._last_refill) * self.max_bandwidth)
+            self._last_refill = now
+            self._allowance -= nbytes
+            wait = -self._allowance / self.max_bandwidth if self._allowance < 0 else 0.0
+        if wait > 0:
+            self.throttled_seconds += wait
+            time.sleep(wait)
@@ -0,0 +1,42 @@
+import os
+import random
+from pathlib import Path
+
+from dest_index import DestinationIndex
+from script_v2 import handle_duplicate
+
+NAMES = ['IMG_0001.jpg', 'IMG_0001 (1).jpg', 'IMG_0002.jpg', 'clip.mov', 'IMG_0001.png']
+
+
+def test_resolve_matches_handle_duplicate_probing(tmp_path):
+    rng = random.Random(0)
+    (tmp_path / 'IMG_0001 (2).jpg').write_bytes(b'')
+    index = DestinationIndex(tmp_path)
+    for _ in range(500):
+        present = sorted(os.listdir(tmp_path))
+        if present and rng.random() < 0.3:
+            # A file moved out of the directory frees its name
+            name = rng.choice(present)
+            os.remove(tmp_path / name)
+            index.discard(tmp_path / name)
+            continue
+        wanted = tmp_path / rng.choice(NAMES)
+        expected = handle_duplicate(Path(wanted))
+        resolved = index.resolve(wanted)
+        assert resolved == expected
+        resolved.write_bytes(b'')
+
+
+def test_discard_keeps_counters_of_other_names(tmp_path):
+    index = DestinationIndex(tmp_path)
+    for name in ('a.jpg', 'a (1).jpg', 'a (2).jpg', 'b.jpg', 'b (1).jpg'):
+        (tmp_path / name).write_bytes(b'')
+    assert index.resolve(tmp_path / 'a.jpg').name == 'a (3).jpg'
+    assert index.resolve(tmp_path / 'b.jpg').name == 'b (2).jpg'
+
+    os.remove(tmp_path / 'a (1).jpg')
+    index.discard(tmp_path / 'a (1).jpg')
+    assert index.resolve(tmp_path / 'a.jpg').name == 'a (1).jpg'
+    # Only the counter of the discarded name's base name starts over
+    assert index._dirs[str(tmp_path)].next_counter == {('b', '.jpg'): 3, ('a', '.jpg'): 2}
+    assert index.resolve(tmp_path / 'b.jpg').name == 'b (3).jpg'
@@ -0,0 +1,29 @@
+import discovery
+
+
+def test_inode_order_is_sorted_in_bounded_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(discovery, 'INODE_SORT_CHUNK', 4)
+    for i in range(10):
+        (tmp_path / f'f{i}.jpg').write_bytes(b'x')
+    sorted_sizes = []
+    real = discovery._in_inode_order
+
+    def in_inode_order(path, files, classify):
+        sorted_sizes.append(len(files))
+        return real(path, files, classify)
+    monkeypatch.setattr(discovery, '_in_inode_order', in_inode_order)
+
+    records = list(discovery.walk_files(tmp_path, order_by_inode=True))
+    assert sorted(r.name for r in records) == sorted(f'f{i}.jpg' for i in range(10))
+    assert max(sorted_sizes) <= 4
+    # Within each chunk, files come in inode order
+    for start in range(0, 8, 4):
+        chunk = [r.st_ino for r in records[start:start + 4]]
+        assert chunk == sorted(chunk)
+
+
+def test_exclude_skips_named_files(tmp_path):
+    (tmp_path / 'a.jpg').write_bytes(b'x')
+    (tmp_path / '.media-organizer.sqlite').write_bytes(b'x')
+    records = discovery.walk_files(tmp_path, exclude=('.media-organizer.sqlite',))
+    assert [r.name for r in records] == ['a.jpg']
@@ -0,0 +1,14 @@
+import extractors
+
+
+def test_extra_formats_are_opt_in(monkeypatch):
+    monkeypatch.setattr(extractors, '_formats', dict(extractors._formats))
+    monkeypatch.setattr(extractors, '_signatures', list(extractors._signatures))
+    others = extractors.OTHERS
+    for name in ('clip.webm', 'IMG_0001.heif', 'burst.heics', 'IMG_0001.CR3'):
+        assert extractors.category_code(name) == others
+
+    extractors.register_extra_formats()
+    assert extractors.CATEGORIES[extractors.category_code('clip.webm')] == 'videos'
+    for name in ('IMG_0001.heif', 'burst.heics', 'IMG_0001.CR3'):
+        assert extractors.CATEGORIES[extractors.category_code(name)] == 'photos'
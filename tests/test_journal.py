@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+
+from journal import Journal, apply_plan, journal_path, make_entry, write_plan
+
+
+def _plan(tmp_path, *names):
+    """Write a plan moving each source file into tmp_path/out; returns (plan, entries)."""
+    entries = []
+    for seq, name in enumerate(names):
+        src = tmp_path / 'in' / name
+        src.parent.mkdir(exist_ok=True)
+        src.write_bytes(name.encode() * 1000)
+        entries.append(make_entry(seq, 'move', src, tmp_path / 'out' / name, os.stat(src),
+                                  date='2023-07-14T10:15:02'))
+    plan = tmp_path / 'plan.jsonl'
+    write_plan(plan, {'directory': str(tmp_path), 'organize_by': 'date'}, entries)
+    return str(plan), entries
+
+
+def _journal(plan, *lines):
+    with open(journal_path(plan), 'w', encoding='utf-8') as f:
+        f.write(''.join(lines))
+
+
+def test_apply_moves_files(tmp_path):
+    plan, entries = _plan(tmp_path, 'a.jpg', 'b.jpg')
+    _, stats = apply_plan(plan)
+    assert stats['moved'] == 2
+    for entry in entries:
+        assert not os.path.exists(entry['src'])
+        assert os.path.exists(entry['dst'])
+
+
+def test_resume_skips_finished_entries(tmp_path):
+    plan, entries = _plan(tmp_path, 'a.jpg', 'b.jpg')
+    shutil.move(entries[0]['src'], _makedirs(entries[0]['dst']))
+    _journal(plan, json.dumps({'seq': 0, 'state': 'begin'}) + '\n',
+             json.dumps({'seq': 0, 'state': 'done'}) + '\n')
+    _, stats = apply_plan(plan)
+    assert stats['resumed'] == 1
+    assert stats['moved'] == 1
+
+
+def test_begun_entry_with_partial_destination_is_redone(tmp_path):
+    plan, entries = _plan(tmp_path, 'a.jpg')
+    entry = entries[0]
+    _makedirs(entry['dst'])
+    with open(entry['dst'], 'wb') as f:
+        f.write(b'partial')
+    _journal(plan, json.dumps({'seq': 0, 'state': 'begin'}) + '\n')
+    data = open(entry['src'], 'rb').read()
+
+    _, stats = apply_plan(plan)
+    assert stats['moved'] == 1
+    assert not os.path.exists(entry['src'])
+    assert open(entry['dst'], 'rb').read() == data
+
+
+def test_completed_move_with_source_left_behind(tmp_path):
+    # A cross-device move stopped after copying, before removing the source
+    plan, entries = _plan(tmp_path, 'a.jpg')
+    entry = entries[0]
+    _makedirs(entry['dst'])
+    shutil.copy2(entry['src'], entry['dst'])
+    _journal(plan, json.dumps({'seq': 0, 'state': 'begin'}) + '\n')
+
+    _, stats = apply_plan(plan)
+    assert stats['resumed'] == 1
+    assert stats['moved'] == 0
+    assert not os.path.exists(entry['src'])
+    assert os.path.exists(entry['dst'])
+
+
+def test_torn_last_journal_line_is_ignored(tmp_path):
+    plan, entries = _plan(tmp_path, 'a.jpg', 'b.jpg')
+    shutil.move(entries[0]['src'], _makedirs(entries[0]['dst']))
+    _journal(plan, json.dumps({'seq': 0, 'state': 'done'}) + '\n', '{"seq": 1, "sta')
+
+    _, stats = apply_plan(plan)
+    assert stats['resumed'] == 1
+    assert stats['moved'] == 1
+    assert os.path.exists(entries[1]['dst'])
+
+
+def test_incomplete_journal_records_are_skipped(tmp_path):
+    path = tmp_path / 'journal'
+    path.write_text('{"seq": 0}\n7\n{"state": "done"}\n{"seq": 1, "state": "done"}\n')
+    journal = Journal(str(path))
+    try:
+        assert not journal.is_done(0)
+        assert journal.is_done(1)
+    finally:
+        journal.close()
+
+
+def _makedirs(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,226 @@
+import io
+import struct
+from datetime import datetime, timedelta
+
+import pytest
+
+import media_readers
+from media_readers import UnsupportedFormatError, read_exif_date, read_video_date
+
+DATE = datetime(2023, 7, 14, 10, 15, 2)
+
+
+def _entry(tag, field_type, count, value):
+    return struct.pack('<HHI', tag, field_type, count) + value
+
+
+def _tiff(date_bytes=b'2023:07:14 10:15:02\x00', exif_offset=None, count=None):
+    """Little-endian TIFF: IFD0 pointing to an Exif IFD holding DateTimeOriginal."""
+    ifd0 = 8
+    exif_ifd = ifd0 + 2 + 12 + 4
+    date_offset = exif_ifd + 2 + 12 + 4
+    return (b'II*\x00' + struct.pack('<I', ifd0)
+            + struct.pack('<H', 1)
+            + _entry(0x8769, 4, 1, struct.pack('<I', exif_ifd if exif_offset is None else exif_offset))
+            + struct.pack('<I', 0)
+            + struct.pack('<H', 1 if count is None else count)
+            + _entry(0x9003, 2, len(date_bytes), struct.pack('<I', date_offset))
+            + struct.pack('<I', 0) + date_bytes)
+
+
+def _jpeg(tiff):
+    app1 = b'Exif\x00\x00' + tiff
+    return b'\xff\xd8\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + b'\xff\xda\x00\x02\xff\xd9'
+
+
+def _box(box_type, payload, size=None):
+    return struct.pack('>I', len(payload) + 8 if size is None else size) + box_type + payload
+
+
+def _mvhd(date):
+    created = int((date - datetime(1904, 1, 1)).total_seconds())
+    return _box(b'mvhd', struct.pack('>IIIII', 0, created, created, 1000, 1000) + bytes(80))
+
+
+def _ebml_element(element_id, payload):
+    return element_id + bytes([0x80 | len(payload)]) + payload
+
+
+def _mkv(date):
+    nanoseconds = int((date - datetime(2001, 1, 1)).total_seconds()) * 10**9
+    info = _ebml_element(b'\x15\x49\xa9\x66', _ebml_element(b'\x44\x61', struct.pack('>q', nanoseconds)))
+    return _ebml_element(b'\x1a\x45\xdf\xa3', b'') + _ebml_element(b'\x18\x53\x80\x67', info)
+
+
+def _riff_chunk(chunk_id, payload):
+    return chunk_id + struct.pack('<I', len(payload)) + payload + b'\x00' * (len(payload) & 1)
+
+
+def _avi(*chunks):
+    body = b'AVI ' + b''.join(chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def _write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+# EXIF and TIFF
+
+def test_jpeg_exif_date(tmp_path):
+    assert read_exif_date(_write(tmp_path, 'a.jpg', _jpeg(_tiff()))) == DATE
+
+
+def test_tiff_date(tmp_path):
+    assert read_exif_date(_write(tmp_path, 'a.dng', _tiff())) == DATE
+
+
+@pytest.mark.parametrize('cut', [5, 12, 30, 40])
+def test_truncated_exif_block(tmp_path, cut):
+    with pytest.raises(UnsupportedFormatError):
+        read_exif_date(_write(tmp_path, 'a.jpg', _jpeg(_tiff()[:cut])))
+
+
+def test_ifd_count_larger_than_buffer(tmp_path):
+    with pytest.raises(UnsupportedFormatError):
+        read_exif_date(_write(tmp_path, 'a.jpg', _jpeg(_tiff(count=500))))
+
+
+def test_implausible_ifd_count(tmp_path):
+    with pytest.raises(UnsupportedFormatError):
+        read_exif_date(_write(tmp_path, 'a.jpg', _jpeg(_tiff(count=60000))))
+
+
+def test_self_referencing_ifd_offset(tmp_path):
+    # The Exif IFD pointer leads back to IFD0, which holds no date
+    assert read_exif_date(_write(tmp_path, 'a.jpg', _jpeg(_tiff(exif_offset=8)))) is None
+
+
+def test_oversized_ascii_tag_is_skipped(tmp_path):
+    date_bytes = b'2023:07:14 10:15:02' + b' ' * 100 + b'\x00'
+    assert read_exif_date(_write(tmp_path, 'a.jpg', _jpeg(_tiff(date_bytes)))) is None
+
+
+@pytest.mark.parametrize('length', [0, 1])
+def test_jpeg_segment_length_below_two(tmp_path, length):
+    data = b'\xff\xd8\xff\xe1' + struct.pack('>H', length) + b'Exif\x00\x00' + _tiff()
+    with pytest.raises(UnsupportedFormatError):
+        read_exif_date(_write(tmp_path, 'a.jpg', data))
+
+
+# ISO base media (MP4/MOV)
+
+def test_mp4_mvhd_date(tmp_path):
+    data = _box(b'ftyp', b'isom\x00\x00\x00\x00') + _box(b'moov', _mvhd(DATE)) + _box(b'mdat', bytes(64))
+    assert read_video_date(_write(tmp_path, 'a.mp4', data)) == DATE
+
+
+def test_box_size_zero_extends_to_end(tmp_path):
+    moov = _mvhd(DATE)
+    data = _box(b'ftyp', b'isom\x00\x00\x00\x00') + _box(b'moov', moov, size=0)
+    assert read_video_date(_write(tmp_path, 'a.mp4', data)) == DATE
+
+
+def test_box_size_one_reads_largesize(tmp_path):
+    moov = _mvhd(DATE)
+    large = struct.pack('>I', 1) + b'moov' + struct.pack('>Q', len(moov) + 16) + moov
+    data = _box(b'ftyp', b'isom\x00\x00\x00\x00') + large
+    assert read_video_date(_write(tmp_path, 'a.mp4', data)) == DATE
+
+
+def test_box_largesize_smaller_than_header(tmp_path):
+    large = struct.pack('>I', 1) + b'moov' + struct.pack('>Q', 8) + _mvhd(DATE)
+    data = _box(b'ftyp', b'isom\x00\x00\x00\x00') + large
+    with pytest.raises(UnsupportedFormatError):
+        read_video_date(_write(tmp_path, 'a.mp4', data))
+
+
+@pytest.mark.parametrize('size', [2, 7])
+def test_box_size_smaller_than_header(tmp_path, size):
+    data = _box(b'ftyp', b'isom\x00\x00\x00\x00') + _box(b'moov', _mvhd(DATE), size=size)
+    with pytest.raises(UnsupportedFormatError):
+        read_video_date(_write(tmp_path, 'a.mp4', data))
+
+
+def test_truncated_mvhd(tmp_path):
+    data = _box(b'ftyp', b'isom\x00\x00\x00\x00') + _box(b'moov', _mvhd(DATE))[:28]
+    with pytest.raises(UnsupportedFormatError):
+        read_video_date(_write(tmp_path, 'a.mp4', data))
+
+
+def test_oversized_metadata_box(tmp_path):
+    meta = struct.pack('>I', 1 << 30) + b'meta'
+    data = _box(b'ftyp', b'isom\x00\x00\x00\x00') + _box(b'moov', meta)
+    with pytest.raises(UnsupportedFormatError):
+        read_video_date(_write(tmp_path, 'a.mp4', data))
+
+
+# EBML (Matroska/WebM)
+
+@pytest.mark.parametrize('data, expected', [
+    (b'\x81', (1, 1)),
+    (b'\x40\x02', (2, 2)),
+    (b'\x20\x00\x03', (3, 3)),
+    (b'\x01' + b'\x00' * 6 + b'\x05', (5, 8)),
+    (b'\xff', (None, 1)),
+    (b'\x7f\xff', (None, 2)),
+])
+def test_ebml_size(data, expected):
+    assert media_readers._read_ebml_size(io.BytesIO(data)) == expected
+
+
+@pytest.mark.parametrize('data', [b'', b'\x00\x00'])
+def test_invalid_ebml_size(data):
+    with pytest.raises(UnsupportedFormatError):
+        media_readers._read_ebml_size(io.BytesIO(data))
+
+
+def test_ebml_id():
+    assert media_readers._read_ebml_id(io.BytesIO(b'\x1a\x45\xdf\xa3')) == (0x1A45DFA3, 4)
+    assert media_readers._read_ebml_id(io.BytesIO(b'')) == (None, 0)
+    with pytest.raises(UnsupportedFormatError):
+        media_readers._read_ebml_id(io.BytesIO(b'\x08\x00'))
+
+
+def test_mkv_date(tmp_path):
+    assert read_video_date(_write(tmp_path, 'a.mkv', _mkv(DATE))) == DATE
+
+
+def test_mkv_truncated_element(tmp_path):
+    data = _mkv(DATE)
+    with pytest.raises(UnsupportedFormatError):
+        read_video_date(_write(tmp_path, 'a.mkv', data[:-12]))
+
+
+# RIFF (AVI)
+
+def test_avi_idit_date(tmp_path):
+    hdrl = _riff_chunk(b'LIST', b'hdrl' + _riff_chunk(b'IDIT', b'Fri Jul 14 10:15:02 2023\n\x00'))
+    data = _avi(hdrl, _riff_chunk(b'LIST', b'movi' + bytes(32)))
+    assert read_video_date(_write(tmp_path, 'a.avi', data)) == DATE
+
+
+@pytest.mark.parametrize('size', [0, 3])
+def test_riff_list_smaller_than_its_type(tmp_path, size):
+    data = _avi(b'LIST' + struct.pack('<I', size) + b'hdrl' + bytes(16))
+    with pytest.raises(UnsupportedFormatError):
+        read_video_date(_write(tmp_path, 'a.avi', data))
+
+
+def test_riff_list_larger_than_file(tmp_path):
+    data = _avi(b'LIST' + struct.pack('<I', 1000) + b'hdrl' + bytes(16))
+    with pytest.raises(UnsupportedFormatError):
+        read_video_date(_write(tmp_path, 'a.avi', data))
+
+
+def test_truncated_riff_stops_cleanly(tmp_path):
+    data = _avi(_riff_chunk(b'JUNK', bytes(8)))[:18]
+    assert read_video_date(_write(tmp_path, 'a.avi', data)) is None
+
+
+def test_mvhd_zero_creation_time():
+    assert media_readers._parse_mvhd(bytes(8)) is None
+    one_day = b'\x00' * 4 + struct.pack('>I', 86400)
+    assert media_readers._parse_mvhd(one_day) == datetime(1904, 1, 1) + timedelta(days=1)
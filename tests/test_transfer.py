@@ -0,0 +1,102 @@
+import errno
+import os
+
+import pytest
+
+import transfer
+
+SIZE = 3000000
+
+
+def _failing_copy_file_range(fail_after):
+    """os.copy_file_range that copies `fail_after` bytes, then fails with EINVAL."""
+    real = os.copy_file_range
+    copied = [0]
+
+    def copy_file_range(src_fd, dst_fd, count, offset_src=None, offset_dst=None):
+        if copied[0] >= fail_after:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        count = min(count, fail_after - copied[0])
+        sent = real(src_fd, dst_fd, count, offset_src, offset_dst)
+        copied[0] += sent
+        return sent
+    return copy_file_range
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'src.bin'
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+def _only_kernel_copy(monkeypatch, fail_after):
+    if not hasattr(os, 'copy_file_range'):
+        pytest.skip('copy_file_range is not available')
+    monkeypatch.setattr(transfer, '_disabled', set())
+    # Only the in-kernel copy is tried, so the failure can't be skipped over
+    monkeypatch.setattr(transfer, '_COPY_STRATEGIES',
+                        [s for s in transfer._COPY_STRATEGIES if s[0] == 'copy_file_range'])
+    monkeypatch.setattr(os, 'copy_file_range', _failing_copy_file_range(fail_after))
+
+
+@pytest.fixture
+def failing_kernel_copy(monkeypatch):
+    _only_kernel_copy(monkeypatch, 500000)
+
+
+def test_copy_file(tmp_path, source):
+    dst = tmp_path / 'dst.bin'
+    strategy = transfer.copy_file(source, dst)
+    assert strategy in ('reflink', 'copy_file_range', 'sendfile', 'buffered')
+    assert dst.read_bytes() == source.read_bytes()
+
+
+def test_failure_partway_through_copy_is_not_retried(tmp_path, source, failing_kernel_copy):
+    dst = tmp_path / 'dst.bin'
+    with pytest.raises(OSError) as raised:
+        transfer.copy_file(source, dst)
+    assert raised.value.errno == errno.EIO
+    assert not dst.exists()
+
+
+def test_failure_partway_through_move_keeps_source(tmp_path, source, failing_kernel_copy, monkeypatch):
+    def rename(src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    monkeypatch.setattr(os, 'rename', rename)
+    data = source.read_bytes()
+    dst = tmp_path / 'dst.bin'
+    with pytest.raises(OSError):
+        transfer.transfer(source, dst, 'move')
+    assert source.read_bytes() == data
+    assert not dst.exists()
+
+
+def test_unsupported_strategy_falls_back_before_writing(tmp_path, source, monkeypatch):
+    _only_kernel_copy(monkeypatch, 0)
+    dst = tmp_path / 'dst.bin'
+    assert transfer.copy_file(source, dst) == 'buffered'
+    assert dst.read_bytes() == source.read_bytes()
+
+
+def test_verified_move_syncs_destination_directory_before_removing_source(tmp_path, source, monkeypatch):
+    def rename(src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    monkeypatch.setattr(os, 'rename', rename)
+    events = []
+    real_sync, real_remove = transfer._fsync_directory, os.remove
+
+    def fsync_directory(path):
+        events.append(('sync', path))
+        real_sync(path)
+
+    def remove(path):
+        events.append(('remove', os.fspath(path)))
+        real_remove(path)
+    monkeypatch.setattr(transfer, '_fsync_directory', fsync_directory)
+    monkeypatch.setattr(os, 'remove', remove)
+
+    dst = tmp_path / 'out' / 'dst.bin'
+    dst.parent.mkdir()
+    assert transfer.transfer(source, dst, 'move', verifier=transfer.Verifier('checksum')) == 'verified'
+    assert events == [('sync', str(dst.parent)), ('remove', str(source))]
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from watcher import CHANGED, InotifyWatcher
+
+
+@pytest.fixture
+def inotify_watcher(tmp_path):
+    try:
+        watcher = InotifyWatcher(tmp_path)
+    except OSError:
+        pytest.skip('inotify is not available')
+    yield watcher
+    watcher.close()
+
+
+def test_rescan_reports_files_and_keeps_watch_index(tmp_path, inotify_watcher):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'b').mkdir()
+    (tmp_path / 'a' / 'b' / 'IMG_0001.jpg').write_bytes(b'x')
+    inotify_watcher.read(0.1)
+    assert set(inotify_watcher._watched) == {str(tmp_path), str(tmp_path / 'a'), str(tmp_path / 'a' / 'b')}
+
+    inotify_watcher._rescan()
+    changes = inotify_watcher.read(0)
+    assert (CHANGED, str(tmp_path / 'a' / 'b' / 'IMG_0001.jpg')) in changes
+    assert sorted(inotify_watcher._watched.values()) == sorted(inotify_watcher._paths)
+
+
+def test_removed_directory_leaves_watch_index(tmp_path, inotify_watcher):
+    (tmp_path / 'a').mkdir()
+    inotify_watcher.read(0.1)
+    os.rmdir(tmp_path / 'a')
+    inotify_watcher.read(0.1)
+    assert str(tmp_path / 'a') not in inotify_watcher._watched
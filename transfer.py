@@ -0,0 +1,274 @@
+"""Fast file transfers: rename, reflink, in-kernel copy and hard links.
+
+Every transfer reports the strategy that actually moved the data, so runs
+can show how many files were cloned, copied in the kernel or copied through
+userspace. Strategies a destination filesystem rejects once are not tried
+again for that pair of filesystems. Copies can instead be verified: the data
+is checksummed as it passes through, and optionally read back from the
+destination and compared before a moved source is removed.
+"""
+import errno
+import os
+import shutil
+
+from dedupe import content_hasher
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+TRANSFER_MODES = ('move', 'copy', 'link')
+
+# ioctl request cloning all extents of one file into another (Linux, btrfs/XFS/...)
+FICLONE = 0x40049409
+
+# Bytes requested per copy_file_range/sendfile call
+KERNEL_COPY_CHUNK = 1 << 30
+# Smaller requests when copies are throttled, so the bandwidth cap stays smooth
+THROTTLED_COPY_CHUNK = 8 << 20
+BUFFER_SIZE = 1024 * 1024
+# Buffer reused by every verified copy of a run
+VERIFY_BUFFER_SIZE = 8 << 20
+
+# checksum: hash the data while copying and fsync; readback: also re-read the destination
+VERIFY_MODES = ('checksum', 'readback')
+
+# Errors meaning "this strategy does not work here", as opposed to a real I/O error
+_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY,
+                errno.EPERM}
+if hasattr(errno, 'ENOTSUP'):
+    _UNSUPPORTED.add(errno.ENOTSUP)
+
+# (strategy, source device, destination device) combinations known not to work
+_disabled = set()
+
+
+def _unsupported(error):
+    return error.errno in _UNSUPPORTED
+
+
+def _reflink(src_fd, dst_fd, size, throttle=None):
+    # Shares extents without copying data, so there is nothing to throttle
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _kernel_copy(copy_chunk):
+    def copy(src_fd, dst_fd, size, throttle=None):
+        chunk = KERNEL_COPY_CHUNK if throttle is None else THROTTLED_COPY_CHUNK
+        offset = 0
+        while offset < size:
+            try:
+                sent = copy_chunk(src_fd, dst_fd, offset, min(chunk, size - offset))
+            except OSError as e:
+                if offset == 0 and _unsupported(e):
+                    raise
+                # Data was already written, so no other strategy may take over
+                # from a destination in an unknown state; EIO is never retried
+                raise OSError(errno.EIO, f"Copy failed after {offset} bytes: {e.strerror}") from e
+            if sent == 0:
+                break
+            offset += sent
+            if throttle is not None:
+                throttle(sent)
+    return copy
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def _buffered(src_fd, dst_fd, size, throttle=None):
+    while True:
+        block = os.read(src_fd, BUFFER_SIZE)
+        if not block:
+            break
+        if throttle is not None:
+            throttle(len(block))
+        view = memoryview(block)
+        while view:
+            view = view[os.write(dst_fd, view):]
+
+
+def _stream(fd, buffer, digest, dst_fd=None, throttle=None):
+    """Hash a file from its current offset, copying it to `dst_fd` on the way if given."""
+    f = open(fd, 'rb', buffering=0, closefd=False)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        n = f.readinto(buffer)
+        if not n:
+            return total
+        digest.update(view[:n])
+        if dst_fd is not None:
+            if throttle is not None:
+                throttle(n)
+            block = view[:n]
+            while block:
+                block = block[os.write(dst_fd, block):]
+        total += n
+
+
+class Verifier:
+    """Verified copies for one run, with the checksums they produced.
+
+    Copies made with a Verifier bypass reflinks and in-kernel copies: the
+    data streams through one reusable buffer and a hasher (the digest used
+    by dedupe), and the destination is fsynced before the copy counts as
+    done. In 'readback' mode the destination is then read again, from the
+    disk where the page cache can be dropped, and its digest compared. Not
+    thread-safe; use one Verifier per thread or process.
+    """
+
+    def __init__(self, mode='readback'):
+        if mode not in VERIFY_MODES:
+            raise ValueError(f"Unknown verify mode: {mode}")
+        self.mode = mode
+        self.verified = 0
+        self.mismatches = 0
+        self.bytes_read_back = 0
+        self._buffer = bytearray(VERIFY_BUFFER_SIZE)
+        self._checksums = {}
+
+    def copy(self, src_fd, dst_fd, dst, throttle=None):
+        """Copy between open files, fsync and verify; raises OSError on a mismatch."""
+        digest = content_hasher()
+        _stream(src_fd, self._buffer, digest, dst_fd, throttle)
+        os.fsync(dst_fd)
+        checksum = digest.hexdigest()
+        if self.mode == 'readback':
+            with open(dst, 'rb', buffering=0) as f:
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+                readback = content_hasher()
+                self.bytes_read_back += _stream(f.fileno(), self._buffer, readback)
+            if readback.hexdigest() != checksum:
+                self.mismatches += 1
+                raise OSError(errno.EIO, f"Verification failed, {dst} differs from its source")
+        self.verified += 1
+        self._checksums[os.fspath(dst)] = checksum
+
+    def take(self, dst):
+        """Return and forget the hex checksum of a verified copy, or None."""
+        return self._checksums.pop(os.fspath(dst), None)
+
+
+def _fsync_directory(path):
+    """Make a new entry in the directory `path` durable (a no-op where directories can't be opened)."""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Tried in order; the buffered copy always works
+_COPY_STRATEGIES = []
+if fcntl is not None and hasattr(fcntl, 'ioctl') and os.name == 'posix':
+    _COPY_STRATEGIES.append(('reflink', _reflink))
+if hasattr(os, 'copy_file_range'):
+    _COPY_STRATEGIES.append(('copy_file_range', _kernel_copy(_copy_file_range)))
+if hasattr(os, 'sendfile') and os.name == 'posix':
+    _COPY_STRATEGIES.append(('sendfile', _kernel_copy(_sendfile)))
+
+
+def copy_file(src, dst, throttle=None, verifier=None):
+    """Copy a file with its metadata (like shutil.copy2) using the fastest strategy.
+
+    The destination must not exist. `throttle` is called with the number of
+    bytes after every chunk copied and may block to limit bandwidth. With a
+    `verifier` the copy is verified instead (strategy 'verified') and a
+    destination that fails verification is removed. Returns the name of the
+    strategy used.
+    """
+    src_fd = os.open(src, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        src_stat = os.fstat(src_fd)
+        size = src_stat.st_size
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            devices = (src_stat.st_dev, os.fstat(dst_fd).st_dev)
+            used = None
+            if verifier is not None:
+                verifier.copy(src_fd, dst_fd, dst, throttle)
+                used = 'verified'
+            else:
+                for name, strategy in _COPY_STRATEGIES:
+                    if (name,) + devices in _disabled:
+                        continue
+                    try:
+                        strategy(src_fd, dst_fd, size, throttle)
+                    except OSError as e:
+                        if not _unsupported(e):
+                            raise
+                        _disabled.add((name,) + devices)
+                        continue
+                    used = name
+                    break
+            if used is None:
+                _buffered(src_fd, dst_fd, size, throttle)
+                used = 'buffered'
+        except BaseException:
+            os.close(dst_fd)
+            os.remove(dst)
+            raise
+        os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+    shutil.copystat(src, dst)
+    return used
+
+
+def transfer(src, dst, mode='move', throttle=None, verifier=None):
+    """Move, copy or hard link `src` to `dst`, which must not exist yet.
+
+    Moves are renames when both paths are on the same filesystem and a copy
+    followed by removing the source otherwise. Links fall back to a copy
+    when the destination is on another filesystem or does not support hard
+    links. Copies pass `throttle` and `verifier` on to copy_file; a moved
+    source is only removed once its copy has been verified and the
+    destination directory synced. Returns the name
+    of the strategy used.
+    """
+    src, dst = os.fspath(src), os.fspath(dst)
+    if os.path.lexists(dst):
+        raise FileExistsError(f"Destination already exists: {dst}")
+
+    if mode == 'move':
+        try:
+            os.rename(src, dst)
+            return 'rename'
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        if os.path.islink(src):
+            shutil.move(src, dst)
+            return 'buffered'
+        strategy = copy_file(src, dst, throttle, verifier)
+        if verifier is not None:
+            # The copy's data is synced; its name must be too before the source goes
+            _fsync_directory(os.path.dirname(os.path.abspath(dst)))
+        os.remove(src)
+        return strategy
+
+    if mode == 'link':
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError as e:
+            if not _unsupported(e):
+                raise
+        return copy_file(src, dst, throttle, verifier)
+
+    if mode == 'copy':
+        return copy_file(src, dst, throttle, verifier)
+
+    raise ValueError(f"Unknown transfer mode: {mode}")
@@ -0,0 +1,287 @@
+"""Change notification for a directory tree, with debouncing of files being written.
+
+InotifyWatcher uses Linux inotify through ctypes, so each new or finished
+file is reported individually without walking the tree. Where inotify is
+not available, PollingWatcher compares directory modification times and
+only lists directories that changed. Both report paths that may have
+changed; a Debouncer then waits until a file's size and modification time
+stop changing before it is handed on.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+# inotify event flags (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+# Kinds of reported changes
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+# Seconds a file's size and modification time must stay the same
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+def _walk_directories(directory):
+    """Yield `directory` and every directory below it, without following symlinks."""
+    stack = [directory]
+    while stack:
+        path = stack.pop()
+        yield path
+        try:
+            with os.scandir(path) as it:
+                stack.extend(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+        except OSError as e:
+            logging.warning(f"Could not scan {path}: {e}")
+
+
+def _list_files(directory):
+    try:
+        with os.scandir(directory) as it:
+            return [entry.path for entry in it if entry.is_file(follow_symlinks=False)]
+    except OSError:
+        return []
+
+
+class InotifyWatcher:
+    """Reports changes below a directory through inotify (Linux only).
+
+    Every directory gets its own watch; directories created later are
+    watched as they appear, and files that landed in them before the watch
+    existed are reported right away. If the kernel queue overflows, the
+    whole tree is reported once.
+    """
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name or 'libc.so.6', use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.directory = os.fspath(directory)
+        self._paths = {}
+        # The reverse of _paths, so rescans look paths up in O(1)
+        self._watched = {}
+        self._pending = []
+        for path in _walk_directories(self.directory):
+            self._add_watch(path)
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                logging.error(f"Out of inotify watches at {path}; raise fs.inotify.max_user_watches")
+            elif error not in (errno.ENOENT, errno.ENOTDIR):
+                logging.warning(f"Could not watch {path}: {os.strerror(error)}")
+            return False
+        self._paths[wd] = path
+        self._watched[path] = wd
+        return True
+
+    def _watch_new_directory(self, path):
+        # Files and subdirectories may have appeared before the watch did
+        for subdir in _walk_directories(path):
+            if self._add_watch(subdir):
+                self._pending.extend((CHANGED, file_path) for file_path in _list_files(subdir))
+
+    def _rescan(self):
+        logging.warning("Change queue overflowed; rescanning the whole tree")
+        for path in _walk_directories(self.directory):
+            if path not in self._watched:
+                self._add_watch(path)
+            self._pending.extend((CHANGED, file_path) for file_path in _list_files(path))
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds and return a list of (kind, path) changes."""
+        changes, self._pending = self._pending, []
+        if changes:
+            timeout = 0
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return changes
+        try:
+            data = os.read(self._fd, _READ_SIZE)
+        except BlockingIOError:
+            return changes
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self._rescan()
+                continue
+            parent = self._paths.get(wd)
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                if parent is not None and self._watched.get(parent) == wd:
+                    del self._watched[parent]
+                continue
+            if parent is None or not name:
+                continue
+            path = os.path.join(parent, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_new_directory(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                changes.append((REMOVED, path))
+            else:
+                changes.append((CHANGED, path))
+        changes.extend(self._pending)
+        self._pending = []
+        return changes
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """Reports changes by re-listing directories whose modification time changed.
+
+    A directory's modification time changes when entries are added, removed
+    or renamed, so each poll costs one stat per directory plus a listing of
+    the directories that changed. Files that are only rewritten in place are
+    not noticed.
+    """
+
+    def __init__(self, directory, interval=DEFAULT_POLL_INTERVAL):
+        self.directory = os.fspath(directory)
+        self.interval = interval
+        self._dirs = {}
+        self._files = {}
+        self._next_poll = 0.0
+        for path in _walk_directories(self.directory):
+            self._snapshot(path)
+
+    def _snapshot(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        self._dirs[path] = mtime
+        files = set(_list_files(path))
+        previous = self._files.get(path, set())
+        self._files[path] = files
+        return files, previous
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds and return a list of (kind, path) changes."""
+        delay = self._next_poll - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            if delay > timeout:
+                return []
+        self._next_poll = time.monotonic() + self.interval
+
+        changes = []
+        for path, mtime in list(self._dirs.items()):
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                del self._dirs[path]
+                changes.extend((REMOVED, file_path) for file_path in self._files.pop(path, ()))
+                continue
+            if current == mtime:
+                continue
+            files, previous = self._snapshot(path) or (set(), set())
+            changes.extend((CHANGED, file_path) for file_path in files - previous)
+            changes.extend((REMOVED, file_path) for file_path in previous - files)
+            # New subdirectories are tracked from now on, with their files
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False) and entry.path not in self._dirs:
+                        for subdir in _walk_directories(entry.path):
+                            snapshot = self._snapshot(subdir)
+                            if snapshot:
+                                changes.extend((CHANGED, file_path) for file_path in snapshot[0])
+        return changes
+
+    def close(self):
+        pass
+
+
+def open_watcher(directory, polling=False, interval=DEFAULT_POLL_INTERVAL):
+    """Return an InotifyWatcher, or a PollingWatcher if inotify is unavailable or `polling` is set."""
+    if not polling:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify unavailable ({e}); polling every {interval:g}s instead")
+    return PollingWatcher(directory, interval)
+
+
+class Debouncer:
+    """Holds back files until their size and modification time have settled.
+
+    touch() is O(1) per change event; ready() stats every file still
+    pending, which is the number of files being written, not the size of
+    the tree.
+    """
+
+    def __init__(self, settle=DEFAULT_SETTLE_SECONDS):
+        self.settle = settle
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, path):
+        """Note that a file changed; it becomes ready once it stops changing."""
+        self._pending[path] = (None, time.monotonic())
+
+    def discard(self, path):
+        self._pending.pop(path, None)
+
+    def ready(self):
+        """Return (path, stat_result) for every pending file that has settled."""
+        now = time.monotonic()
+        settled = []
+        for path, (fingerprint, since) in list(self._pending.items()):
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            current = (stat_result.st_size, stat_result.st_mtime_ns)
+            if current != fingerprint:
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self._pending[path]
+                settled.append((path, stat_result))
+        return settled